@@ -0,0 +1,361 @@
+import numpy as np
+
+from forecast import Series, TimeAxis
+
+# Decimals of computed values, as in Forecast API responses
+DECIMALS = 1
+
+# Window of the trailing precipitation sum, in hours
+ROLLING_PRECIPITATION_HOURS = 24
+
+# Hourly variables computed from the cached hourly series. They are added
+# to a response only when named in its "variables" selection.
+DERIVED_HOURLY = ("heat_index", "wind_chill", "precipitation_24h")
+
+# Daily variable: (hourly variable it is computed from, reduction). The
+# hourly series of a day are reduced in local time (the Forecast API is
+# always asked for timezone=auto), so days follow the location's calendar.
+DAILY_AGGREGATES = {
+    "temperature_2m_max": ("temperature_2m", "max"),
+    "temperature_2m_min": ("temperature_2m", "min"),
+    # WMO codes grow with severity; the Forecast API reports the most
+    # severe condition of the day
+    "weather_code": ("weather_code", "max"),
+    "wind_speed_10m_max": ("wind_speed_10m", "max"),
+    "wind_direction_10m_dominant": ("wind_direction_10m", "direction"),
+    "precipitation_sum": ("precipitation", "sum"),
+    "precipitation_probability_max": ("precipitation_probability", "max"),
+    "relative_humidity_2m_max": ("relative_humidity_2m", "max"),
+    "uv_index_max": ("uv_index", "max"),
+    "heat_index_max": ("heat_index", "max"),
+    "wind_chill_min": ("wind_chill", "min"),
+}
+
+# Daily variables the Forecast API does not have, added to a response only
+# when named in its "variables" selection
+DERIVED_DAILY = ("heat_index_max", "wind_chill_min")
+
+# Input whose unit a derived hourly variable is reported in
+_UNIT_SOURCES = {"heat_index": "temperature_2m", "wind_chill": "temperature_2m", "precipitation_24h": "precipitation"}
+
+
+def numeric(column):
+    """
+    :param column: Column of a Series (see forecast.encode_column)
+    :return: numpy array of the values with NaN for gaps, or None if the
+        column is not a numeric series
+    """
+    if isinstance(column, np.ndarray):
+        return column
+    if not isinstance(column, list):
+        return None
+    try:
+        return np.array([np.nan if v is None else v for v in column], dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+
+
+def heat_index(temperature, humidity):
+    """
+    NWS heat index: Steadman's approximation, replaced by the Rothfusz
+    regression (with its low and high humidity adjustments) where that
+    approximation reaches 80 °F. Defined from 80 °F (26.7 °C); below that,
+    the air temperature.
+
+    :param temperature: Air temperatures in °C
+    :param humidity: Relative humidities in %
+    :return: Heat index in °C
+    """
+    t = temperature * 1.8 + 32
+    rh = humidity
+    with np.errstate(invalid="ignore"):
+        index = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+        regression = (index + t) / 2 >= 80
+        if regression.any():
+            t2 = t * t
+            full = (
+                -42.379 + 2.04901523 * t - 6.83783e-3 * t2
+                + rh * (10.14333127 - 0.22475541 * t + 1.22874e-3 * t2)
+                + rh * rh * (-5.481717e-2 + 8.5282e-4 * t - 1.99e-6 * t2)
+            )
+            dry = (rh < 13) & (t >= 80) & (t <= 112)
+            if dry.any():
+                full = full - np.where(dry, (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17), 0)
+            humid = (rh > 85) & (t >= 80) & (t <= 87)
+            if humid.any():
+                full = full + np.where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+            index = np.where(regression, full, index)
+        return np.where(t >= 80, (index - 32) / 1.8, temperature)
+
+
+def wind_chill(temperature, wind_speed):
+    """
+    Wind chill index of Environment Canada and the NWS, defined at or below
+    10 °C with wind above 4.8 km/h; elsewhere the air temperature.
+
+    :param temperature: Air temperatures in °C
+    :param wind_speed: Wind speeds at 10 m in km/h
+    :return: Wind chill in °C
+    """
+    with np.errstate(invalid="ignore"):
+        power = np.power(np.clip(wind_speed, 0, None), 0.16)
+        chill = 13.12 + 0.6215 * temperature - 11.37 * power + 0.3965 * temperature * power
+        return np.where((temperature <= 10) & (wind_speed > 4.8), chill, temperature)
+
+
+def rolling_sum(values, times, hours=ROLLING_PRECIPITATION_HOURS):
+    """
+    Trailing sum over a time window, by time rather than by step count so
+    that irregular (daylight saving) axes are summed correctly.
+
+    :param values: Values of the time steps, NaN for gaps
+    :param times: Their times as datetime64, ascending
+    :param hours: Window length; a step sums the values of the steps less
+        than ``hours`` before it, itself included
+    :return: Window sums, NaN where the window holds no values
+    """
+    missing = np.isnan(values)
+    totals = np.concatenate(([0.0], np.cumsum(np.where(missing, 0.0, values))))
+    counts = np.concatenate(([0], np.cumsum(~missing)))
+    first = np.searchsorted(times, times - np.timedelta64(hours, "h"), side="right")
+    last = np.arange(1, len(values) + 1)
+    return np.where(counts[last] > counts[first], totals[last] - totals[first], np.nan)
+
+
+def _float(column):
+    values = numeric(column)
+    return None if values is None else values.astype(np.float64, copy=False)
+
+
+def derived_hourly(series, names, times=None):
+    """
+    :param series: Hourly Series in canonical units
+    :param names: Names of DERIVED_HOURLY variables to compute
+    :param times: Result of series.stamps(), if already known
+    :return: Dict mapping each computable name to a float array, rounded to
+        DECIMALS; names whose inputs the series lacks are left out
+    """
+    columns = series.columns
+    temperature = _float(columns.get("temperature_2m"))
+    result = {}
+    if "heat_index" in names and temperature is not None:
+        humidity = _float(columns.get("relative_humidity_2m"))
+        if humidity is not None:
+            result["heat_index"] = heat_index(temperature, humidity)
+    if "wind_chill" in names and temperature is not None:
+        wind_speed = _float(columns.get("wind_speed_10m"))
+        if wind_speed is not None:
+            result["wind_chill"] = wind_chill(temperature, wind_speed)
+    if "precipitation_24h" in names:
+        precipitation = _float(columns.get("precipitation"))
+        times = series.stamps() if times is None else times
+        if precipitation is not None and times is not None:
+            result["precipitation_24h"] = rolling_sum(precipitation, times)
+    return {name: np.round(values, DECIMALS) for name, values in result.items()}
+
+
+def day_starts(times):
+    """
+    :param times: Local times of an hourly series as datetime64, ascending
+    :return: Tuple of (days as datetime64[D], index of each day's first
+        time step)
+    """
+    days = times.astype("datetime64[D]")
+    starts = np.flatnonzero(np.concatenate(([True], days[1:] != days[:-1])))
+    return days[starts], starts
+
+
+def circular_mean(degrees, weights, starts):
+    """
+    Mean direction per group as the direction of the summed unit vectors,
+    weighted (e.g. by wind speed) so calm hours barely count. Groups whose
+    weights are all zero fall back to the unweighted mean.
+
+    :param degrees: Directions in degrees, NaN for gaps
+    :param weights: Weight per direction, or None
+    :param starts: Index of each group's first element
+    :return: Mean direction per group in [0, 360), NaN where a group has no
+        directions
+    """
+    radians = np.deg2rad(degrees)
+    valid = ~np.isnan(radians)
+    sin = np.where(valid, np.sin(radians), 0.0)
+    cos = np.where(valid, np.cos(radians), 0.0)
+    sin_sum = np.add.reduceat(sin, starts)
+    cos_sum = np.add.reduceat(cos, starts)
+    if weights is not None:
+        weights = np.where(valid & ~np.isnan(weights), weights, 0.0)
+        weighted_sin = np.add.reduceat(sin * weights, starts)
+        weighted_cos = np.add.reduceat(cos * weights, starts)
+        calm = (weighted_sin == 0) & (weighted_cos == 0)
+        sin_sum = np.where(calm, sin_sum, weighted_sin)
+        cos_sum = np.where(calm, cos_sum, weighted_cos)
+    mean = np.rad2deg(np.arctan2(sin_sum, cos_sum)) % 360
+    return np.where(np.add.reduceat(valid, starts) > 0, mean, np.nan)
+
+
+def _reduce(matrix, reduction, starts):
+    """
+    :param matrix: float64 array, one hourly variable per row
+    :param reduction: "max", "min" or "sum"
+    :param starts: Index of each day's first time step
+    :return: Array with one row per variable and one column per day, NaN
+        where a day has no values
+    """
+    # fmax and fmin skip NaN unless a whole day is missing
+    if reduction == "max":
+        return np.fmax.reduceat(matrix, starts, axis=1)
+    if reduction == "min":
+        return np.fmin.reduceat(matrix, starts, axis=1)
+    missing = np.isnan(matrix)
+    sums = np.round(np.add.reduceat(np.where(missing, 0.0, matrix), starts, axis=1), DECIMALS)
+    return np.where(np.add.reduceat(~missing, starts, axis=1) > 0, sums, np.nan)
+
+
+def _column(values, like):
+    """
+    :return: Reduced ``values`` as integers where the hourly input ``like``
+        is an integer array (or a direction) and no day is missing
+    """
+    if like.dtype.kind in "iu" and not np.isnan(values).any():
+        return values.astype(like.dtype)
+    return values
+
+
+def daily_from_hourly(series, hourly_units=None, extra=(), base=True):
+    """
+    Compute the daily view from an hourly series in one vectorized pass:
+    the variables sharing a reduction are stacked into one matrix and
+    reduced over the day boundaries with a single ufunc ``reduceat``.
+
+    :param series: Hourly Series in canonical units
+    :param hourly_units: The forecast's "hourly_units" map, if any
+    :param extra: Names of DERIVED_DAILY variables to add
+    :param base: False to compute only the ``extra`` variables
+    :return: Tuple of (daily Series, "daily_units" map or None), or None if
+        the series has no usable time axis
+    """
+    times = series.stamps()
+    if times is None:
+        return None
+    days, starts = day_starts(times)
+    wanted = [name for name in DAILY_AGGREGATES if name in extra or base and name not in DERIVED_DAILY]
+    derived = derived_hourly(series, {DAILY_AGGREGATES[name][0] for name in wanted}, times)
+    wind_speed = _float(series.columns.get("wind_speed_10m"))
+
+    inputs = {}
+    for name in wanted:
+        source, reduction = DAILY_AGGREGATES[name]
+        values = derived.get(source)
+        if values is None:
+            values = numeric(series.columns.get(source))
+        if values is not None and len(values) == len(times):
+            inputs[name] = values
+
+    # One reduceat per reduction over all the variables it applies to
+    reduced = {}
+    for reduction in ("max", "min", "sum"):
+        names = [name for name in inputs if DAILY_AGGREGATES[name][1] == reduction]
+        if names:
+            matrix = np.array([inputs[name] for name in names], dtype=np.float64)
+            reduced.update(zip(names, _reduce(matrix, reduction, starts)))
+    for name in inputs:
+        if DAILY_AGGREGATES[name][1] == "direction":
+            if wind_speed is not None and len(wind_speed) != len(times):
+                wind_speed = None
+            # Whole degrees, as the Forecast API reports them
+            reduced[name] = np.rint(circular_mean(inputs[name].astype(np.float64), wind_speed, starts))
+
+    day_strings = np.datetime_as_string(days, unit="D").tolist()
+    axis = TimeAxis.encode(day_strings)
+    columns = {"time": None if axis is not None else day_strings}
+    units = {"time": "iso8601"} if hourly_units is not None else None
+    for name in inputs:
+        source = DAILY_AGGREGATES[name][0]
+        like = np.empty(0, np.int16) if DAILY_AGGREGATES[name][1] == "direction" else inputs[name]
+        columns[name] = _column(reduced[name], like)
+        if units is not None:
+            label = hourly_units.get(_UNIT_SOURCES.get(source, source))
+            if label is not None:
+                units[name] = label
+    return Series(axis, columns), units
+
+
+def _merge_daily(forecast, daily, computed, computed_units):
+    """
+    Add computed daily columns to the forecast's upstream daily series,
+    aligned on its days (NaN for days the hourly series does not cover).
+
+    :return: A copy of ``forecast`` with the merged series and units
+    """
+    days = daily.stamps()
+    computed_days = computed.stamps()
+    if days is None or computed_days is None:
+        return forecast
+    index = np.minimum(np.searchsorted(computed_days, days), len(computed_days) - 1)
+    found = computed_days[index] == days
+    columns = dict(daily.columns)
+    for name, values in computed.columns.items():
+        if name == "time":
+            continue
+        if found.all():
+            columns[name] = values[index]
+        else:
+            merged = np.full(len(days), np.nan)
+            merged[found] = values[index[found]]
+            columns[name] = merged
+    extra = {}
+    units = forecast.extra.get("daily_units")
+    if isinstance(units, dict) and computed_units is not None:
+        extra["daily_units"] = {**units, **{name: label for name, label in computed_units.items() if name != "time"}}
+    return forecast.replace({"daily": Series(daily.time, columns)}, extra)
+
+
+def derive_views(forecast, forecast_type, variables=None):
+    """
+    Add the computed series a view needs to a cached forecast, without an
+    upstream call:
+
+    - the daily view, computed from the hourly series when the forecast has
+      no daily series
+    - DERIVED_DAILY variables named in ``variables``, added to the daily
+      series (upstream or computed)
+    - DERIVED_HOURLY variables named in ``variables``, for the hourly view
+
+    :param forecast: CompactForecast in canonical units
+    :param forecast_type: "hourly" or "daily", the view to return
+    :param variables: Variables selected by the request's ResponseShape, or
+        None for the default set
+    :return: ``forecast`` itself, or a copy with the computed series
+    """
+    hourly = forecast.series.get("hourly")
+    if hourly is None:
+        return forecast
+    variables = variables or frozenset()
+    units = forecast.extra.get("hourly_units")
+    if forecast_type == "daily":
+        extra = [name for name in DERIVED_DAILY if name in variables]
+        upstream_daily = forecast.series.get("daily")
+        if upstream_daily is not None and not extra:
+            return forecast
+        daily = daily_from_hourly(
+            hourly, units if isinstance(units, dict) else None, extra, base=upstream_daily is None
+        )
+        if daily is None:
+            return forecast
+        series, daily_units = daily
+        if upstream_daily is not None:
+            return _merge_daily(forecast, upstream_daily, series, daily_units)
+        return forecast.replace({"daily": series}, {} if daily_units is None else {"daily_units": daily_units})
+    names = [name for name in DERIVED_HOURLY if name in variables]
+    if forecast_type != "hourly" or not names:
+        return forecast
+    columns = derived_hourly(hourly, names)
+    if not columns:
+        return forecast
+    extra = {}
+    if isinstance(units, dict):
+        extra["hourly_units"] = {
+            **units, **{name: units[_UNIT_SOURCES[name]] for name in columns if _UNIT_SOURCES[name] in units}
+        }
+    return forecast.replace({"hourly": Series(hourly.time, {**hourly.columns, **columns})}, extra)
@@ -1,8 +1,33 @@
+import atexit
+import json
+import math
 import os
-import requests
-from flask import Flask, render_template, request, jsonify
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlencode
+from flask import Flask, Response, g, redirect, render_template, request, jsonify
 from dotenv import load_dotenv
-from functools import lru_cache
+from flask_limiter import ApplicationLimit, Limiter
+from flask_limiter.util import get_remote_address
+from limits import parse_many
+from werkzeug.http import http_date, parse_date
+import numpy as np
+
+from aggregate import derive_views
+from archive import ARCHIVE_SECTIONS, ForecastArchive, decode, latest_values
+from cache import ForecastCache, create_backend
+from forecast import CompactForecast, ResponseShape, compact_forecast
+from metrics import SERVER_TIMING, RequestTimer, registry, timed
+from refresh import BackgroundRefresher
+from resilience import UpstreamUnavailableError
+from serialization import EncodedResponse, ResponseMemo, dumps
+from snapshot import SnapshotWriter, read_snapshot
+from geocoding import GeocodingIndex, Place, normalize
+from spatial import SpatialKeyer
+from units import canonical_params, convert_units, resolve_units
+import upstream
 
 load_dotenv()
 
@@ -10,64 +35,898 @@ app = Flask(__name__)
 
 OPEN_METEO_BASE = os.getenv("OPEN_METEO_BASE")
 GEOCODING_API = os.getenv("GEOCODING_API")
+
+# Forecast cache configuration. The "sqlite" backend stores entries in a file
+# shared by all workers on the node; "memory" keeps a per-process LRU.
+FORECAST_CACHE_BACKEND = os.getenv("FORECAST_CACHE_BACKEND", "memory")
+FORECAST_CACHE_PATH = os.getenv("FORECAST_CACHE_PATH", "forecast_cache.sqlite3")
+FORECAST_CACHE_MAXSIZE = int(os.getenv("FORECAST_CACHE_MAXSIZE", "128"))
+FORECAST_CACHE_MAX_BYTES = int(os.getenv("FORECAST_CACHE_MAX_BYTES", "0")) or None
+FORECAST_TTLS = {
+    name: int(os.getenv(f"FORECAST_TTL_{name.upper()}"))
+    for name in ("current", "hourly", "daily")
+    if os.getenv(f"FORECAST_TTL_{name.upper()}")
+}
+# Stale-while-revalidate window past the TTL, and the background refresh of
+# the FORECAST_REFRESH_TOP_N most requested locations (0 disables it).
+FORECAST_STALE_TTL = int(os.getenv("FORECAST_STALE_TTL", "600"))
+# Seconds past expiry during which a forecast is still served if fetching a
+# new one fails, e.g. while the upstream circuit breaker is open
+FORECAST_STALE_IF_ERROR = int(os.getenv("FORECAST_STALE_IF_ERROR", "3600"))
+FORECAST_REFRESH_TOP_N = int(os.getenv("FORECAST_REFRESH_TOP_N", "50"))
+FORECAST_REFRESH_INTERVAL = float(os.getenv("FORECAST_REFRESH_INTERVAL", "60"))
+# "split" fetches and caches the hourly and daily views separately;
+# "combined" fetches current, hourly and daily in one upstream call and
+# caches the superset, from which each view is sliced; "derived" fetches
+# only the hourly view and computes the daily view from it (aggregate.py).
+FORECAST_FETCH_MODE = os.getenv("FORECAST_FETCH_MODE", "split")
+# In "split" mode, serve a daily view from the location's cached hourly
+# forecast, if there is one, rather than fetching the daily view. Off by
+# default: the derived values can differ from the upstream daily ones.
+FORECAST_DAILY_FROM_HOURLY = os.getenv("FORECAST_DAILY_FROM_HOURLY", "0") == "1"
+
+CURRENT_VARIABLES = "temperature_2m,apparent_temperature,weather_code,wind_speed_10m,wind_direction_10m,precipitation,relative_humidity_2m,uv_index"
+HOURLY_VARIABLES = "temperature_2m,apparent_temperature,weather_code,wind_speed_10m,wind_direction_10m,precipitation,precipitation_probability,relative_humidity_2m,uv_index"
+DAILY_VARIABLES = "temperature_2m_max,temperature_2m_min,weather_code,wind_speed_10m_max,wind_direction_10m_dominant,precipitation_sum,precipitation_probability_max,relative_humidity_2m_max,uv_index_max"
+
+
+def _create_forecast_cache():
+    """
+    Build the forecast cache from the FORECAST_CACHE_* settings.
+
+    :return: ForecastCache instance
+    """
+    options = {"maxsize": FORECAST_CACHE_MAXSIZE, "max_bytes": FORECAST_CACHE_MAX_BYTES}
+    if FORECAST_CACHE_BACKEND == "sqlite":
+        options["path"] = FORECAST_CACHE_PATH
+    cache = ForecastCache(
+        create_backend(FORECAST_CACHE_BACKEND, **options),
+        ttls=FORECAST_TTLS,
+        stale_ttl=FORECAST_STALE_TTL,
+        stale_if_error=FORECAST_STALE_IF_ERROR,
+    )
+    if FORECAST_REFRESH_TOP_N:
+        cache.refresher = BackgroundRefresher(
+            cache, top_n=FORECAST_REFRESH_TOP_N, interval=FORECAST_REFRESH_INTERVAL
+        )
+    return cache
+
+
+forecast_cache = _create_forecast_cache()
+
+# Spatial keying: requests inside one cell share a cache entry and an
+# upstream fetch. "grid" snaps to SPATIAL_GRID_RESOLUTION degrees, "geohash"
+# to cells of SPATIAL_GEOHASH_PRECISION characters and "exact" disables it.
+SPATIAL_KEY_MODE = os.getenv("SPATIAL_KEY_MODE", "grid")
+SPATIAL_GRID_RESOLUTION = float(os.getenv("SPATIAL_GRID_RESOLUTION", "0.1"))
+SPATIAL_GEOHASH_PRECISION = int(os.getenv("SPATIAL_GEOHASH_PRECISION", "5"))
+
+spatial_keyer = SpatialKeyer(
+    SPATIAL_KEY_MODE, resolution=SPATIAL_GRID_RESOLUTION, precision=SPATIAL_GEOHASH_PRECISION
+)
+
+# Offline geocoding: city names are resolved from a bundled GeoNames-style
+# gazetteer before falling back to the Geocoding API.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+GEOCODING_GAZETTEER = os.getenv("GEOCODING_GAZETTEER", os.path.join(DATA_DIR, "cities.tsv"))
+GEOCODING_COUNTRIES = os.getenv("GEOCODING_COUNTRIES", os.path.join(DATA_DIR, "countries.tsv"))
+
+geocoding_index = GeocodingIndex.load(GEOCODING_GAZETTEER, GEOCODING_COUNTRIES)
+
+# Places resolved through the Geocoding API, by the normalized name searched
+# for. Searched names are user input, so only the GEOCODED_PLACES_MAXSIZE
+# most recently used ones stay in the index.
+GEOCODED_PLACES_MAXSIZE = int(os.getenv("GEOCODED_PLACES_MAXSIZE", "10000"))
+geocoded_places = OrderedDict()
+geocoded_places_lock = threading.Lock()
+
+def remember_geocoded_place(name, place):
+    """
+    Index a place resolved through the Geocoding API under the name searched
+    for, unindexing the least recently used ones beyond
+    GEOCODED_PLACES_MAXSIZE.
+
+    :param name: The name that was searched for
+    :param place: Place it resolved to
+    """
+    name = normalize(name)
+    with geocoded_places_lock:
+        previous = geocoded_places.pop(name, None)
+        if previous is not None:
+            geocoding_index.remove(previous, aliases=(name,))
+        geocoding_index.add(place, aliases=(name,))
+        geocoded_places[name] = place
+        while len(geocoded_places) > GEOCODED_PLACES_MAXSIZE:
+            evicted, evicted_place = geocoded_places.popitem(last=False)
+            geocoding_index.remove(evicted_place, aliases=(evicted,))
+
+def touch_geocoded_place(name):
+    """
+    Mark a place resolved through the Geocoding API as recently used.
+
+    :param name: The name that was searched for
+    """
+    name = normalize(name)
+    with geocoded_places_lock:
+        if name in geocoded_places:
+            geocoded_places.move_to_end(name)
+
+def geocoded_place_items():
+    """
+    :return: List of (name, Place) resolved through the Geocoding API,
+        least recently used first
+    """
+    with geocoded_places_lock:
+        return list(geocoded_places.items())
+
+# Suggestions returned by /api/geocode/suggest by default and at most
+GEOCODE_SUGGEST_LIMIT = int(os.getenv("GEOCODE_SUGGEST_LIMIT", "10"))
+GEOCODE_SUGGEST_MAX_LIMIT = 20
+# Seconds clients may cache a suggestion list
+GEOCODE_SUGGEST_MAX_AGE = int(os.getenv("GEOCODE_SUGGEST_MAX_AGE", "3600"))
+
+# Admission control: rate limits per client address (shared by the weather
+# endpoints, and for autocomplete) and for all clients together, in the
+# "N per second;M per minute" notation of the limits package. Counters live
+# in RATE_LIMIT_STORAGE_URI: "memory://" is per worker, a "redis://" or
+# "memcached://" URI shares them between workers and nodes. An empty limit
+# disables it.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "moving-window")
+RATE_LIMIT_PER_CLIENT = os.getenv("RATE_LIMIT_PER_CLIENT", "20 per second;600 per minute")
+RATE_LIMIT_SUGGEST = os.getenv("RATE_LIMIT_SUGGEST", "30 per second")
+RATE_LIMIT_GLOBAL = os.getenv("RATE_LIMIT_GLOBAL", "")
+# Counters are stored as (prefix, client address or GLOBAL_LIMIT_KEY,
+# scope), the keys Flask-Limiter builds, so requests served outside Flask
+# (asgi.py) count against the same budgets through hit_rate_limits
+RATE_LIMIT_KEY_PREFIX = "weather"
+GLOBAL_LIMIT_KEY = "all"
+GLOBAL_LIMIT_SCOPE = "global"
+
+def request_cost():
+    """
+    :return: Rate limit hits charged for the current request: one per
+        location for a batch (rejected above batch_max_locations anyway),
+        one otherwise
+    """
+    if request.endpoint != "api_weather_batch":
+        return 1
+    data = request.get_json(silent=True)
+    locations = data.get("locations") if isinstance(data, dict) else None
+    if not isinstance(locations, list):
+        return 1
+    return max(1, min(len(locations), batch_max_locations()))
+
+def admitted(response):
+    """
+    Every limit is checked before any is charged, and a request is only
+    charged once it has been admitted, so a request rejected by one limit
+    does not use up the budget of another.
+
+    :param response: Flask response
+    :return: True if the request counts against the rate limits
+    """
+    return response.status_code != 429
+
+# Registered with the app after the request timer, so rejected requests are
+# timed and counted too
+limiter = Limiter(
+    get_remote_address,
+    application_limits=[
+        ApplicationLimit(
+            RATE_LIMIT_GLOBAL,
+            key_function=lambda: GLOBAL_LIMIT_KEY,
+            cost=request_cost,
+            deduct_when=admitted,
+            scope=GLOBAL_LIMIT_SCOPE,
+        )
+    ] if RATE_LIMIT_GLOBAL else [],
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    # A shared store that is down must not take the API down with it
+    swallow_errors=True,
+    in_memory_fallback_enabled=True,
+    key_prefix=RATE_LIMIT_KEY_PREFIX,
+    enabled=RATE_LIMIT_ENABLED,
+)
+
+def rate_limit(limits, scope):
+    """
+    :param limits: Limits string, or empty for no limit
+    :param scope: Name of the counter shared by the decorated views
+    :return: View decorator applying ``limits`` per client address
+    """
+    if not limits:
+        return lambda view: view
+    return limiter.shared_limit(limits, scope=scope, cost=request_cost, deduct_when=admitted)
+
+def hit_rate_limits(client, limits, scope):
+    """
+    Count a request served outside Flask against the per-client limits of
+    a rate_limit scope and the global limit, in the counters the Flask
+    views use, so a client has one budget whichever server answers it.
+
+    :param client: Client address
+    :param limits: Limits string of the scope, as passed to rate_limit
+    :param scope: Scope name, as passed to rate_limit
+    :return: Seconds until the exhausted limit frees up, or None if the
+        request is admitted (also when the counter store fails, as the
+        Flask views do with swallow_errors)
+    """
+    if not limiter.enabled:
+        return None
+    checks = [(limit, (client, scope)) for limit in _parse_limits(limits)]
+    checks.extend((limit, (GLOBAL_LIMIT_KEY, GLOBAL_LIMIT_SCOPE)) for limit in _parse_limits(RATE_LIMIT_GLOBAL))
+    strategy = limiter.limiter
+    try:
+        # Like the Flask views (see admitted), charge only admitted requests
+        for limit, identifiers in checks:
+            if not strategy.test(limit, RATE_LIMIT_KEY_PREFIX, *identifiers):
+                reset_at, _ = strategy.get_window_stats(limit, RATE_LIMIT_KEY_PREFIX, *identifiers)
+                return max(1, math.ceil(reset_at - time.time()))
+        for limit, identifiers in checks:
+            strategy.hit(limit, RATE_LIMIT_KEY_PREFIX, *identifiers)
+    except Exception:
+        app.logger.exception("Rate limit storage failed, admitting the request")
+    return None
+
+_parsed_limits = {}
+
+def _parse_limits(limits):
+    """
+    :return: The RateLimitItems of a limits string, parsed once
+    """
+    parsed = _parsed_limits.get(limits)
+    if parsed is None:
+        parsed = _parsed_limits[limits] = parse_many(limits) if limits else []
+    return parsed
+
+# Warm start: the in-memory forecast cache and geocoded places are written to
+# FORECAST_SNAPSHOT_PATH every FORECAST_SNAPSHOT_INTERVAL seconds and at
+# exit, and loaded back when a worker starts (unset disables snapshots).
+FORECAST_SNAPSHOT_PATH = os.getenv("FORECAST_SNAPSHOT_PATH")
+FORECAST_SNAPSHOT_INTERVAL = float(os.getenv("FORECAST_SNAPSHOT_INTERVAL", "300"))
+
+def snapshot_entries():
+    """
+    :return: The forecast cache entries to snapshot, least recently used
+        first; none for the sqlite backend, which persists by itself
+    """
+    if forecast_cache.backend.name != "memory":
+        return []
+    return forecast_cache.backend.items()
+
+def restore_snapshot(path):
+    """
+    Load a snapshot into the forecast cache and the geocoding index,
+    skipping expired forecasts.
+
+    :param path: Snapshot file path
+    :return: Tuple of (forecasts restored, places restored)
+    """
+    entries, places = read_snapshot(path)
+    for name, place in places:
+        remember_geocoded_place(name, place)
+    return forecast_cache.restore(entries), len(places)
+
+if FORECAST_SNAPSHOT_PATH:
+    restore_snapshot(FORECAST_SNAPSHOT_PATH)
+    forecast_cache.snapshotter = SnapshotWriter(
+        FORECAST_SNAPSHOT_PATH,
+        snapshot_entries,
+        geocoded_place_items,
+        interval=FORECAST_SNAPSHOT_INTERVAL,
+        max_entries=FORECAST_CACHE_MAXSIZE,
+        max_places=GEOCODED_PLACES_MAXSIZE,
+    )
+    atexit.register(forecast_cache.snapshotter.run_at_exit)
+
+# Forecast archive: every fetched forecast is appended to columnar files
+# under FORECAST_ARCHIVE_PATH (unset disables it) and served by /api/archive
+FORECAST_ARCHIVE_PATH = os.getenv("FORECAST_ARCHIVE_PATH")
+# Most archived forecasts returned per /api/archive request, newest kept
+ARCHIVE_MAX_RUNS = int(os.getenv("ARCHIVE_MAX_RUNS", "48"))
+# Fetched forecasts waiting for the archive's writer thread; more are dropped
+ARCHIVE_QUEUE_SIZE = int(os.getenv("ARCHIVE_QUEUE_SIZE", "1024"))
+# Seconds a worker waits at exit for queued forecasts to be appended
+ARCHIVE_FLUSH_TIMEOUT = float(os.getenv("ARCHIVE_FLUSH_TIMEOUT", "10"))
+ARCHIVE_VIEWS = ("runs", "latest")
+
+forecast_archive = None
+if FORECAST_ARCHIVE_PATH:
+    forecast_archive = ForecastArchive(FORECAST_ARCHIVE_PATH, queue_size=ARCHIVE_QUEUE_SIZE)
+    atexit.register(forecast_archive.flush, ARCHIVE_FLUSH_TIMEOUT)
+
+def store_forecast(key, weather):
+    """
+    Compact a forecast fetched from upstream for the cache and, if the
+    archive is enabled, queue it to be appended to the archive off the
+    request path.
+
+    :param key: Forecast cache key, starting with the spatial cell
+    :param weather: Decoded Forecast API response
+    :return: Value to cache, see compact_forecast
+    """
+    weather = compact_forecast(weather)
+    if forecast_archive is not None:
+        forecast_archive.submit(key[:2], weather)
+    return weather
+
+# Batch endpoint: locations accepted per request, coordinates sent in one
+# multi-coordinate Forecast API call, and upstream calls made in parallel.
+BATCH_MAX_LOCATIONS = int(os.getenv("BATCH_MAX_LOCATIONS", "500"))
+BATCH_UPSTREAM_COORDINATES = int(os.getenv("BATCH_UPSTREAM_COORDINATES", "100"))
+BATCH_FETCH_WORKERS = int(os.getenv("BATCH_FETCH_WORKERS", "4"))
+
+def batch_max_locations():
+    """
+    :return: Most locations accepted per batch: BATCH_MAX_LOCATIONS, or the
+        smallest per-client or global rate limit if that is lower, since a
+        batch is charged one request per location
+    """
+    amounts = [BATCH_MAX_LOCATIONS]
+    if limiter.enabled:
+        amounts.extend(limit.amount for limit in _parse_limits(RATE_LIMIT_PER_CLIENT))
+        amounts.extend(limit.amount for limit in _parse_limits(RATE_LIMIT_GLOBAL))
+    return min(amounts)
+# Request fields a batch may set for all locations and each location override
+BATCH_ITEM_FIELDS = (
+    "units", "wind_speed_unit", "precipitation_unit", "forecast_type",
+    "horizon", "start", "end", "variables",
+)
+
+# Encoded (and compressed) /api/weather bodies kept for repeated requests
+RESPONSE_MEMO_MAXSIZE = int(os.getenv("RESPONSE_MEMO_MAXSIZE", "1024"))
+response_memo = ResponseMemo(RESPONSE_MEMO_MAXSIZE)
+
+# Streaming mode: NDJSON records are written in chunks of this many lines
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_ROWS_PER_CHUNK = int(os.getenv("STREAM_ROWS_PER_CHUNK", "48"))
+
+# GET /api/weather: query fields in canonical order, values left out of the
+# canonical query because they are the defaults, coordinate decimals kept
+# (4 decimals is about 11 m) and how long clients may cache the redirect
+# from a non-canonical query
+WEATHER_QUERY_FIELDS = (
+    "city", "lat", "lon", "units", "wind_speed_unit", "precipitation_unit",
+    "forecast_type", "horizon", "start", "end", "variables",
+)
+WEATHER_QUERY_DEFAULTS = {"units": "celsius", "forecast_type": "hourly"}
+CANONICAL_COORDINATE_DECIMALS = int(os.getenv("CANONICAL_COORDINATE_DECIMALS", "4"))
+CANONICAL_REDIRECT_MAX_AGE = int(os.getenv("CANONICAL_REDIRECT_MAX_AGE", "86400"))
+
 def get_coords(city):
     """
     Return the coordinates for a given city name.
 
+    The local geocoding index is consulted first; the Geocoding API is only
+    called on a miss and its answer is added to the index.
+
     :param city: City name
     :return: Tuple of latitude, longitude, city name, country name
     :raises ValueError: if city not found
     """
-    params = {"name": city, "count": 1, "language": "en", "format": "json"}
-    resp = requests.get(GEOCODING_API, params=params, timeout=5)
-    resp.raise_for_status()
-    data = resp.json()
+    with timed("geocode"):
+        place = geocoding_index.lookup(city)
+        if place is not None:
+            touch_geocoded_place(city)
+            return place.as_tuple()
+        resp = upstream.get(GEOCODING_API, params=geocode_params(city), timeout=5)
+        resp.raise_for_status()
+        return index_geocode_result(city, resp.json()).as_tuple()
+
+def geocode_params(city):
+    """
+    :param city: City name
+    :return: Query parameters for a Geocoding API search
+    """
+    return {"name": city, "count": 1, "language": "en", "format": "json"}
+
+def index_geocode_result(city, data):
+    """
+    Turn a Geocoding API response into a Place and add it to the local index.
+
+    :param city: The name that was searched for, kept as an alias
+    :param data: Decoded Geocoding API response
+    :return: Place
+    :raises ValueError: if city not found
+    """
     if "results" in data and data["results"]:
         r = data["results"][0]
-        return r["latitude"], r["longitude"], r["name"], r.get("country", "")
+        place = Place(
+            r["name"], r["latitude"], r["longitude"], r.get("country", ""), r.get("population", 0)
+        )
+        remember_geocoded_place(city, place)
+        return place
     raise ValueError("City not found")
 
-def fetch_weather(lat, lon, units, forecast_type):
+def fetch_weather(lat, lon, forecast_type):
     """
     Fetch the weather data for a given location and parameters.
 
+    The forecast is always requested in the canonical units of units.py;
+    convert_units turns it into the units a client asked for.
+
     :param lat: Latitude
     :param lon: Longitude
-    :param units: "celsius" or "fahrenheit"
-    :param forecast_type: "hourly" or "daily"
+    :param forecast_type: "hourly", "daily" or "all" for both
     :return: The JSON response from the Open-Meteo API
     :raises requests.exceptions.RequestException: on request errors
     """
+    with timed("upstream"):
+        resp = upstream.get(OPEN_METEO_BASE, params=forecast_params(lat, lon, forecast_type), timeout=10)
+        resp.raise_for_status()
+        return resp.json()
+
+def fetch_weather_many(coords, forecast_type):
+    """
+    Fetch the weather data for several locations in one upstream call, using
+    the Forecast API's comma-separated multi-coordinate form.
+
+    :param coords: List of (latitude, longitude) tuples
+    :param forecast_type: "hourly", "daily" or "all" for both
+    :return: List of forecast documents in the order of ``coords``
+    :raises requests.exceptions.RequestException: on request errors
+    :raises ValueError: if the response does not hold one forecast per location
+    """
+    lats = ",".join(str(lat) for lat, _ in coords)
+    lons = ",".join(str(lon) for _, lon in coords)
+    with timed("upstream"):
+        resp = upstream.get(OPEN_METEO_BASE, params=forecast_params(lats, lons, forecast_type), timeout=10)
+        resp.raise_for_status()
+        data = resp.json()
+    # A single location is answered with an object rather than a list
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != len(coords):
+        raise ValueError("Forecast API returned an unexpected number of locations")
+    return data
+
+def forecast_params(lat, lon, forecast_type):
+    """
+    Build the Forecast API query parameters for a location and view.
+
+    :param lat: Latitude
+    :param lon: Longitude
+    :param forecast_type: "hourly", "daily" or "all" for both
+    :return: Dict of query parameters
+    """
     params = {
         "latitude": lat,
         "longitude": lon,
-        "current": "temperature_2m,apparent_temperature,weather_code,wind_speed_10m,wind_direction_10m,precipitation,relative_humidity_2m,uv_index",
+        "current": CURRENT_VARIABLES,
         "timezone": "auto",
     }
-    if forecast_type == "hourly":
-        params["hourly"] = "temperature_2m,apparent_temperature,weather_code,wind_speed_10m,wind_direction_10m,precipitation,precipitation_probability,relative_humidity_2m,uv_index"
-    else:
-        params["daily"] = "temperature_2m_max,temperature_2m_min,weather_code,wind_speed_10m_max,wind_direction_10m_dominant,precipitation_sum,precipitation_probability_max,relative_humidity_2m_max,uv_index_max"
-    if units == "fahrenheit":
-        params["temperature_unit"] = "fahrenheit"
-        params["wind_speed_unit"] = "mph"
-    else:
-        params["temperature_unit"] = "celsius"
-        params["wind_speed_unit"] = "kmh"
-    params["precipitation_unit"] = "mm"
-    resp = requests.get(OPEN_METEO_BASE, params=params, timeout=10)
-    resp.raise_for_status()
-    return resp.json()
+    if forecast_type in ("hourly", "all"):
+        params["hourly"] = HOURLY_VARIABLES
+    if forecast_type != "hourly":
+        params["daily"] = DAILY_VARIABLES
+    params.update(canonical_params())
+    return params
+
+def iter_cached_fetch_weather_many(cells, fetched_type):
+    """
+    Cached lookup of many locations of one forecast type, yielding each
+    location as soon as it is available.
+
+    Cache hits (including stale ones) are yielded first; the misses are
+    fetched in chunks of BATCH_UPSTREAM_COORDINATES locations per upstream
+    call, with the chunks running concurrently, stored in the cache and
+    yielded chunk by chunk as the calls complete.
+
+    :param cells: Iterable of (latitude, longitude) spatial cells
+    :param fetched_type: Forecast type to fetch, see fetched_forecast_type
+    :return: Iterator of (cache key, cached value or exception) pairs, one
+        per distinct key
+    """
+    ttl = forecast_cache.ttl_for(fetched_type)
+    seen = set()
+    misses = []
+    for lat, lon in cells:
+        key = (float(lat), float(lon), fetched_type)
+        if key in seen:
+            continue
+        seen.add(key)
+        entry = forecast_cache.lookup(key, lambda key=key: store_forecast(key, fetch_weather(*key)), ttl)
+        if entry is not None:
+            yield key, entry.value
+        else:
+            misses.append(key)
+
+    def fetch_chunk(chunk):
+        try:
+            docs = fetch_weather_many([key[:2] for key in chunk], fetched_type)
+        except Exception as e:
+            fallbacks = [forecast_cache.fallback(key) for key in chunk]
+            return [(key, e if entry is None else entry.value) for key, entry in zip(chunk, fallbacks)]
+        return [
+            (key, forecast_cache.set(key, store_forecast(key, doc), ttl).value)
+            for key, doc in zip(chunk, docs)
+        ]
+
+    chunks = [
+        misses[i:i + BATCH_UPSTREAM_COORDINATES]
+        for i in range(0, len(misses), BATCH_UPSTREAM_COORDINATES)
+    ]
+    if len(chunks) == 1:
+        yield from fetch_chunk(chunks[0])
+    elif chunks:
+        with ThreadPoolExecutor(min(BATCH_FETCH_WORKERS, len(chunks))) as pool:
+            for future in as_completed([pool.submit(fetch_chunk, chunk) for chunk in chunks]):
+                yield from future.result()
+
+def cached_weather_entry(cell_lat, cell_lon, forecast_type):
+    """
+    Look up or fetch the forecast cache entry for a spatial cell.
+
+    :param cell_lat: Latitude of the spatial cell
+    :param cell_lon: Longitude of the spatial cell
+    :param forecast_type: "hourly" or "daily"
+    :return: Tuple of (cache key, Entry)
+    """
+    fetched_type = fetched_forecast_type(forecast_type, (cell_lat, cell_lon))
+    key = (float(cell_lat), float(cell_lon), fetched_type)
+    # On a miss this includes the "upstream" stage
+    with timed("cache"):
+        entry = forecast_cache.get_or_fetch_entry(
+            key, lambda: store_forecast(key, fetch_weather(*key)), forecast_cache.ttl_for(fetched_type)
+        )
+    return key, entry
+
+def encode_weather_response(entry, key, forecast_type, target_units, shape, envelope):
+    """
+    Render and encode a response body from a cache entry, or reuse the bytes
+    from an identical earlier request for the same entry.
+
+    :param entry: Forecast cache Entry
+    :param key: Its cache key
+    :param forecast_type: "hourly" or "daily"
+    :param target_units: Dict mapping quantity to unit, from parse_units
+    :param shape: ResponseShape, from parse_shape
+    :param envelope: Tuple of (location name, country, lat, lon, units)
+        as passed to weather_response
+    :return: EncodedResponse
+    """
+    memo_key = (key, entry.created_at, forecast_type, tuple(sorted(target_units.items())), shape.key(), envelope)
+    encoded = response_memo.get(memo_key)
+    if encoded is None:
+        weather = render_forecast(entry.value, key[2], forecast_type, target_units, shape)
+        city_found, country, lat, lon, units = envelope
+        with timed("encode"):
+            encoded = EncodedResponse.of(
+                weather_response(city_found, country, lat, lon, units, forecast_type, weather)
+            )
+        response_memo.set(memo_key, encoded)
+    return encoded
+
+def send_encoded(encoded, entry=None):
+    """
+    :param encoded: EncodedResponse
+    :param entry: Forecast cache Entry the body was rendered from, for a
+        response that shared caches may store (see cache_headers)
+    :return: Flask response with the representation the request accepts, or
+        304 Not Modified if the request's If-None-Match names it (or, without
+        If-None-Match, its If-Modified-Since covers the entry)
+    """
+    if_none_match = request.headers.get("If-None-Match")
+    status, headers, body = encoded.respond(request.headers.get("Accept-Encoding", ""), if_none_match)
+    if entry is not None:
+        if status == 200 and if_none_match is None and not_modified_since(entry):
+            status, body = 304, b""
+            headers = [(name, value) for name, value in headers if name in ("ETag", "Vary")]
+        headers.extend(cache_headers(entry))
+    return Response(body, status=status, headers=headers)
+
+def cache_headers(entry, now=None):
+    """
+    HTTP caching headers for a GET response rendered from a cache entry.
+
+    Browsers and shared caches may keep the response for as long as the
+    entry stays fresh here, and serve it while it is revalidated for the
+    rest of the entry's stale window. Last-Modified is when the forecast
+    was fetched from upstream.
+
+    :param entry: Forecast cache Entry
+    :param now: Timestamp to compute the remaining lifetime from (defaults
+        to time.time())
+    :return: List of (name, value) header pairs
+    """
+    now = time.time() if now is None else now
+    control = f"public, max-age={int(max(0.0, entry.stale_at - now))}"
+    stale_window = int(entry.expires_at - max(entry.stale_at, now))
+    if stale_window > 0:
+        control += f", stale-while-revalidate={stale_window}"
+    return [("Cache-Control", control), ("Last-Modified", http_date(entry.created_at))]
+
+def not_modified_since(entry):
+    """
+    :param entry: Forecast cache Entry
+    :return: True if the request's If-Modified-Since is at or after the time
+        the entry was fetched
+    """
+    since = parse_date(request.headers.get("If-Modified-Since"))
+    # HTTP dates have a resolution of one second
+    return since is not None and int(entry.created_at) <= since.timestamp()
+
+def fetched_forecast_type(forecast_type, cell=None):
+    """
+    :param forecast_type: The view a client asked for
+    :param cell: (latitude, longitude) of the location's spatial cell, to
+        check for a cached hourly forecast that can serve a daily view
+    :return: The forecast type fetched and cached for it: the view itself,
+        "all" in the "combined" FORECAST_FETCH_MODE, or "hourly" for a
+        daily view computed from hourly data (see render_forecast)
+    """
+    if FORECAST_FETCH_MODE == "combined":
+        return "all"
+    if forecast_type != "daily":
+        return forecast_type
+    if FORECAST_FETCH_MODE == "derived":
+        return "hourly"
+    if FORECAST_DAILY_FROM_HOURLY and cell is not None:
+        entry = forecast_cache.peek((float(cell[0]), float(cell[1]), "hourly"))
+        if entry is not None and isinstance(entry.value, CompactForecast) and "hourly" in entry.value.series:
+            return "hourly"
+    return forecast_type
+
+def render_forecast(weather, fetched_type, forecast_type, target, shape=None):
+    """
+    Build the response document from a cached forecast.
+
+    A combined entry is sliced to the requested view, a daily view is
+    computed from an hourly entry (as are computed variables named in
+    ``shape``, see aggregate.derive_views), the compact form is decoded
+    (only for that view and the time steps and variables selected by
+    ``shape``) and the requested units are applied.
+
+    :param weather: Cached value, normally a CompactForecast
+    :param fetched_type: Forecast type the entry was fetched with
+    :param forecast_type: "hourly" or "daily", the view to return
+    :param target: Dict mapping quantity to unit, from resolve_units
+    :param shape: Optional ResponseShape, from parse_shape
+    :return: Forecast document in the Forecast API response shape
+    """
+    exclude = ()
+    if fetched_type != forecast_type:
+        other = "daily" if forecast_type == "hourly" else "hourly"
+        exclude = (other, f"{other}_units")
+    with timed("render"):
+        if isinstance(weather, dict):
+            weather = CompactForecast(weather)
+        if isinstance(weather, CompactForecast):
+            weather = derive_views(weather, forecast_type, shape.variables if shape else None)
+            weather = weather.to_dict(exclude, shape)
+        return convert_units(weather, target)
+
+class RequestError(Exception):
+    """
+    Invalid client input, reported as a JSON error with a 400 status code.
+    """
+
+def error_status(error):
+    """
+    :param error: Exception raised while answering a request
+    :return: 503 if an upstream is unavailable (its circuit breaker is
+        open or this worker's upstream budget is used up), else 500
+    """
+    return 503 if isinstance(error, UpstreamUnavailableError) else 500
+
+def error_response(error):
+    """
+    :param error: Exception raised while answering a request
+    :return: JSON error response with the status from error_status, and a
+        Retry-After header while the upstream is unavailable
+    """
+    response = jsonify({"error": str(error)})
+    response.status_code = error_status(error)
+    if isinstance(error, UpstreamUnavailableError):
+        response.headers["Retry-After"] = str(max(1, round(error.retry_after)))
+    return response
+
+def parse_coordinates(lat, lon):
+    """
+    Validate a latitude/longitude pair from a request.
+
+    :param lat: Latitude (number or numeric string)
+    :param lon: Longitude (number or numeric string)
+    :return: Tuple of float latitude, longitude
+    :raises RequestError: if missing, non-numeric or out of range
+    """
+    if lat is None or lon is None:
+        raise RequestError("No location provided")
+    try:
+        lat = float(lat)
+        lon = float(lon)
+    except (TypeError, ValueError):
+        raise RequestError("Latitude and longitude must be valid numbers")
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise RequestError("Invalid latitude or longitude range")
+    return lat, lon
+
+def resolve_location(data, located=None):
+    """
+    Resolve the location of a request body: a city name or a lat/lon pair.
+
+    :param data: Request body (or batch item) as a dict
+    :param located: Optional results of geocode_many, used for the cities
+        it covers
+    :return: Tuple of latitude, longitude, location name, country name
+    :raises RequestError: if no valid location is given
+    :raises ValueError: if the city is not found
+    """
+    city = data.get("city")
+    if city:
+        result = located.get(city) if located and isinstance(city, str) else None
+        if isinstance(result, Exception):
+            raise result
+        return get_coords(city) if result is None else result
+    lat, lon = parse_coordinates(data.get("lat"), data.get("lon"))
+    return lat, lon, "Coordinates", ""
 
-@lru_cache(maxsize=128)
-def cached_fetch_weather(lat, lon, units, forecast_type):
+def parse_units(units, wind_speed_unit=None, precipitation_unit=None):
     """
-    Cached wrapper for fetch_weather.
-    Only accepts hashable arguments.
+    Validate the unit fields of a request.
+
+    :return: Dict mapping quantity to unit, see units.resolve_units
+    :raises RequestError: if a unit override is not supported
+    """
+    try:
+        return resolve_units(units, wind_speed_unit, precipitation_unit)
+    except ValueError as e:
+        raise RequestError(str(e))
+
+def parse_shape(data):
     """
-    # lru_cache only works with hashable types (float, str, etc.)
-    # Convert lat/lon to float to ensure hashability and consistency
-    return fetch_weather(float(lat), float(lon), units, forecast_type)
+    Read the response shaping fields of a request: "horizon", "start",
+    "end" and "variables".
+
+    :return: ResponseShape
+    :raises RequestError: if a field is malformed
+    """
+    try:
+        return ResponseShape(
+            data.get("horizon"), data.get("start"), data.get("end"), data.get("variables")
+        )
+    except ValueError as e:
+        raise RequestError(str(e))
+
+def weather_response(city_found, country, lat, lon, units, forecast_type, weather):
+    """
+    :return: The /api/weather response body as a dict
+    """
+    return {
+        "location": f"{city_found}, {country}".strip(", "),
+        "coordinates": {"lat": lat, "lon": lon},
+        "units": units,
+        "forecast_type": forecast_type,
+        "weather": weather
+    }
+
+def wants_stream(data, accept=""):
+    """
+    :param data: Request body as a dict
+    :param accept: Accept header of the request
+    :return: True if the client opted into the NDJSON streaming mode, with
+        ``"stream": true`` or an Accept header naming application/x-ndjson
+    """
+    return bool(data.get("stream")) or NDJSON_MIMETYPE in accept
+
+def ndjson(record):
+    """
+    :return: ``record`` as one NDJSON line
+    """
+    return json.dumps(record, separators=(",", ":")) + "\n"
+
+def stream_weather_response(body):
+    """
+    Render an /api/weather response body as NDJSON, one time step per line.
+
+    The first record ("type": "meta") is the response body without the
+    series of the forecast view, plus "columns" naming the variables of the
+    "row" records that follow, one per time step. An "end" record closes
+    the stream.
+
+    :param body: Response body from weather_response
+    :return: Iterator of NDJSON chunks
+    """
+    weather = body["weather"]
+    view = body["forecast_type"]
+    section = weather.get(view) if isinstance(weather, dict) else None
+    if not isinstance(section, dict) or not isinstance(section.get("time"), list):
+        yield ndjson({"type": "meta", **body, "columns": []})
+        yield ndjson({"type": "end"})
+        return
+    names = list(section)
+    head = dict(body, weather={k: v for k, v in weather.items() if k != view})
+    yield ndjson({"type": "meta", **head, "columns": names})
+    lines = []
+    for values in zip(*(section[name] for name in names)):
+        lines.append(ndjson({"type": "row", **dict(zip(names, values))}))
+        if len(lines) >= STREAM_ROWS_PER_CHUNK:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+    yield ndjson({"type": "end"})
+
+@app.before_request
+def start_request_timer():
+    """
+    Time every request for the /metrics histograms and the Server-Timing
+    header (see metrics.RequestTimer).
+    """
+    g.request_timer = RequestTimer(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def finish_request_timer(response):
+    """
+    Record the response and add the Server-Timing header.
+    """
+    timer = g.pop("request_timer", None)
+    if timer is not None:
+        timer.finish(response.status_code)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+limiter.init_app(app)
+
+@app.errorhandler(429)
+def rate_limit_exceeded(error):
+    """
+    Turn a rate limit rejection into a JSON error with a Retry-After
+    header for when the exhausted limit's window frees up.
+    """
+    response = jsonify({"error": f"Rate limit exceeded: {error.description}"})
+    response.status_code = 429
+    current = limiter.current_limit
+    retry_after = 1 if current is None else math.ceil(current.reset_at - time.time())
+    response.headers["Retry-After"] = str(max(1, retry_after))
+    return response
+
+@registry.collector
+def collect_cache_and_upstream_metrics():
+    """
+    :return: Forecast cache, response memo and upstream counters, read from
+        their statistics at scrape time
+    """
+    cache = forecast_cache.info()
+    memo = response_memo.info()
+    endpoints = upstream.resilient_client.stats()
+    families = [
+        ("weather_cache_operations_total", "counter", "Forecast cache operations by outcome.", [
+            ({"outcome": name}, cache[name])
+            for name in ("hits", "misses", "stale_hits", "coalesced", "evictions", "expirations",
+                         "refreshes", "refresh_errors", "errors_served_stale")
+        ]),
+        ("weather_cache_hit_ratio", "gauge", "Forecast cache hits per lookup.", [({}, cache["hit_ratio"])]),
+        ("weather_cache_entries", "gauge", "Forecasts in the cache.", [({}, cache["size"])]),
+        ("weather_response_memo_operations_total", "counter", "Encoded response memo lookups by outcome.", [
+            ({"outcome": "hits"}, memo["hits"]), ({"outcome": "misses"}, memo["misses"]),
+        ]),
+    ]
+    for field, documentation in (
+        ("calls", "Upstream calls, by endpoint."),
+        ("attempts", "Upstream HTTP requests sent including retries and hedges, by endpoint."),
+        ("retries", "Upstream requests repeated after a failure, by endpoint."),
+        ("hedges", "Hedged upstream requests sent, by endpoint."),
+        ("failures", "Upstream calls that failed after all retries, by endpoint."),
+        ("timeouts", "Upstream requests that timed out, by endpoint."),
+        ("short_circuits", "Upstream calls refused by an open circuit breaker, by endpoint."),
+        ("shed", "Upstream calls refused because the worker's upstream budget was used up, by endpoint."),
+    ):
+        families.append((f"weather_upstream_{field}_total", "counter", documentation, [
+            ({"endpoint": name}, stats[field]) for name, stats in endpoints.items()
+        ]))
+    families.append(("weather_upstream_circuit_open", "gauge", "1 while an endpoint's circuit breaker is not closed.", [
+        ({"endpoint": name}, stats["state"] != "closed") for name, stats in endpoints.items()
+    ]))
+    bulkhead = upstream.resilient_client.bulkhead.info()
+    families.append(("weather_upstream_in_flight", "gauge", "Upstream calls in flight in this worker.", [
+        ({}, bulkhead["active"]),
+    ]))
+    return families
 
 @app.route("/", methods=["GET"])
 def index():
@@ -78,7 +937,177 @@ def index():
     """
     return render_template("dashboard.html")
 
+@app.route("/api/cache/stats", methods=["GET"])
+def api_cache_stats():
+    """
+    Report the forecast cache backend, size and hit/miss/eviction counters,
+    plus the size and hits of the encoded response memo and, if enabled, the
+    snapshots written and the size of the forecast archive.
+
+    :return: JSON object with the cache statistics
+    """
+    stats = dict(forecast_cache.info(), response_memo=response_memo.info())
+    if forecast_cache.snapshotter is not None:
+        stats["snapshot"] = forecast_cache.snapshotter.info()
+    if forecast_archive is not None:
+        stats["archive"] = forecast_archive.info()
+    return jsonify(stats)
+
+@app.route("/metrics", methods=["GET"])
+@limiter.exempt
+def metrics():
+    """
+    Report this worker's request, stage, cache and upstream metrics in the
+    Prometheus text format.
+
+    :return: text/plain response
+    """
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/upstream/stats", methods=["GET"])
+def api_upstream_stats():
+    """
+    Report connection reuse statistics for upstream API calls in this worker.
+
+    :return: JSON object with the upstream client statistics
+    """
+    return jsonify(upstream.stats())
+
+@app.route("/api/geocode/suggest", methods=["GET"])
+@rate_limit(RATE_LIMIT_SUGGEST, "suggest")
+def api_geocode_suggest():
+    """
+    Suggest places whose name starts with the query, most populous first,
+    from the local geocoding index (no Geocoding API call):
+
+        GET /api/geocode/suggest?q=san&limit=5
+
+    Each result carries the place's exact coordinates, so a client can ask
+    /api/weather for them directly instead of by name.
+
+    :return: JSON object with the query and a list of results with "name",
+        "country", "lat", "lon" and "population"; a 400 error if "limit" is
+        not a positive integer
+    """
+    query = request.args.get("q", "")
+    limit = request.args.get("limit", str(GEOCODE_SUGGEST_LIMIT))
+    if not limit.isdigit() or int(limit) < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    places = geocoding_index.prefix(query, min(int(limit), GEOCODE_SUGGEST_MAX_LIMIT))
+    response = Response(dumps({
+        "query": query,
+        "results": [
+            {"name": p.name, "country": p.country, "lat": p.latitude, "lon": p.longitude,
+             "population": p.population}
+            for p in places
+        ],
+    }), mimetype="application/json")
+    response.headers["Cache-Control"] = f"public, max-age={GEOCODE_SUGGEST_MAX_AGE}"
+    return response
+
+def parse_archive_time(name, value, unit="m"):
+    """
+    :param name: Query parameter name, for the error message
+    :param value: ISO 8601 date or date-time, or None
+    :param unit: numpy datetime64 unit to parse to
+    :return: numpy datetime64, or None
+    :raises RequestError: if the value is malformed
+    """
+    if value is None:
+        return None
+    try:
+        return np.datetime64(value, unit)
+    except ValueError:
+        raise RequestError(f"{name} must be an ISO 8601 date or date-time")
+
+def archive_section(times, values, section, target_units):
+    """
+    :param times: Local times as datetime64[m]
+    :param values: Dict mapping variable name to archived values
+    :param section: "hourly", "daily" or "current"
+    :param target_units: Dict mapping quantity to unit, from parse_units
+    :return: The section dict in the Forecast API shape, in the requested
+        units
+    """
+    data = {"time": np.datetime_as_string(times, unit="D" if section == "daily" else "m").tolist()}
+    data.update((name, decode(column)) for name, column in values.items())
+    return convert_units({section: data}, target_units)[section]
+
+@app.route("/api/archive", methods=["GET"])
+@rate_limit(RATE_LIMIT_PER_CLIENT, "archive")
+def api_archive():
+    """
+    Serve the archived forecasts of a location from the forecast archive,
+    without an upstream call:
+
+        GET /api/archive?lat=52.52&lon=13.41&start=2024-05-01&end=2024-05-02T23:00
+
+    Query parameters: "city" or "lat" and "lon"; "section" ("hourly",
+    "daily" or "current", default "hourly"); "start" and "end" (inclusive
+    local times of the forecast steps); "issued_from" and "issued_to"
+    (inclusive UTC times the forecasts were fetched); "variables"
+    (comma-separated); "units", "wind_speed_unit" and "precipitation_unit";
+    "view": "runs" (default) returns each archived forecast of the
+    location's spatial cell on its own, up to the ARCHIVE_MAX_RUNS most
+    recent, to show how the forecast for a time changed; "latest" merges
+    them into one series with the most recently issued value per time.
+
+    :return: JSON object with "location", "coordinates", "section",
+        "units" and either "runs" (list of objects with "issued",
+        "utc_offset_seconds" and the section's series) or "series"; a 400
+        error for invalid parameters, 404 if the archive is disabled
+    """
+    if forecast_archive is None:
+        return jsonify({"error": "Forecast archive is disabled"}), 404
+    args = request.args
+    try:
+        section = args.get("section", "hourly")
+        if section not in ARCHIVE_SECTIONS:
+            raise RequestError(f"section must be one of {', '.join(ARCHIVE_SECTIONS)}")
+        view = args.get("view", "runs")
+        if view not in ARCHIVE_VIEWS:
+            raise RequestError(f"view must be one of {', '.join(ARCHIVE_VIEWS)}")
+        units = args.get("units", "celsius")
+        target_units = parse_units(units, args.get("wind_speed_unit"), args.get("precipitation_unit"))
+        start = parse_archive_time("start", args.get("start"))
+        end = parse_archive_time("end", args.get("end"))
+        issued_from = parse_archive_time("issued_from", args.get("issued_from"), "s")
+        issued_to = parse_archive_time("issued_to", args.get("issued_to"), "s")
+        variables = args.get("variables")
+        variables = None if variables is None else {name for name in variables.split(",") if name}
+        lat, lon, city_found, country = resolve_location(args)
+
+        runs = forecast_archive.tables[section].query(
+            spatial_keyer.cell(lat, lon), start, end, variables,
+            None if issued_from is None else issued_from.astype(np.int64).item(),
+            None if issued_to is None else issued_to.astype(np.int64).item(),
+        )
+        body = {
+            "location": f"{city_found}, {country}".strip(", "),
+            "coordinates": {"lat": lat, "lon": lon},
+            "section": section,
+            "units": units,
+        }
+        if view == "latest":
+            body["series"] = archive_section(*latest_values(runs), section, target_units)
+        else:
+            body["runs"] = [
+                {
+                    "issued": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(record["issued"])),
+                    "utc_offset_seconds": int(record["utc_offset"]),
+                    section: archive_section(times, values, section, target_units),
+                }
+                for record, times, values in runs[-ARCHIVE_MAX_RUNS:]
+            ]
+        return Response(dumps(body), mimetype="application/json")
+
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
 @app.route("/api/weather", methods=["POST"])
+@rate_limit(RATE_LIMIT_PER_CLIENT, "weather")
 def api_weather():
     """
     Handle a POST request with the following JSON body:
@@ -87,49 +1116,295 @@ def api_weather():
         "lat": float (optional),
         "lon": float (optional),
         "units": string (optional, default "celsius"),
-        "forecast_type": string (optional, default "hourly")
+        "wind_speed_unit": string (optional, "kmh", "ms", "mph" or "kn"),
+        "precipitation_unit": string (optional, "mm" or "inch"),
+        "forecast_type": string (optional, default "hourly"),
+        "horizon": int (optional, number of hours/days from now),
+        "start": string (optional, first ISO 8601 date/time to include),
+        "end": string (optional, last ISO 8601 date/time to include),
+        "variables": list of strings (optional, variables to include),
+        "stream": bool (optional, default false)
     }
     If "city" is provided, fetch the coordinates from the Geocoding API.
     If "lat" and "lon" are provided, use them directly.
     Otherwise, return a 400 error.
     Fetch the weather data from the Forecast API with the given parameters.
-    Return the weather data in JSON format.
-    On error, return a JSON object with an "error" key and a 500 status code.
+    The forecast is fetched for the spatial cell containing the location;
+    "coordinates" in the response reports the location itself.
+    Return the weather data in JSON format, or as NDJSON records (see
+    stream_weather_response) when streaming is requested. JSON bodies are
+    compressed when the client accepts it and carry an ETag; a matching
+    If-None-Match gets a 304 response. See api_weather_get for a variant
+    that browser and shared caches can store.
+    On error, return a JSON object with an "error" key and a 500 status code,
+    or 503 with Retry-After while the upstream's circuit breaker is open and
+    no stale forecast is left to serve.
     """
 
     try:
-        data = request.json
-        city = data.get("city")
-        lat = data.get("lat")
-        lon = data.get("lon")
-        units = data.get("units", "celsius")
-        forecast_type = data.get("forecast_type", "hourly")
-
-        if city:
-            lat, lon, city_found, country = get_coords(city)
-        elif lat is not None and lon is not None:
+        return serve_weather(request.json)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
+@app.route("/api/weather", methods=["GET"])
+@rate_limit(RATE_LIMIT_PER_CLIENT, "weather")
+def api_weather_get():
+    """
+    Cacheable variant of POST /api/weather taking the same fields as query
+    parameters, with "variables" comma-separated:
+
+        GET /api/weather?city=berlin&forecast_type=daily&horizon=3
+
+    A query that is not in canonical form (see canonical_weather_query) is
+    redirected to its canonical URL, so browser and shared caches store one
+    copy per distinct request. Responses carry Cache-Control derived from the
+    cached forecast's remaining lifetime and Last-Modified from when it was
+    fetched, and are revalidated with If-None-Match or If-Modified-Since.
+    Streaming is requested with an Accept header naming application/x-ndjson.
+    On error, return a JSON object with an "error" key and a 400, 500 or 503
+    status code, as for api_weather.
+    """
+    query = canonical_weather_query(request.args)
+    if query != request.query_string.decode("latin-1"):
+        response = redirect(f"{request.path}?{query}", 301)
+        response.headers["Cache-Control"] = f"public, max-age={CANONICAL_REDIRECT_MAX_AGE}"
+        return response
+    try:
+        data = request.args.to_dict()
+        if data.get("horizon", "").isdigit():
+            data["horizon"] = int(data["horizon"])
+        response = serve_weather(data, cacheable=True)
+        response.vary.add("Accept")
+        return response
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+
+def serve_weather(data, cacheable=False):
+    """
+    Answer a weather request, see api_weather.
+
+    :param data: Request fields as a dict
+    :param cacheable: True to add HTTP caching headers and honour
+        If-Modified-Since, for GET requests
+    :return: Flask response
+    :raises RequestError: if the request is invalid
+    """
+    units = data.get("units", "celsius")
+    forecast_type = data.get("forecast_type", "hourly")
+    target_units = parse_units(units, data.get("wind_speed_unit"), data.get("precipitation_unit"))
+    shape = parse_shape(data)
+
+    lat, lon, city_found, country = resolve_location(data)
+
+    # Use the cached forecast, keyed on the spatial cell
+    cell_lat, cell_lon = spatial_keyer.cell(lat, lon)
+    key, entry = cached_weather_entry(cell_lat, cell_lon, forecast_type)
+    if wants_stream(data, request.headers.get("Accept", "")):
+        headers = cache_headers(entry) if cacheable else []
+        if cacheable and not_modified_since(entry):
+            return Response(status=304, headers=headers)
+        weather = render_forecast(entry.value, key[2], forecast_type, target_units, shape)
+        body = weather_response(city_found, country, lat, lon, units, forecast_type, weather)
+        return Response(stream_weather_response(body), mimetype=NDJSON_MIMETYPE, headers=headers)
+    envelope = (city_found, country, lat, lon, units)
+    encoded = encode_weather_response(entry, key, forecast_type, target_units, shape, envelope)
+    return send_encoded(encoded, entry if cacheable else None)
+
+def canonical_weather_query(args):
+    """
+    Canonical query string of a GET /api/weather request.
+
+    Fields are sorted, unknown and empty fields and default values are
+    dropped, a city name is case- and whitespace-folded (and takes the place
+    of coordinates), coordinates are rounded to CANONICAL_COORDINATE_DECIMALS
+    and variables are deduplicated and sorted. Values that do not parse are
+    kept as given so the request fails validation as usual.
+
+    :param args: Query parameters of the request
+    :return: URL-encoded query string
+    """
+    params = {}
+    for name in WEATHER_QUERY_FIELDS:
+        value = args.get(name, "").strip()
+        if value and WEATHER_QUERY_DEFAULTS.get(name) != value:
+            params[name] = value
+    if "city" in params:
+        params["city"] = " ".join(params["city"].split()).lower()
+        params.pop("lat", None)
+        params.pop("lon", None)
+    for name in ("lat", "lon"):
+        if name in params:
             try:
-                lat = float(lat)
-                lon = float(lon)
-                if not (-90 <= lat <= 90 and -180 <= lon <= 180):
-                    return jsonify({"error": "Invalid latitude or longitude range"}), 400
-            except (TypeError, ValueError):
-                return jsonify({"error": "Latitude and longitude must be valid numbers"}), 400
-            city_found, country = "Coordinates", ""
+                params[name] = _format_coordinate(float(params[name]))
+            except ValueError:
+                pass
+    if "variables" in params:
+        variables = sorted({v.strip() for v in params["variables"].split(",") if v.strip()})
+        params["variables"] = ",".join(variables)
+        if not variables:
+            del params["variables"]
+    return urlencode(sorted(params.items()))
+
+def _format_coordinate(value):
+    text = f"{value:.{CANONICAL_COORDINATE_DECIMALS}f}".rstrip("0").rstrip(".")
+    return "0" if text == "-0" else text
+
+def geocode_many(cities):
+    """
+    Resolve the city names of a batch. Names missing from the local index
+    are looked up through the Geocoding API concurrently, on up to
+    BATCH_FETCH_WORKERS threads.
+
+    :param cities: Iterable of city names
+    :return: Dict mapping each name to a get_coords tuple or the exception
+        it raised
+    """
+    def locate(city):
+        try:
+            return get_coords(city)
+        except Exception as e:
+            return e
+
+    located = {}
+    misses = []
+    for city in dict.fromkeys(city for city in cities if isinstance(city, str)):
+        if geocoding_index.lookup(city) is None:
+            misses.append(city)
         else:
-            return jsonify({"error": "No location provided"}), 400
+            located[city] = locate(city)
+    if len(misses) > 1:
+        with ThreadPoolExecutor(min(BATCH_FETCH_WORKERS, len(misses))) as pool:
+            located.update(zip(misses, pool.map(locate, misses)))
+    else:
+        located.update((city, locate(city)) for city in misses)
+    return located
 
-        # Use the cached version of fetch_weather
-        weather = cached_fetch_weather(lat, lon, units, forecast_type)
-        return jsonify({
-            "location": f"{city_found}, {country}".strip(", "),
-            "units": units,
-            "forecast_type": forecast_type,
-            "weather": weather
-        })
-    
+def plan_batch(data):
+    """
+    Resolve the locations of a batch request.
+
+    :param data: Batch request body as a dict
+    :return: Tuple of (plans, cells): one plan per location, either an
+        error result dict or a tuple of (cache key, location name, country,
+        lat, lon, units, forecast_type, target units, shape); and the spatial cells
+        to look up per fetched forecast type
+    :raises RequestError: if the batch itself is invalid
+    """
+    items = data.get("locations")
+    if not isinstance(items, list) or not items:
+        raise RequestError("No locations provided")
+    max_locations = batch_max_locations()
+    if len(items) > max_locations:
+        raise RequestError(f"At most {max_locations} locations per batch")
+    defaults = {
+        name: data[name]
+        for name in BATCH_ITEM_FIELDS
+        if name in data
+    }
+
+    located = geocode_many(item["city"] for item in items if isinstance(item, dict) and item.get("city"))
+    plans = []
+    cells = {}
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise RequestError("Location must be an object")
+            options = {**defaults, **item}
+            units = options.get("units", "celsius")
+            forecast_type = options.get("forecast_type", "hourly")
+            target_units = parse_units(
+                units, options.get("wind_speed_unit"), options.get("precipitation_unit")
+            )
+            shape = parse_shape(options)
+            lat, lon, city_found, country = resolve_location(options, located)
+        except RequestError as e:
+            plans.append({"error": str(e), "status": 400})
+            continue
+        except Exception as e:
+            plans.append({"error": str(e), "status": error_status(e)})
+            continue
+        cell_lat, cell_lon = spatial_keyer.cell(lat, lon)
+        fetched_type = fetched_forecast_type(forecast_type, (cell_lat, cell_lon))
+        cells.setdefault(fetched_type, []).append((cell_lat, cell_lon))
+        key = (float(cell_lat), float(cell_lon), fetched_type)
+        plans.append((key, city_found, country, lat, lon, units, forecast_type, target_units, shape))
+    return plans, cells
+
+def iter_batch_results(plans, cells):
+    """
+    :param plans: Location plans from plan_batch
+    :param cells: Spatial cells per fetched forecast type from plan_batch
+    :return: Iterator of (index, result) pairs, each yielded as soon as the
+        location's forecast is available, in no particular order
+    """
+    waiting = {}
+    for index, plan in enumerate(plans):
+        if isinstance(plan, dict):
+            yield index, plan
+        else:
+            waiting.setdefault(plan[0], []).append(index)
+    for fetched_type, type_cells in cells.items():
+        for key, value in iter_cached_fetch_weather_many(type_cells, fetched_type):
+            for index in waiting.pop(key, ()):
+                if isinstance(value, Exception):
+                    yield index, {"error": str(value), "status": error_status(value)}
+                    continue
+                _, city_found, country, lat, lon, units, forecast_type, target_units, shape = plans[index]
+                weather = render_forecast(value, fetched_type, forecast_type, target_units, shape)
+                yield index, weather_response(city_found, country, lat, lon, units, forecast_type, weather)
+
+def stream_batch_results(plans, cells):
+    """
+    Render batch results as NDJSON: one "result" record per location, with
+    its "index" in the request, as soon as it is available, then an "end"
+    record.
+
+    :return: Iterator of NDJSON chunks
+    """
+    for index, result in iter_batch_results(plans, cells):
+        yield ndjson({"type": "result", "index": index, **result})
+    yield ndjson({"type": "end", "count": len(plans)})
+
+@app.route("/api/weather/batch", methods=["POST"])
+@rate_limit(RATE_LIMIT_PER_CLIENT, "weather")
+def api_weather_batch():
+    """
+    Handle a POST request for many locations at once:
+    {
+        "locations": [
+            {"city": string} or {"lat": float, "lon": float}, ...
+        ],
+        "units", "wind_speed_unit", "precipitation_unit", "forecast_type",
+        "horizon", "start", "end", "variables":
+            optional defaults, each also accepted per location,
+        "stream": bool (optional, default false)
+    }
+    Locations sharing a spatial cell are fetched once, cache hits are served
+    directly and the misses are fetched with multi-coordinate Forecast API
+    calls. Return {"results": [...]} with one entry per location, in order:
+    the /api/weather response body, or an object with "error" and "status".
+    When streaming is requested, return NDJSON records instead (see
+    stream_batch_results).
+    Return a 400 error if the batch itself is invalid.
+    """
+    try:
+        data = request.json
+        plans, cells = plan_batch(data)
+        if wants_stream(data, request.headers.get("Accept", "")):
+            return Response(stream_batch_results(plans, cells), mimetype=NDJSON_MIMETYPE)
+        results = [None] * len(plans)
+        for index, result in iter_batch_results(plans, cells):
+            results[index] = result
+        return jsonify({"results": results})
+
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return error_response(e)
 
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,574 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+import numpy as np
+
+from aggregate import numeric
+from forecast import CompactForecast
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Sections of a forecast that are archived, each in its own table
+ARCHIVE_SECTIONS = ("current", "hourly", "daily")
+
+# One index record per archived forecast section: the spatial cell, when it
+# was fetched (Unix time), its first row in the column files, its number of
+# rows and the location's UTC offset
+INDEX_DTYPE = np.dtype([
+    ("lat", "<f8"),
+    ("lon", "<f8"),
+    ("issued", "<f8"),
+    ("start", "<i8"),
+    ("count", "<i4"),
+    ("utc_offset", "<i4"),
+])
+
+# Column files are named after the variable plus the dtype of their values:
+# local times as minutes since the epoch, integer variables (WMO codes,
+# percentages, degrees) as int16 and everything else as float32
+TIME_COLUMN = "time"
+_SUFFIXES = {"i8": np.dtype("<i8"), "i2": np.dtype("<i2"), "f4": np.dtype("<f4")}
+
+# Marks a missing value in an int16 column; float32 columns use NaN
+INT_MISSING = np.iinfo(np.int16).min
+
+# Decimals of archived float values in responses, which undoes the float32
+# rounding of values the Forecast API reports with one or two decimals
+DECIMALS = 2
+
+_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+_INDEX_FILE = "index"
+_LOCK_FILE = "lock"
+
+
+class ArchiveError(Exception):
+    """
+    Raised when archived rows cannot be read back, e.g. a time column cut
+    short behind the index.
+    """
+
+
+class _FileLock:
+    """
+    Exclusive lock on a file across processes (where fcntl is available),
+    so workers sharing an archive append one at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+def _encode(values, dtype, count):
+    """
+    :param values: numpy array of a variable's values, NaN for gaps, or None
+        for a variable the forecast does not have
+    :param dtype: dtype of the column file
+    :param count: Number of rows
+    :return: Array of ``dtype`` to append
+    """
+    if dtype.kind == "f":
+        if values is None:
+            return np.full(count, np.nan, dtype)
+        return values.astype(dtype)
+    if values is None:
+        return np.full(count, INT_MISSING, dtype)
+    if values.dtype.kind == "f":
+        missing = np.isnan(values)
+        return np.where(missing, INT_MISSING, np.rint(np.where(missing, 0, values))).astype(dtype)
+    return values.astype(dtype)
+
+
+def _dtype_for(values):
+    """
+    :return: Column dtype for a variable first archived with ``values``
+    """
+    if values.dtype.kind in "iu" and len(values):
+        if INT_MISSING < values.min() and values.max() <= np.iinfo(np.int16).max:
+            return _SUFFIXES["i2"]
+    return _SUFFIXES["f4"]
+
+
+def decode(values):
+    """
+    :param values: Slice of a column file
+    :return: List of the values with None for gaps, floats rounded to
+        DECIMALS
+    """
+    if values.dtype.kind == "f":
+        data = np.round(values.astype(np.float64), DECIMALS)
+        missing = np.isnan(data)
+    else:
+        data = values
+        missing = values == INT_MISSING
+    if missing.any():
+        return np.where(missing, None, data).tolist()
+    return data.tolist()
+
+
+class ArchiveTable:
+    """
+    One section of the archive ("hourly", ...): append-only column files,
+    one per variable, with one row per archived time step, and an index
+    with one record per archived forecast.
+
+    Appends write the rows to every column first and the index record last,
+    so the index is the commit log: readers only look at rows an index
+    record covers, and a writer that dies midway leaves rows that the next
+    append overwrites. Reads memory-map the files, and query results are
+    views into those maps.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._index = np.empty(0, INDEX_DTYPE)
+        self._cells = {}
+        self._schema = {}
+        self._maps = {}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def columns(self):
+        """
+        :return: Dict mapping each column's name to its dtype, by name
+        """
+        result = {}
+        for filename in sorted(os.listdir(self.path)):
+            name, _, suffix = filename.rpartition(".")
+            if suffix in _SUFFIXES and _NAME.match(name):
+                result[name] = _SUFFIXES[suffix]
+        return result
+
+    def _committed(self):
+        """
+        :return: Tuple of (index records, rows they cover) as stored, read
+            while holding the append lock
+        """
+        try:
+            size = os.path.getsize(self._file(_INDEX_FILE))
+        except FileNotFoundError:
+            return 0, 0
+        records = size // INDEX_DTYPE.itemsize
+        if not records:
+            return 0, 0
+        with open(self._file(_INDEX_FILE), "rb") as f:
+            f.seek((records - 1) * INDEX_DTYPE.itemsize)
+            last = np.frombuffer(f.read(INDEX_DTYPE.itemsize), INDEX_DTYPE)[0]
+        return records, int(last["start"]) + int(last["count"])
+
+    @staticmethod
+    def _write_at(path, offset, data):
+        # Truncating first drops rows of a writer that died before committing
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(data)
+
+    def append(self, cell, issued, utc_offset, times, columns):
+        """
+        Archive one forecast section.
+
+        :param cell: (latitude, longitude) of the spatial cell
+        :param issued: Unix time the forecast was fetched
+        :param utc_offset: The location's UTC offset in seconds
+        :param times: Local times of the rows as datetime64[m]
+        :param columns: Dict mapping variable name to a numpy array of one
+            value per row, NaN for gaps
+        :return: Number of rows appended
+        """
+        count = len(times)
+        columns = {
+            name: values for name, values in columns.items()
+            if _NAME.match(name) and name != TIME_COLUMN and len(values) == count
+        }
+        with self._lock, _FileLock(self._file(_LOCK_FILE)):
+            records, rows = self._committed()
+            existing = self.columns()
+            for name, values in columns.items():
+                if name not in existing:
+                    dtype = _dtype_for(values)
+                    # Rows archived before the variable appeared are gaps
+                    self._write_at(self._file(f"{name}.{dtype.str[1:]}"), 0, _encode(None, dtype, rows).tobytes())
+                    existing[name] = dtype
+            existing[TIME_COLUMN] = _SUFFIXES["i8"]
+            for name, dtype in existing.items():
+                if name == TIME_COLUMN:
+                    data = times.astype("datetime64[m]").astype(dtype)
+                else:
+                    data = _encode(columns.get(name), dtype, count)
+                self._write_at(self._file(f"{name}.{dtype.str[1:]}"), rows * dtype.itemsize, data.tobytes())
+            record = np.array([(cell[0], cell[1], issued, rows, count, utc_offset)], INDEX_DTYPE)
+            self._write_at(self._file(_INDEX_FILE), records * INDEX_DTYPE.itemsize, record.tobytes())
+        return count
+
+    def refresh(self):
+        """
+        Map index records appended since the last call, by any process.
+
+        :return: Number of index records
+        """
+        try:
+            size = os.path.getsize(self._file(_INDEX_FILE))
+        except FileNotFoundError:
+            return 0
+        records = size // INDEX_DTYPE.itemsize
+        with self._read_lock:
+            known = len(self._index)
+            if records > known:
+                index = np.memmap(self._file(_INDEX_FILE), INDEX_DTYPE, mode="r", shape=(records,))
+                cells = zip(index["lat"][known:].tolist(), index["lon"][known:].tolist())
+                for number, cell in enumerate(cells, known):
+                    self._cells.setdefault(cell, []).append(number)
+                # Appends may have added columns
+                self._schema = self.columns()
+                self._index = index
+            return len(self._index)
+
+    def _column(self, name, dtype, rows):
+        """
+        :return: The column file mapped for at least ``rows`` rows
+        :raises ArchiveError: if the time column is shorter than that
+        """
+        with self._read_lock:
+            mapped = self._maps.get(name)
+        if mapped is not None and len(mapped) >= rows:
+            return mapped
+        path = self._file(f"{name}.{dtype.str[1:]}")
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            size = 0
+        if size // dtype.itemsize < rows:
+            size = self._repair(name, dtype)
+        # A plain ndarray view of the mapping slices ~10x faster than the
+        # memmap subclass and still reads from the page cache
+        mapped = np.asarray(np.memmap(path, dtype, mode="r", shape=(size // dtype.itemsize,)))
+        with self._read_lock:
+            self._maps[name] = mapped
+        return mapped
+
+    def _repair(self, name, dtype):
+        """
+        Pad a column file that is shorter than the committed rows (e.g.
+        removed or cut short by a full disk) with gaps, so every committed
+        row reads as a value or a gap.
+
+        :return: Size of the column file in bytes
+        :raises ArchiveError: if the column is the time column, which
+            cannot be filled in
+        """
+        path = self._file(f"{name}.{dtype.str[1:]}")
+        with self._lock, _FileLock(self._file(_LOCK_FILE)):
+            _, rows = self._committed()
+            try:
+                have = os.path.getsize(path) // dtype.itemsize
+            except FileNotFoundError:
+                have = 0
+            if have < rows:
+                if name == TIME_COLUMN:
+                    raise ArchiveError(f"{path} holds {have} of {rows} committed rows")
+                self._write_at(path, have * dtype.itemsize, _encode(None, dtype, rows - have).tobytes())
+            return os.path.getsize(path)
+
+    def _snapshot(self, cell):
+        """
+        :return: Tuple of (index, the cell's record numbers, schema), read
+            together so a concurrent refresh cannot mix old and new
+        """
+        self.refresh()
+        with self._read_lock:
+            numbers = list(self._cells.get((float(cell[0]), float(cell[1])), ()))
+            return self._index, numbers, self._schema
+
+    def records(self, cell, issued_from=None, issued_to=None):
+        """
+        :param cell: (latitude, longitude) of the spatial cell
+        :param issued_from: Earliest issue time (Unix time) to include
+        :param issued_to: Latest issue time (Unix time) to include
+        :return: The cell's index records, oldest issue first
+        """
+        return self._records(self._snapshot(cell), issued_from, issued_to)
+
+    @staticmethod
+    def _records(snapshot, issued_from, issued_to):
+        index, numbers, _ = snapshot
+        if not numbers:
+            return index[:0]
+        records = index[numbers]
+        keep = np.ones(len(records), bool)
+        if issued_from is not None:
+            keep &= records["issued"] >= issued_from
+        if issued_to is not None:
+            keep &= records["issued"] <= issued_to
+        records = records[keep]
+        return records[np.argsort(records["issued"], kind="stable")]
+
+    def query(self, cell, start=None, end=None, variables=None, issued_from=None, issued_to=None):
+        """
+        Read the archived forecasts of a cell within a window of local
+        times, without copying the column data.
+
+        :param cell: (latitude, longitude) of the spatial cell
+        :param start: First local time to include (datetime64), or None
+        :param end: Last local time to include (datetime64), or None
+        :param variables: Names of the variables to read, or None for all
+        :param issued_from: Earliest issue time (Unix time), or None
+        :param issued_to: Latest issue time (Unix time), or None
+        :return: List of (index record, times, {name: values}) per forecast,
+            oldest issue first, with times as datetime64[m] and the values
+            as views into the mapped column files
+        """
+        snapshot = self._snapshot(cell)
+        records = self._records(snapshot, issued_from, issued_to)
+        if not len(records):
+            return []
+        rows = int((records["start"] + records["count"]).max())
+        names = {
+            name: dtype for name, dtype in snapshot[2].items()
+            if name == TIME_COLUMN or variables is None or name in variables
+        }
+        maps = {name: self._column(name, dtype, rows) for name, dtype in names.items()}
+        times = maps.pop(TIME_COLUMN, None)
+        if times is None:
+            return []
+        start = None if start is None else np.datetime64(start, "m").astype(np.int64)
+        end = None if end is None else np.datetime64(end, "m").astype(np.int64)
+        result = []
+        for record in records:
+            first = int(record["start"])
+            stop = first + int(record["count"])
+            stamps = times[first:stop]
+            # Each forecast's times ascend, so the window is two searches
+            if start is not None:
+                first += int(np.searchsorted(stamps, start, "left"))
+            if end is not None:
+                stop = int(record["start"]) + int(np.searchsorted(stamps, end, "right"))
+            if first >= stop:
+                continue
+            values = {name: column[first:stop] for name, column in maps.items()}
+            result.append((record, times[first:stop].view("datetime64[m]"), values))
+        return result
+
+    def info(self):
+        """
+        :return: Dict with the number of archived forecasts, rows, cells
+            and bytes on disk
+        """
+        with self._lock:
+            records, rows = self._committed()
+        size = sum(
+            os.path.getsize(self._file(name)) for name in os.listdir(self.path) if name != _LOCK_FILE
+        )
+        self.refresh()
+        return {"forecasts": records, "rows": rows, "cells": len(self._cells), "bytes": size}
+
+
+def section_columns(forecast, section):
+    """
+    :param forecast: CompactForecast
+    :param section: "current", "hourly" or "daily"
+    :return: Tuple of (local times as datetime64[m], {name: numpy array})
+        for the section, or None if the forecast does not have it
+    """
+    if section == "current":
+        current = forecast.extra.get("current")
+        if not isinstance(current, dict) or not isinstance(current.get("time"), str):
+            return None
+        try:
+            times = np.array([current["time"]], dtype="datetime64[m]")
+        except ValueError:
+            return None
+        columns = {}
+        for name, value in current.items():
+            if name in (TIME_COLUMN, "interval"):
+                continue
+            if type(value) is int:
+                columns[name] = np.array([value], dtype=np.int64)
+            elif type(value) is float or value is None:
+                columns[name] = np.array([np.nan if value is None else value])
+        return times, columns
+    series = forecast.series.get(section)
+    if series is None:
+        return None
+    times = series.stamps()
+    if times is None:
+        return None
+    columns = {}
+    for name, column in series.columns.items():
+        if name == TIME_COLUMN:
+            continue
+        values = numeric(column)
+        if values is not None:
+            columns[name] = values
+    return times, columns
+
+
+def latest_values(runs):
+    """
+    Merge archived forecasts into one series holding, for each local time,
+    the value from the most recently issued forecast that covers it.
+
+    :param runs: Result of ArchiveTable.query, oldest issue first
+    :return: Tuple of (ascending times as datetime64[m], {name: values})
+    """
+    if not runs:
+        return np.empty(0, "datetime64[m]"), {}
+    # Newest run first, so the first occurrence of a time is the latest
+    newest = runs[::-1]
+    times = np.concatenate([stamps for _, stamps, _ in newest])
+    unique, first = np.unique(times, return_index=True)
+    names = newest[0][2]
+    return unique, {name: np.concatenate([values[name] for _, _, values in newest])[first] for name in names}
+
+
+class ForecastArchive:
+    """
+    Append-only on-disk history of every fetched forecast, one ArchiveTable
+    per section, queried by spatial cell, issue time and local time.
+
+    Requests hand fetched forecasts to ``submit``, which queues them for a
+    writer thread, so appending never adds to a request's latency.
+    """
+
+    def __init__(self, path, queue_size=1024):
+        """
+        :param path: Archive directory
+        :param queue_size: Forecasts waiting to be appended before further
+            ones are dropped (and counted in ``dropped``)
+        """
+        self.path = path
+        self.tables = {section: ArchiveTable(os.path.join(path, section)) for section in ARCHIVE_SECTIONS}
+        self.errors = 0
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, cell, forecast, issued=None):
+        """
+        Archive every section of a fetched forecast.
+
+        :param cell: (latitude, longitude) of the spatial cell
+        :param forecast: CompactForecast in canonical units
+        :param issued: Unix time it was fetched (defaults to time.time())
+        :return: Number of rows appended
+        """
+        if not isinstance(forecast, CompactForecast):
+            return 0
+        issued = time.time() if issued is None else issued
+        utc_offset = getattr(forecast, "utc_offset_seconds", 0) or 0
+        rows = 0
+        for section, table in self.tables.items():
+            columns = section_columns(forecast, section)
+            if columns is not None:
+                rows += table.append(cell, issued, utc_offset, *columns)
+        return rows
+
+    def add_quietly(self, cell, forecast, issued=None):
+        """
+        Like add, but count a failure (e.g. a full disk or a column that
+        cannot be stored) in ``errors`` and log it instead of raising, so
+        archiving never fails a request or stops the writer thread.
+        """
+        try:
+            return self.add(cell, forecast, issued)
+        except Exception:
+            self.errors += 1
+            logger.exception("Could not archive the forecast of cell %s", cell)
+            return 0
+
+    def submit(self, cell, forecast):
+        """
+        Queue a fetched forecast for the writer thread, stamped with the
+        current time as its issue time.
+
+        :return: False if the queue was full and the forecast was dropped
+        """
+        if not isinstance(forecast, CompactForecast):
+            return False
+        self.ensure_running()
+        try:
+            self._queue.put_nowait((cell, forecast, time.time()))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def ensure_running(self):
+        """
+        Start the writer thread in this process if it is not running (it
+        does not survive a fork, so each worker starts its own).
+        """
+        if self._running():
+            return
+        with self._lock:
+            if self._running():
+                return
+            self._thread = threading.Thread(target=self._run, name="forecast-archive", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _running(self):
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            cell, forecast, issued = self._queue.get()
+            try:
+                self.add_quietly(cell, forecast, issued)
+            finally:
+                self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """
+        Wait until every submitted forecast has been appended, or the
+        writer thread has stopped.
+
+        :param timeout: Most seconds to wait, or None to wait until done
+        :return: True if nothing is left in the queue
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and self._running():
+                remaining = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+                if remaining <= 0:
+                    break
+                self._queue.all_tasks_done.wait(remaining)
+            return not self._queue.unfinished_tasks
+
+    def info(self):
+        """
+        :return: Per-section table info plus the number of queued, dropped
+            and failed appends
+        """
+        data = {section: table.info() for section, table in self.tables.items()}
+        data["queued"] = self._queue.qsize()
+        data["dropped"] = self.dropped
+        data["errors"] = self.errors
+        return data
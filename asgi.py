@@ -0,0 +1,248 @@
+"""
+ASGI entry point for the weather app.
+
+POST /api/weather is served natively by coroutines sharing the async HTTP
+client of upstream.default_client, so thousands of in-flight requests
+multiplex on a few processes instead of each holding a worker for the whole
+upstream round-trip. Every other route is delegated to the Flask app.
+
+Run with:
+
+    uvicorn asgi:application --workers 2
+
+The synchronous Flask app (``flask run`` / any WSGI server) stays available.
+"""
+import json
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as weather_app
+import upstream
+from singleflight import AsyncSingleFlight
+from metrics import SERVER_TIMING, RequestTimer, timed
+from resilience import UpstreamUnavailableError
+from serialization import dumps
+
+GEOCODE_TIMEOUT = 5
+FORECAST_TIMEOUT = 10
+
+# Concurrent misses for one key on this event loop share a single fetch
+forecast_flights = AsyncSingleFlight()
+
+
+def rate_limit_retry_after(scope):
+    """
+    Count a request against the rate limits of the Flask weather views,
+    sharing their per-client and global counters.
+
+    :param scope: ASGI connection scope
+    :return: Seconds until the exhausted limit frees up, or None if the
+        request is admitted
+    """
+    client = scope["client"][0] if scope.get("client") else "unknown"
+    return weather_app.hit_rate_limits(client, weather_app.RATE_LIMIT_PER_CLIENT, "weather")
+
+
+async def get_coords(city):
+    """
+    Coroutine version of app.get_coords.
+
+    :param city: City name
+    :return: Tuple of latitude, longitude, city name, country name
+    :raises ValueError: if city not found
+    """
+    with timed("geocode"):
+        place = weather_app.geocoding_index.lookup(city)
+        if place is not None:
+            weather_app.touch_geocoded_place(city)
+            return place.as_tuple()
+        resp = await upstream.async_get(
+            weather_app.GEOCODING_API,
+            params=weather_app.geocode_params(city),
+            timeout=GEOCODE_TIMEOUT,
+        )
+        resp.raise_for_status()
+        return weather_app.index_geocode_result(city, resp.json()).as_tuple()
+
+
+async def fetch_weather(lat, lon, forecast_type):
+    """
+    Coroutine version of app.fetch_weather.
+
+    :return: The JSON response from the Open-Meteo API
+    :raises httpx.HTTPError: on request errors
+    """
+    with timed("upstream"):
+        resp = await upstream.async_get(
+            weather_app.OPEN_METEO_BASE,
+            params=weather_app.forecast_params(lat, lon, forecast_type),
+            timeout=FORECAST_TIMEOUT,
+        )
+        resp.raise_for_status()
+        return resp.json()
+
+
+async def cached_weather_entry(lat, lon, forecast_type):
+    """
+    Look up or fetch the forecast cache entry for a spatial cell.
+
+    :return: Tuple of (cache key, Entry)
+    """
+    fetched_type = weather_app.fetched_forecast_type(forecast_type, (lat, lon))
+    key = (float(lat), float(lon), fetched_type)
+    cache = weather_app.forecast_cache
+    ttl = cache.ttl_for(fetched_type)
+    # Background refreshes run on the cache's thread pool with the sync client
+    with timed("cache"):
+        entry = cache.lookup(key, lambda: weather_app.store_forecast(key, weather_app.fetch_weather(*key)), ttl)
+    if entry is None:
+        async def fetch_and_store():
+            weather = await fetch_weather(*key)
+            return cache.set(key, weather_app.store_forecast(key, weather), ttl)
+
+        try:
+            entry, shared = await forecast_flights.do(key, fetch_and_store)
+        except Exception:
+            entry = cache.fallback(key)
+            if entry is None:
+                raise
+            return key, entry
+        if shared:
+            cache.stats.incr("coalesced")
+    return key, entry
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, payload, status=200, headers=()):
+    body = dumps(payload)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_encoded(send, encoded, headers):
+    status, response_headers, body = encoded.respond(
+        headers.get(b"accept-encoding", b"").decode("latin-1"),
+        headers.get(b"if-none-match", b"").decode("latin-1") or None,
+    )
+    response_headers = [(k.lower().encode(), v.encode()) for k, v in response_headers]
+    response_headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_ndjson(send, chunks):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", weather_app.NDJSON_MIMETYPE.encode())],
+    })
+    for chunk in chunks:
+        await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def api_weather(scope, receive, send):
+    """
+    Async handler for POST /api/weather with the same request and response
+    format as app.api_weather, timed like the Flask routes.
+    """
+    timer = RequestTimer("/api/weather")
+
+    async def send_timed(message):
+        if message["type"] == "http.response.start":
+            timer.finish(message["status"])
+            if SERVER_TIMING:
+                message = {**message, "headers": [*message["headers"], (b"server-timing", timer.server_timing().encode())]}
+        await send(message)
+
+    await _api_weather(scope, receive, send_timed)
+
+
+async def _api_weather(scope, receive, send):
+    try:
+        retry_after = rate_limit_retry_after(scope)
+        if retry_after is not None:
+            await _send_json(send, {"error": "Rate limit exceeded"}, 429, [(b"retry-after", str(retry_after).encode())])
+            return
+        data = json.loads(await _read_body(receive))
+        units = data.get("units", "celsius")
+        forecast_type = data.get("forecast_type", "hourly")
+        target_units = weather_app.parse_units(
+            units, data.get("wind_speed_unit"), data.get("precipitation_unit")
+        )
+        shape = weather_app.parse_shape(data)
+
+        if data.get("city"):
+            lat, lon, city_found, country = await get_coords(data["city"])
+        else:
+            lat, lon = weather_app.parse_coordinates(data.get("lat"), data.get("lon"))
+            city_found, country = "Coordinates", ""
+
+        cell_lat, cell_lon = weather_app.spatial_keyer.cell(lat, lon)
+        key, entry = await cached_weather_entry(cell_lat, cell_lon, forecast_type)
+        headers = dict(scope["headers"])
+        if weather_app.wants_stream(data, headers.get(b"accept", b"").decode("latin-1")):
+            weather = weather_app.render_forecast(entry.value, key[2], forecast_type, target_units, shape)
+            body = weather_app.weather_response(
+                city_found, country, lat, lon, units, forecast_type, weather
+            )
+            await _send_ndjson(send, weather_app.stream_weather_response(body))
+            return
+        encoded = weather_app.encode_weather_response(
+            entry, key, forecast_type, target_units, shape, (city_found, country, lat, lon, units)
+        )
+        await _send_encoded(send, encoded, headers)
+
+    except weather_app.RequestError as e:
+        await _send_json(send, {"error": str(e)}, 400)
+    except UpstreamUnavailableError as e:
+        retry_after = str(max(1, round(e.retry_after))).encode()
+        await _send_json(send, {"error": str(e)}, 503, [(b"retry-after", retry_after)])
+    except Exception as e:
+        await _send_json(send, {"error": str(e)}, 500)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await upstream.default_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+_flask = WsgiToAsgi(weather_app.app)
+
+
+async def application(scope, receive, send):
+    """
+    ASGI application: native async /api/weather, Flask for everything else.
+    """
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif (
+        scope["type"] == "http"
+        and scope["path"] == "/api/weather"
+        and scope["method"] == "POST"
+    ):
+        await api_weather(scope, receive, send)
+    else:
+        await _flask(scope, receive, send)
@@ -0,0 +1,164 @@
+"""
+Measure computing the daily view from a cached hourly forecast, vectorized
+with NumPy against a pure-Python loop over the same hourly lists.
+
+Both compute the daily variables the app otherwise fetches from upstream,
+plus the daily heat index maximum and wind chill minimum, and must agree.
+Also timed is rendering a daily response from a cached hourly entry, which
+replaces an upstream call, next to rendering an upstream daily entry.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_aggregate [--days 7] [--repeat 200]
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+import app
+from aggregate import DAILY_AGGREGATES, DERIVED_DAILY, daily_from_hourly
+from benchmarks.stub_upstream import forecast_payload
+from forecast import CompactForecast
+from units import resolve_units
+
+
+def hourly_forecast(days, seed):
+    """
+    :return: Forecast document with ``days`` days of hourly data, with
+        noise and gaps so no two hours are alike
+    """
+    params = {k: str(v) for k, v in app.forecast_params(48.2, 16.4, "hourly").items()}
+    doc = forecast_payload(params, hours=days * 24)
+    rng = random.Random(seed)
+    hourly = doc["hourly"]
+    hourly["temperature_2m"] = [round(v * 2.5 + rng.uniform(-4, 4), 1) for v in hourly["temperature_2m"]]
+    hourly["wind_speed_10m"] = [round(rng.uniform(0, 40), 1) for _ in hourly["time"]]
+    hourly["wind_direction_10m"] = [rng.randrange(360) for _ in hourly["time"]]
+    hourly["relative_humidity_2m"] = [rng.randrange(10, 100) for _ in hourly["time"]]
+    hourly["precipitation"] = [None if rng.random() < 0.02 else round(max(0.0, rng.gauss(0, 1)), 1)
+                               for _ in hourly["time"]]
+    return doc
+
+
+def heat_index(c, rh):
+    t = c * 1.8 + 32
+    if t < 80:
+        return c
+    hi = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    if (hi + t) / 2 >= 80:
+        hi = (-42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+              - 6.83783e-3 * t * t - 5.481717e-2 * rh * rh + 1.22874e-3 * t * t * rh
+              + 8.5282e-4 * t * rh * rh - 1.99e-6 * t * t * rh * rh)
+        if rh < 13 and 80 <= t <= 112:
+            hi -= (13 - rh) / 4 * math.sqrt(max(0.0, 17 - abs(t - 95)) / 17)
+        elif rh > 85 and 80 <= t <= 87:
+            hi += (rh - 85) / 10 * (87 - t) / 5
+    return (hi - 32) / 1.8
+
+
+def wind_chill(c, v):
+    if c <= 10 and v > 4.8:
+        return 13.12 + 0.6215 * c - 11.37 * v ** 0.16 + 0.3965 * c * v ** 0.16
+    return c
+
+
+def daily_loop(hourly):
+    """
+    Pure-Python reference: one pass over the hours per day.
+
+    :param hourly: "hourly" section of a forecast document
+    :return: "daily" section with the same variables as daily_from_hourly
+    """
+    days = {}
+    for i, stamp in enumerate(hourly["time"]):
+        days.setdefault(stamp[:10], []).append(i)
+    daily = {"time": list(days)}
+    for name in DAILY_AGGREGATES:
+        daily[name] = []
+    for hours in days.values():
+        values = {name: [hourly[name][i] for i in hours if hourly[name][i] is not None]
+                  for name in app.HOURLY_VARIABLES.split(",")}
+        heat = [round(heat_index(hourly["temperature_2m"][i], hourly["relative_humidity_2m"][i]), 1) for i in hours]
+        chill = [round(wind_chill(hourly["temperature_2m"][i], hourly["wind_speed_10m"][i]), 1) for i in hours]
+        sin = cos = 0.0
+        for i in hours:
+            speed, direction = hourly["wind_speed_10m"][i], math.radians(hourly["wind_direction_10m"][i])
+            sin += speed * math.sin(direction)
+            cos += speed * math.cos(direction)
+        daily["temperature_2m_max"].append(max(values["temperature_2m"]))
+        daily["temperature_2m_min"].append(min(values["temperature_2m"]))
+        daily["weather_code"].append(max(values["weather_code"]))
+        daily["wind_speed_10m_max"].append(max(values["wind_speed_10m"]))
+        daily["wind_direction_10m_dominant"].append(round(math.degrees(math.atan2(sin, cos)) % 360))
+        daily["precipitation_sum"].append(round(sum(values["precipitation"]), 1))
+        daily["precipitation_probability_max"].append(max(values["precipitation_probability"]))
+        daily["relative_humidity_2m_max"].append(max(values["relative_humidity_2m"]))
+        daily["uv_index_max"].append(max(values["uv_index"]))
+        daily["heat_index_max"].append(max(heat))
+        daily["wind_chill_min"].append(min(chill))
+    return daily
+
+
+def per_call(function, repeat):
+    """
+    :return: Best-of-three mean seconds per call of ``function()``
+    """
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--days", type=int, action="append", help="forecast length, repeatable (default: 7, 16, 92)")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    results = []
+    target = resolve_units("celsius")
+    for days in args.days or (7, 16, 92):
+        doc = hourly_forecast(days, args.seed)
+        compact = CompactForecast(doc)
+        hourly = compact.series["hourly"]
+
+        series, _ = daily_from_hourly(hourly, extra=DERIVED_DAILY)
+        vectorized = series.to_dict()
+        looped = daily_loop(doc["hourly"])
+        mismatched = [name for name in looped if vectorized.get(name) != looped[name]]
+
+        numpy_s = per_call(lambda: daily_from_hourly(hourly, extra=DERIVED_DAILY), args.repeat)
+        loop_s = per_call(lambda: daily_loop(doc["hourly"]), max(1, args.repeat // 10))
+        render_s = per_call(lambda: app.render_forecast(compact, "hourly", "daily", target), args.repeat)
+        upstream_daily = CompactForecast(forecast_payload(
+            {k: str(v) for k, v in app.forecast_params(48.2, 16.4, "daily").items()}, days=days
+        ))
+        render_upstream_s = per_call(
+            lambda: app.render_forecast(upstream_daily, "daily", "daily", target), args.repeat
+        )
+        row = {
+            "days": days,
+            "hours": days * 24,
+            "numpy_us": round(numpy_s * 1e6, 1),
+            "python_loop_us": round(loop_s * 1e6, 1),
+            "speedup": round(loop_s / numpy_s, 1),
+            "render_daily_from_hourly_us": round(render_s * 1e6, 1),
+            "render_upstream_daily_us": round(render_upstream_s * 1e6, 1),
+            "mismatched": mismatched,
+        }
+        results.append(row)
+        print(f"{days:>4} days  numpy {row['numpy_us']:>8} us  python loop {row['python_loop_us']:>9} us"
+              f"  x{row['speedup']:<5}  render daily from hourly {row['render_daily_from_hourly_us']:>7} us"
+              f" (upstream daily entry {row['render_upstream_daily_us']} us)"
+              f"  mismatched {mismatched or 'none'}")
+    print(json.dumps({"repeat": args.repeat, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Measure appending fetched forecasts to the forecast archive and querying it
+back by location, issue time and local time.
+
+``--forecasts`` forecasts (current, 168 hourly and 7 daily steps, built
+from stub upstream responses) are archived round-robin over ``--cells``
+spatial cells, one issue per cell and hour, so every cell ends up with a
+history of overlapping forecasts. Then a cell's history is read back: all
+forecasts covering one day, the latest value per hour over the whole
+history, an issue-time window, the same query on a freshly opened archive
+(mapping the index on first use) and /api/archive end to end. Also timed
+is what a request pays to hand a forecast to the archive's writer thread.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_archive [--forecasts 20000] [--cells 500] [--path DIR]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+import app
+from archive import ForecastArchive, latest_values
+from benchmarks.stub_upstream import forecast_payload
+from forecast import CompactForecast, Series, TimeAxis
+
+ISSUED_START = 1714521600.0  # 2024-05-01T00:00Z
+
+
+def templates(cells, seed):
+    """
+    :return: One (cell, CompactForecast) per spatial cell, in canonical units
+    """
+    rng = random.Random(seed)
+    result = []
+    for _ in range(cells):
+        cell = app.spatial_keyer.cell(rng.uniform(-60, 70), rng.uniform(-180, 180))
+        params = {k: str(v) for k, v in app.forecast_params(cell[0], cell[1], "all").items()}
+        result.append((cell, CompactForecast(forecast_payload(params))))
+    return result
+
+
+def issue(forecast, hours):
+    """
+    :return: ``forecast`` as if issued ``hours`` hours later: every time
+        axis and the current time moved forward
+    """
+    series = {}
+    for name, section in forecast.series.items():
+        axis = section.time
+        shift = np.timedelta64(hours, "h") if name == "hourly" else np.timedelta64(hours // 24, "D")
+        series[name] = Series(TimeAxis(axis.start + shift, axis.step, axis.count, axis.unit), section.columns)
+    current = dict(forecast.extra["current"])
+    current["time"] = str(np.datetime64(current["time"], "m") + np.timedelta64(hours, "h"))
+    return forecast.replace(series, {"current": current})
+
+
+def per_call(function, repeat):
+    """
+    :return: Best-of-three mean seconds per call of ``function()``
+    """
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best
+
+
+def run(path, args):
+    cells = templates(args.cells, args.seed)
+    archive = ForecastArchive(path)
+    rows = 0
+    elapsed = 0.0
+    for number in range(args.forecasts):
+        hours, slot = divmod(number, len(cells))
+        cell, template = cells[slot]
+        forecast = issue(template, hours)
+        start = time.perf_counter()
+        rows += archive.add(cell, forecast, issued=ISSUED_START + hours * 3600)
+        elapsed += time.perf_counter() - start
+    info = archive.info()
+    ingest = {
+        "forecasts": args.forecasts,
+        "rows": rows,
+        "seconds": round(elapsed, 2),
+        "forecasts_per_s": round(args.forecasts / elapsed),
+        "rows_per_s": round(rows / elapsed),
+        "append_us": round(elapsed / args.forecasts * 1e6, 1),
+        "bytes": sum(table["bytes"] for table in info.values() if isinstance(table, dict)),
+    }
+    ingest["bytes_per_row"] = round(ingest["bytes"] / rows, 1)
+    # What a request pays: handing the forecast to the writer thread
+    queued = ForecastArchive(os.path.join(path, "queued"), queue_size=args.forecasts)
+    forecasts = [
+        issue(cells[number % len(cells)][1], number // len(cells)) for number in range(min(args.forecasts, 1000))
+    ]
+    start = time.perf_counter()
+    for number, forecast in enumerate(forecasts):
+        queued.submit(cells[number % len(cells)][0], forecast)
+    ingest["submit_us"] = round((time.perf_counter() - start) / len(forecasts) * 1e6, 1)
+    queued.flush()
+    print(f"ingest   {ingest['forecasts']} forecasts, {ingest['rows']} rows in {ingest['seconds']} s"
+          f"  {ingest['forecasts_per_s']} forecasts/s  {ingest['rows_per_s']} rows/s"
+          f"  {ingest['append_us']} us/forecast  {ingest['bytes'] / 1e6:.1f} MB"
+          f" ({ingest['bytes_per_row']} B/row)  submit {ingest['submit_us']} us/forecast")
+
+    hourly = archive.tables["hourly"]
+    cell = cells[0][0]
+    history = len(hourly.records(cell))
+    day_start = np.datetime64(str(cells[0][1].series["hourly"].time.start), "m") + np.timedelta64(history, "h")
+    day_end = day_start + np.timedelta64(23, "h")
+    issued_to = ISSUED_START + history // 2 * 3600
+    client = app.app.test_client()
+    app.forecast_archive = archive
+    url = (f"/api/archive?lat={cell[0]}&lon={cell[1]}"
+           f"&start={day_start}&end={day_end}&view=latest&variables=temperature_2m,precipitation")
+    queries = {
+        "day_all_runs": lambda: hourly.query(cell, day_start, day_end),
+        "latest_whole_history": lambda: latest_values(hourly.query(cell)),
+        "issued_window": lambda: hourly.query(cell, issued_to=issued_to),
+        "cold_open_day_all_runs": lambda: ForecastArchive(path).tables["hourly"].query(cell, day_start, day_end),
+        "endpoint_latest_day": lambda: client.get(url),
+    }
+    assert client.get(url).status_code == 200
+    latency = {}
+    for name, query in queries.items():
+        latency[name] = round(per_call(query, args.repeat) * 1e6, 1)
+        print(f"query    {name:<24} {latency[name]:>9} us")
+    runs = hourly.query(cell, day_start, day_end)
+    return {
+        "cells": args.cells,
+        "history_per_cell": history,
+        "runs_covering_day": len(runs),
+        "ingest": ingest,
+        "query_us": latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--forecasts", type=int, default=20000)
+    parser.add_argument("--cells", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--path", help="archive directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    if args.path:
+        result = run(args.path, args)
+    else:
+        with tempfile.TemporaryDirectory() as path:
+            result = run(path, args)
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
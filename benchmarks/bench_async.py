@@ -0,0 +1,155 @@
+"""
+Compare throughput and tail latency of the sync (gunicorn + Flask) and async
+(uvicorn + asgi.py) serving modes against a local stub upstream.
+
+Every request uses fresh coordinates so each one pays a full upstream
+round-trip; this is the worst case the async path is designed for.
+
+Run from the repository root (needs gunicorn and uvicorn installed):
+
+    python -m benchmarks.bench_async [--requests 2000] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.stub_upstream import serve_in_subprocess
+
+SERVERS = {
+    "sync": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "--workers", str(workers),
+        "--bind", f"127.0.0.1:{port}", "--log-level", "warning", "app:app",
+    ],
+    "async": lambda port, workers: [
+        sys.executable, "-m", "uvicorn", "--workers", str(workers),
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "asgi:application",
+    ],
+}
+
+
+def percentile(values, pct):
+    """
+    :param values: Sorted list of numbers
+    :param pct: Percentile between 0 and 100
+    :return: Nearest-rank percentile of ``values``
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(pct / 100 * len(values))) - 1))
+    return values[rank]
+
+
+async def drive(url, total, concurrency, seed):
+    """
+    Send ``total`` POST /api/weather requests with at most ``concurrency``
+    in flight.
+
+    :return: Dict with req/s, latency percentiles (ms) and error count
+    """
+    rng = random.Random(seed)
+    bodies = [{"lat": rng.uniform(-60, 70), "lon": rng.uniform(-180, 180)} for _ in range(total)]
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                body = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body)
+                    if resp.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "req_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def wait_for_port(url, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def run_mode(mode, args, upstream):
+    env = dict(
+        os.environ,
+        OPEN_METEO_BASE=f"{upstream}/v1/forecast",
+        GEOCODING_API=f"{upstream}/v1/search",
+        SPATIAL_KEY_MODE="exact",
+        # Every request comes from one address and most need the upstream:
+        # measure the serving modes, not admission control
+        RATE_LIMIT_ENABLED="0",
+        UPSTREAM_MAX_CONCURRENCY="0",
+    )
+    port = args.port + (1 if mode == "async" else 0)
+    proc = subprocess.Popen(SERVERS[mode](port, args.workers), env=env)
+    try:
+        wait_for_port(f"http://127.0.0.1:{port}/api/cache/stats")
+        result = asyncio.run(drive(
+            f"http://127.0.0.1:{port}/api/weather", args.requests, args.concurrency, args.seed
+        ))
+    finally:
+        proc.terminate()
+        proc.wait()
+    result["mode"] = mode
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.2, help="stub upstream delay in seconds")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub_port = args.port - 100
+    stub = serve_in_subprocess(stub_port, args.latency)
+    try:
+        results = [run_mode(mode, args, f"http://127.0.0.1:{stub_port}") for mode in SERVERS]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    for row in results:
+        print(f"{row['mode']:<6} {row['req_per_s']:>8} req/s  p50 {row['p50_ms']:>7} ms"
+              f"  p99 {row['p99_ms']:>7} ms  errors {row['errors']}")
+    print(json.dumps({"workers": args.workers, "concurrency": args.concurrency,
+                      "upstream_latency_s": args.latency, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
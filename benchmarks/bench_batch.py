@@ -0,0 +1,96 @@
+"""
+Compare /api/weather/batch with one /api/weather call per location.
+
+The app is driven in-process through the Flask test client against the
+local stub upstream. Each scenario starts from an empty cache ("cold") and
+is then repeated with every location cached ("warm"). Reported are the
+wall time, the upstream forecast calls and the time per location.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batch [--locations 200] [--latency 0.05]
+"""
+import argparse
+import json
+import random
+import time
+
+import app
+from benchmarks.stub_upstream import StubUpstream, serve_in_thread
+
+
+def generate_locations(count, seed):
+    """
+    :return: ``count`` coordinate dicts, about one in ten a duplicate site
+    """
+    rng = random.Random(seed)
+    sites = [{"lat": round(rng.uniform(-60, 70), 4), "lon": round(rng.uniform(-180, 180), 4)}
+             for _ in range(count - count // 10)]
+    return sites + rng.sample(sites, count - len(sites))
+
+
+def run_single(client, locations):
+    for location in locations:
+        response = client.post("/api/weather", json=location)
+        assert response.status_code == 200, response.get_json()
+
+
+def run_batch(client, locations):
+    response = client.post("/api/weather/batch", json={"locations": locations})
+    assert response.status_code == 200, response.get_json()
+    assert all("error" not in r for r in response.get_json()["results"])
+
+
+def measure(name, run, client, locations, stub):
+    """
+    :return: Result rows for a cold and a warm run of ``run``
+    """
+    app.forecast_cache.clear()
+    rows = []
+    for phase in ("cold", "warm"):
+        calls_before = stub.calls["forecast"]
+        start = time.perf_counter()
+        run(client, locations)
+        elapsed = time.perf_counter() - start
+        rows.append({
+            "mode": name,
+            "phase": phase,
+            "seconds": round(elapsed, 3),
+            "upstream_calls": stub.calls["forecast"] - calls_before,
+            "ms_per_location": round(elapsed / len(locations) * 1000, 3),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--port", type=int, default=9104)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=args.latency)
+    server = serve_in_thread(stub, args.port)
+    app.OPEN_METEO_BASE = f"http://127.0.0.1:{args.port}/v1/forecast"
+    app.forecast_cache.refresher = None
+    app.limiter.enabled = False
+    app.spatial_keyer = app.SpatialKeyer("exact")
+    app.forecast_cache.backend.maxsize = max(app.forecast_cache.backend.maxsize, args.locations)
+    client = app.app.test_client()
+    locations = generate_locations(args.locations, args.seed)
+    try:
+        results = measure("single", run_single, client, locations, stub)
+        results += measure("batch", run_batch, client, locations, stub)
+    finally:
+        server.should_exit = True
+
+    for row in results:
+        print(f"{row['mode']:<7} {row['phase']:<5} {row['seconds']:>8.3f} s"
+              f"  upstream calls {row['upstream_calls']:>4}"
+              f"  {row['ms_per_location']:>8.3f} ms/location")
+    print(json.dumps({"locations": args.locations, "latency": args.latency, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
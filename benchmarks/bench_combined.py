@@ -0,0 +1,116 @@
+"""
+Compare the "split" and "combined" forecast fetch modes.
+
+Simulated dashboard sessions open a location in one forecast view and
+switch to the other view with a given probability (the forecast-type
+toggle). Each mode is replayed through the app's cache against the local
+stub upstream, and the upstream calls, cache entries and memory per entry
+are reported.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_combined [--sessions 2000] [--toggle-rate 0.5]
+"""
+import argparse
+import json
+import random
+import tracemalloc
+
+import app
+from benchmarks.stub_upstream import StubUpstream, serve_in_thread
+from cache import ForecastCache, MemoryBackend
+
+
+def generate_sessions(count, locations, toggle_rate, seed):
+    """
+    :param count: Number of dashboard sessions
+    :param locations: Number of distinct locations, Zipf distributed
+    :param toggle_rate: Probability that a session also opens the other view
+    :param seed: Random seed for a reproducible replay
+    :return: List of request lists, each a list of (lat, lon, forecast_type)
+    """
+    rng = random.Random(seed)
+    points = [(round(rng.uniform(-60, 70), 1), round(rng.uniform(-180, 180), 1)) for _ in range(locations)]
+    weights = [1 / (rank + 1) for rank in range(locations)]
+    sessions = []
+    for _ in range(count):
+        lat, lon = rng.choices(points, weights)[0]
+        first = rng.choice(("hourly", "daily"))
+        requests = [(lat, lon, first)]
+        if rng.random() < toggle_rate:
+            requests.append((lat, lon, "daily" if first == "hourly" else "hourly"))
+        sessions.append(requests)
+    return sessions
+
+
+def replay(mode, sessions, stub):
+    """
+    :return: Result row for ``mode`` after replaying ``sessions``
+    """
+    app.FORECAST_FETCH_MODE = mode
+    # max_bytes only switches on size accounting; it is never reached
+    app.forecast_cache = ForecastCache(MemoryBackend(maxsize=0, max_bytes=2 ** 40))
+    calls_before = stub.calls["forecast"]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    requests = 0
+    with app.app.test_request_context():
+        for session in sessions:
+            for lat, lon, forecast_type in session:
+                app.serve_weather({"lat": lat, "lon": lon, "forecast_type": forecast_type})
+                requests += 1
+    app.response_memo.clear()
+    # Responses are garbage by now; what remains traced is the cache
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    info = app.forecast_cache.info()
+    entries = info["size"]
+    return {
+        "mode": mode,
+        "requests": requests,
+        "upstream_calls": stub.calls["forecast"] - calls_before,
+        "cache_entries": entries,
+        "pickled_bytes_per_entry": round(app.forecast_cache.backend.bytes_used / entries),
+        "heap_bytes_per_entry": round(retained / entries),
+        "heap_bytes_total": retained,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--locations", type=int, default=300)
+    parser.add_argument("--toggle-rate", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=9103)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = StubUpstream(latency=0)
+    server = serve_in_thread(stub, args.port)
+    app.OPEN_METEO_BASE = f"http://127.0.0.1:{args.port}/v1/forecast"
+    sessions = generate_sessions(args.sessions, args.locations, args.toggle_rate, args.seed)
+    try:
+        results = [replay(mode, sessions, stub) for mode in ("split", "combined")]
+    finally:
+        server.should_exit = True
+
+    split, combined = results
+    for row in results:
+        print(f"{row['mode']:<9} upstream calls {row['upstream_calls']:>5}"
+              f"  entries {row['cache_entries']:>4}"
+              f"  pickled {row['pickled_bytes_per_entry']:>6} B/entry"
+              f"  heap {row['heap_bytes_per_entry']:>6} B/entry"
+              f"  heap total {row['heap_bytes_total'] / 2 ** 20:.1f} MiB")
+    reduction = 1 - combined["upstream_calls"] / split["upstream_calls"]
+    print(f"combined saves {reduction:.1%} of upstream calls")
+    print(json.dumps({
+        "sessions": args.sessions,
+        "locations": args.locations,
+        "toggle_rate": args.toggle_rate,
+        "upstream_call_reduction": round(reduction, 4),
+        "results": results,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure the memory taken by a cached forecast, before and after compaction.
+
+For each forecast type a set of distinct locations is decoded from
+Forecast-API-shaped JSON (built by the stub upstream from the app's own
+variable lists) and kept either as the plain decoded dict or as a
+CompactForecast. Heap bytes per cached location are measured with
+tracemalloc, together with the cost of rebuilding the JSON shape on demand.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_memory [--locations 500]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import app
+from benchmarks.stub_upstream import forecast_payload
+from forecast import CompactForecast
+
+
+def bodies(forecast_type, count):
+    """
+    :return: ``count`` JSON bodies for distinct locations
+    """
+    result = []
+    for i in range(count):
+        params = app.forecast_params(-60 + i * 0.25, -180 + i * 0.7, forecast_type)
+        result.append(json.dumps(forecast_payload({k: str(v) for k, v in params.items()})))
+    return result
+
+
+def retained_bytes(build, items):
+    """
+    :return: Heap bytes retained by ``[build(item) for item in items]``
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [build(item) for item in items]
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del kept
+    return retained
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--locations", type=int, default=500)
+    args = parser.parse_args()
+
+    results = []
+    for forecast_type in ("hourly", "daily", "all"):
+        docs = bodies(forecast_type, args.locations)
+        plain = retained_bytes(json.loads, docs)
+        compact = retained_bytes(lambda body: CompactForecast(json.loads(body)), docs)
+
+        cached = [CompactForecast(json.loads(body)) for body in docs[:100]]
+        start = time.perf_counter()
+        for entry in cached:
+            entry.to_dict()
+        render_us = (time.perf_counter() - start) / len(cached) * 1e6
+
+        row = {
+            "forecast_type": forecast_type,
+            "plain_bytes_per_location": round(plain / args.locations),
+            "compact_bytes_per_location": round(compact / args.locations),
+            "reduction": round(1 - compact / plain, 4),
+            "to_dict_us": round(render_us, 1),
+        }
+        results.append(row)
+        print(f"{forecast_type:<7} plain {row['plain_bytes_per_location']:>7} B/location"
+              f"  compact {row['compact_bytes_per_location']:>6} B/location"
+              f"  ({row['reduction']:.1%} smaller)  to_dict {row['to_dict_us']:.0f} us")
+    print(json.dumps({"locations": args.locations, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Overload an app server whose upstream cannot keep up, with and without
+admission control, and compare tail latency and what gets served.
+
+The stub upstream serves a fixed number of requests at once (the rest
+queue), so it sustains capacity / latency calls per second. Requests arrive
+open loop at a fixed rate: a share asks for hot, already cached locations
+and the rest for new coordinates that need an upstream call, at a rate the
+upstream cannot sustain. Latency is measured from each request's scheduled
+send time, so queueing in front of the server counts. Compared are:
+
+- unprotected: no upstream concurrency cap, no rate limits
+- bulkhead: at most --max-concurrency upstream calls per worker; misses
+  beyond it get 503 with Retry-After at once, cache hits are unaffected
+- bulkhead_rate_limit: as bulkhead, plus a global rate limit that sheds
+  excess requests with 429 before any work is done
+
+Run from the repository root (needs gunicorn installed):
+
+    python -m benchmarks.bench_overload [--rate 200] [--duration 10] [--miss-share 0.3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.bench_async import percentile, wait_for_port
+from benchmarks.stub_upstream import serve_in_subprocess
+
+
+def modes(args):
+    """
+    :return: Environment overrides of the app server per mode
+    """
+    return {
+        "unprotected": {"UPSTREAM_MAX_CONCURRENCY": "0", "RATE_LIMIT_ENABLED": "0"},
+        "bulkhead": {"UPSTREAM_MAX_CONCURRENCY": str(args.max_concurrency), "RATE_LIMIT_ENABLED": "0"},
+        "bulkhead_rate_limit": {
+            "UPSTREAM_MAX_CONCURRENCY": str(args.max_concurrency),
+            # Every request comes from one address, so the global limit is
+            # the one that matters
+            "RATE_LIMIT_PER_CLIENT": "",
+            "RATE_LIMIT_GLOBAL": args.global_limit,
+        },
+    }
+
+
+def schedule(args, hot):
+    """
+    :return: List of (send offset in seconds, "hit" or "miss", request body)
+    """
+    rng = random.Random(args.seed)
+    plan = []
+    for i in range(int(args.rate * args.duration)):
+        if rng.random() < args.miss_share:
+            body = {"lat": round(rng.uniform(-60, 70), 4), "lon": round(rng.uniform(-180, 180), 4)}
+            plan.append((i / args.rate, "miss", body))
+        else:
+            plan.append((i / args.rate, "hit", rng.choice(hot)))
+    return plan
+
+
+async def drive(url, plan, timeout):
+    """
+    Send every planned request at its offset, whatever the server's state.
+
+    :return: List of (kind, status or exception name, seconds since
+        scheduled)
+    """
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=64)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+
+        async def one(offset, kind, body):
+            await asyncio.sleep(max(0.0, start + offset - loop.time()))
+            try:
+                status = (await client.post(url, json=body)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            return kind, status, loop.time() - (start + offset)
+
+        return await asyncio.gather(*(one(*item) for item in plan))
+
+
+def summarize(mode, results, duration):
+    row = {"mode": mode, "offered_req_per_s": round(len(results) / duration, 1)}
+    for kind in ("hit", "miss"):
+        latencies = sorted(seconds for k, _, seconds in results if k == kind)
+        statuses = {}
+        for k, status, _ in results:
+            if k == kind:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+        row[kind] = {
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "statuses": statuses,
+        }
+    return row
+
+
+def run_mode(mode, env_overrides, args, stub_url, hot):
+    env = dict(
+        os.environ,
+        OPEN_METEO_BASE=f"{stub_url}/v1/forecast",
+        GEOCODING_API=f"{stub_url}/v1/search",
+        SPATIAL_KEY_MODE="exact",
+        FORECAST_CACHE_MAXSIZE=str(int(args.rate * args.duration) + len(hot)),
+        **env_overrides,
+    )
+    env.pop("FORECAST_SNAPSHOT_PATH", None)
+    base = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen([
+        sys.executable, "-m", "gunicorn", "--workers", "1", "--threads", str(args.threads),
+        "--worker-class", "gthread", "--bind", f"127.0.0.1:{args.port}", "--log-level", "warning", "app:app",
+    ], env=env)
+    try:
+        wait_for_port(f"{base}/api/cache/stats")
+        for body in hot:
+            httpx.post(f"{base}/api/weather", json=body, timeout=30).raise_for_status()
+        results = asyncio.run(drive(f"{base}/api/weather", schedule(args, hot), args.timeout))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return summarize(mode, results, args.duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rate", type=float, default=200, help="requests per second offered")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--miss-share", type=float, default=0.3, help="share of requests needing the upstream")
+    parser.add_argument("--hot", type=int, default=20, help="cached hot locations")
+    parser.add_argument("--threads", type=int, default=16, help="gthread worker threads")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="upstream calls in flight when capped")
+    parser.add_argument("--global-limit", default="150 per second")
+    parser.add_argument("--latency", type=float, default=0.1, help="stub upstream service time")
+    parser.add_argument("--capacity", type=int, default=4, help="stub upstream requests served at once")
+    parser.add_argument("--timeout", type=float, default=30, help="client timeout in seconds")
+    parser.add_argument("--port", type=int, default=9400)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed + 1)
+    hot = [{"lat": round(rng.uniform(-60, 70), 4), "lon": round(rng.uniform(-180, 180), 4)} for _ in range(args.hot)]
+    stub_port = args.port - 100
+    stub = serve_in_subprocess(stub_port, args.latency, capacity=args.capacity)
+    results = []
+    try:
+        for mode, env_overrides in modes(args).items():
+            results.append(run_mode(mode, env_overrides, args, f"http://127.0.0.1:{stub_port}", hot))
+            time.sleep(args.latency * 2)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    for row in results:
+        print(f"{row['mode']:<20} hits p50 {row['hit']['p50_ms']:>8} ms p99 {row['hit']['p99_ms']:>8} ms"
+              f" {row['hit']['statuses']}  misses p50 {row['miss']['p50_ms']:>8} ms"
+              f" p99 {row['miss']['p99_ms']:>8} ms {row['miss']['statuses']}")
+    print(json.dumps({
+        "rate": args.rate, "duration": args.duration, "miss_share": args.miss_share,
+        "upstream_capacity_per_s": round(args.capacity / args.latency, 1), "results": results,
+    }))
+
+
+if __name__ == "__main__":
+    main()
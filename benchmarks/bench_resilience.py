@@ -0,0 +1,108 @@
+"""
+Measure /api/weather throughput against a faulty upstream with and without
+the resilience policies.
+
+The app is driven in-process through the Flask test client from a pool of
+threads, every request for new coordinates so each one needs an upstream
+call. The stub upstream (in its own process) answers a share of requests
+with 503 and stalls another share for several seconds. Compared are:
+
+- fixed: one attempt with the caller's fixed timeout, no breaker (the
+  behaviour before the resilience module)
+- resilient: retries with jittered backoff, adaptive timeouts, breaker
+- hedged: as resilient, plus hedged requests after the p95 latency
+
+Run from the repository root:
+
+    python -m benchmarks.bench_resilience [--requests 400] [--threads 16]
+"""
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+import upstream
+from benchmarks.bench_async import percentile
+from benchmarks.stub_upstream import serve_in_subprocess
+from resilience import ResilientClient
+
+MODES = {
+    "fixed": dict(retries=0, adaptive_timeout=False, hedge=False, breaker_failures=0),
+    "resilient": dict(hedge=False),
+    "hedged": dict(hedge=True),
+}
+
+
+def run(mode, client, total, threads, seed):
+    """
+    :return: Result row with req/s, latency percentiles and outcomes
+    """
+    upstream.resilient_client = ResilientClient(upstream.default_client, **MODES[mode])
+    app.forecast_cache.clear()
+    rng = random.Random(seed)
+    bodies = [{"lat": round(rng.uniform(-60, 70), 4), "lon": round(rng.uniform(-180, 180), 4)} for _ in range(total)]
+
+    def one(body):
+        start = time.perf_counter()
+        status = client.post("/api/weather", json=body).status_code
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(one, bodies))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for _, seconds in results)
+    stats = next(iter(upstream.resilient_client.stats().values()), {})
+    return {
+        "mode": mode,
+        "req_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "ok": sum(1 for status, _ in results if status == 200),
+        "errors": sum(1 for status, _ in results if status != 200),
+        "upstream_attempts": stats.get("attempts", 0),
+        "hedges": stats.get("hedges", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--stall-rate", type=float, default=0.03)
+    parser.add_argument("--stall", type=float, default=5.0)
+    parser.add_argument("--port", type=int, default=9105)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    stub = serve_in_subprocess(args.port, args.latency, args.error_rate, args.stall_rate, args.stall)
+    app.OPEN_METEO_BASE = f"http://127.0.0.1:{args.port}/v1/forecast"
+    app.forecast_cache.refresher = None
+    app.limiter.enabled = False
+    app.forecast_cache.stale_if_error = 0
+    app.spatial_keyer = app.SpatialKeyer("exact")
+    app.forecast_cache.backend.maxsize = max(app.forecast_cache.backend.maxsize, args.requests)
+    client = app.app.test_client()
+    results = []
+    try:
+        for mode in MODES:
+            row = run(mode, client, args.requests, args.threads, args.seed)
+            results.append(row)
+            print(f"{mode:<9} {row['req_per_s']:>7.1f} req/s  p50 {row['p50_ms']:>7.1f} ms"
+                  f"  p99 {row['p99_ms']:>7.1f} ms  ok {row['ok']:>4}  errors {row['errors']:>4}"
+                  f"  upstream attempts {row['upstream_attempts']:>4}  hedges {row['hedges']:>3}")
+    finally:
+        stub.terminate()
+    print(json.dumps({
+        "requests": args.requests, "threads": args.threads, "latency": args.latency,
+        "error_rate": args.error_rate, "stall_rate": args.stall_rate, "stall": args.stall,
+        "results": results,
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Measure writing and loading a warm-start snapshot of the forecast cache.
+
+A snapshot of ``--locations`` cached hourly forecasts (in the compact form,
+built from stub upstream responses) is written, then loaded back into an
+empty cache as a new worker does at startup. A share of the entries is
+expired to show they are skipped without being decoded. Finally the app
+is imported in a fresh interpreter with and without the snapshot, to give
+the worker startup time.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_snapshot [--locations 10000] [--expired 0.25]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import app
+from benchmarks.stub_upstream import forecast_payload
+from cache import Entry, ForecastCache, MemoryBackend
+from forecast import CompactForecast
+from snapshot import read_snapshot, write_snapshot
+
+STARTUP_SCRIPT = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t, len(app.forecast_cache.backend))"
+
+
+def build_entries(count, expired_share):
+    """
+    :return: ``count`` (key, Entry) pairs, the first ``expired_share`` of
+        them already expired
+    """
+    now = time.time()
+    expired = int(count * expired_share)
+    entries = []
+    for i in range(count):
+        params = app.forecast_params(-60 + i * 0.01, -180 + i * 0.03, "hourly")
+        value = CompactForecast(json.loads(json.dumps(forecast_payload({k: str(v) for k, v in params.items()}))))
+        expires_at = now - 1 if i < expired else now + 3600
+        entries.append(((params["latitude"], params["longitude"], "hourly"), Entry(value, now - 60, expires_at)))
+    return entries
+
+
+def startup_seconds(env, runs=3):
+    """
+    :return: Best of ``runs`` times to import app in a new interpreter, and
+        the number of cached forecasts it started with
+    """
+    best = None
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True)
+        seconds, size = out.stdout.split()
+        best = min(best or float(seconds), float(seconds))
+    return best, int(size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--locations", type=int, default=10000)
+    parser.add_argument("--expired", type=float, default=0.25)
+    args = parser.parse_args()
+
+    entries = build_entries(args.locations, args.expired)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "forecast.snap")
+        start = time.perf_counter()
+        size = write_snapshot(path, entries)
+        write_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        loaded, _ = read_snapshot(path)
+        cache = ForecastCache(MemoryBackend(maxsize=args.locations))
+        restored = cache.restore(loaded)
+        load_s = time.perf_counter() - start
+
+        env = dict(os.environ, FORECAST_CACHE_MAXSIZE=str(args.locations), FORECAST_REFRESH_TOP_N="0")
+        cold_s, _ = startup_seconds(env)
+        warm_s, warm_size = startup_seconds(dict(env, FORECAST_SNAPSHOT_PATH=path))
+
+    result = {
+        "locations": args.locations,
+        "snapshot_bytes": size,
+        "bytes_per_entry": round(size / args.locations),
+        "write_s": round(write_s, 3),
+        "load_s": round(load_s, 3),
+        "restored": restored,
+        "startup_without_snapshot_s": round(cold_s, 3),
+        "startup_with_snapshot_s": round(warm_s, 3),
+        "cached_at_startup": warm_size,
+    }
+    print(f"snapshot {size / 1e6:.1f} MB ({result['bytes_per_entry']} B/entry), write {write_s:.3f} s")
+    print(f"load {load_s:.3f} s, {restored} of {args.locations} entries restored "
+          f"({load_s / max(restored, 1) * 1e6:.0f} us/entry)")
+    print(f"worker startup {cold_s:.3f} s without snapshot, {warm_s:.3f} s with ({warm_size} cached)")
+    print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
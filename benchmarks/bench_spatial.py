@@ -0,0 +1,101 @@
+"""
+Replay a realistic coordinate distribution through the forecast cache and
+report the hit rate for each spatial keying mode.
+
+Traffic is modelled as browsers geolocating around popular cities (Zipf
+distributed, with a few kilometres of GPS/IP jitter) plus a long tail of
+uniformly scattered points.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_spatial [--requests 50000] [--seed 1]
+"""
+import argparse
+import json
+import random
+
+from cache import ForecastCache, MemoryBackend
+from spatial import SpatialKeyer
+
+CITIES = [
+    (51.5074, -0.1278), (40.7128, -74.0060), (35.6762, 139.6503), (48.8566, 2.3522),
+    (52.5200, 13.4050), (-33.8688, 151.2093), (19.4326, -99.1332), (28.6139, 77.2090),
+    (-23.5505, -46.6333), (55.7558, 37.6173), (34.0522, -118.2437), (41.9028, 12.4964),
+    (39.9042, 116.4074), (1.3521, 103.8198), (37.5665, 126.9780), (30.0444, 31.2357),
+    (-34.6037, -58.3816), (43.6532, -79.3832), (41.0082, 28.9784), (6.5244, 3.3792),
+]
+
+MODES = [
+    SpatialKeyer("exact"),
+    SpatialKeyer("grid", resolution=0.05),
+    SpatialKeyer("grid", resolution=0.1),
+    SpatialKeyer("grid", resolution=0.25),
+    SpatialKeyer("geohash", precision=5),
+    SpatialKeyer("geohash", precision=4),
+]
+
+
+def generate_coordinates(count, seed, jitter=0.03, tail=0.1):
+    """
+    :param count: Number of coordinates to generate
+    :param seed: Random seed for a reproducible replay
+    :param jitter: Standard deviation in degrees around a city centre
+    :param tail: Fraction of requests scattered uniformly over the globe
+    :return: List of (lat, lon) tuples
+    """
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(CITIES))]
+    coords = []
+    for _ in range(count):
+        if rng.random() < tail:
+            coords.append((rng.uniform(-60, 70), rng.uniform(-180, 180)))
+        else:
+            lat, lon = rng.choices(CITIES, weights)[0]
+            coords.append((rng.gauss(lat, jitter), rng.gauss(lon, jitter)))
+    return coords
+
+
+def replay(keyer, coords, maxsize):
+    """
+    :return: Cache info after replaying ``coords`` through a fresh cache
+    """
+    cache = ForecastCache(MemoryBackend(maxsize=maxsize))
+    for lat, lon in coords:
+        key = keyer.cell(lat, lon) + ("hourly",)
+        cache.get_or_fetch(key, dict, ttl=3600)
+    return cache.info()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=50000)
+    parser.add_argument("--maxsize", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    coords = generate_coordinates(args.requests, args.seed)
+    results = []
+    for keyer in MODES:
+        info = replay(keyer, coords, args.maxsize)
+        label = {
+            "exact": "exact",
+            "grid": f"grid {keyer.resolution}deg",
+            "geohash": f"geohash p{keyer.precision}",
+        }[keyer.mode]
+        results.append({
+            "mode": label,
+            "hit_ratio": round(info["hit_ratio"], 4),
+            "upstream_calls": info["misses"],
+        })
+
+    baseline = results[0]["hit_ratio"]
+    for row in results:
+        row["hit_ratio_gain"] = round(row["hit_ratio"] - baseline, 4)
+        print(f"{row['mode']:<16} hit ratio {row['hit_ratio']:.2%}"
+              f"  upstream calls {row['upstream_calls']:>6}"
+              f"  gain {row['hit_ratio_gain']:+.2%}")
+    print(json.dumps({"requests": args.requests, "maxsize": args.maxsize, "results": results}))
+
+
+if __name__ == "__main__":
+    main()
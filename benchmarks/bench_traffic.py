@@ -0,0 +1,291 @@
+"""
+Drive the app with realistic traffic mixes against a local stub upstream and
+record throughput, latency, upstream calls and memory as JSON.
+
+Each scenario starts a fresh app server (cold cache) pointed at the stub
+Geocoding and Forecast APIs and replays a seeded request sequence: city
+names vs coordinates, a Zipf-distributed set of hot locations vs a long tail,
+and a mix of units and forecast types. Per scenario the run reports req/s,
+p50/p90/p99 latency, errors, upstream calls by API, the cache hit ratio and
+the resident memory of the app's processes. Save a run with --output and
+pass it to a later run with --compare to see the change per scenario.
+
+Run from the repository root (needs gunicorn or uvicorn installed):
+
+    python -m benchmarks.bench_traffic [--scenario mixed] [--requests 3000] [--output run.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+
+import httpx
+
+from benchmarks.bench_async import SERVERS, percentile, wait_for_port
+from benchmarks.stub_upstream import DAILY_DAYS, HOURLY_HOURS, serve_in_subprocess
+from geocoding import GEONAMES_LATITUDE, GEONAMES_LONGITUDE, GEONAMES_NAME, GEONAMES_POPULATION
+
+GAZETTEER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cities.tsv")
+
+# Traffic mixes: share of requests by city name, share aimed at the hot
+# locations, and the weights of units and forecast types
+SCENARIOS = {
+    "hot": {
+        "city": 0.5, "hot": 0.95, "hot_locations": 20,
+        "units": {"celsius": 0.7, "fahrenheit": 0.3},
+        "forecast_type": {"hourly": 0.6, "daily": 0.25, "current": 0.15},
+    },
+    "long_tail": {
+        "city": 0.3, "hot": 0.2, "hot_locations": 100,
+        "units": {"celsius": 0.7, "fahrenheit": 0.3},
+        "forecast_type": {"hourly": 0.6, "daily": 0.25, "current": 0.15},
+    },
+    "mixed": {
+        "city": 0.4, "hot": 0.8, "hot_locations": 50,
+        "units": {"celsius": 0.6, "fahrenheit": 0.4},
+        "forecast_type": {"hourly": 0.5, "daily": 0.3, "current": 0.2},
+    },
+}
+
+
+def load_places(path=GAZETTEER):
+    """
+    :return: List of (name, latitude, longitude) from the gazetteer, most
+        populous first
+    """
+    places = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) > GEONAMES_POPULATION:
+                places.append((
+                    int(fields[GEONAMES_POPULATION] or 0), fields[GEONAMES_NAME],
+                    float(fields[GEONAMES_LATITUDE]), float(fields[GEONAMES_LONGITUDE]),
+                ))
+    places.sort(reverse=True)
+    return [place[1:] for place in places]
+
+
+def generate_requests(mix, count, places, seed):
+    """
+    Build a reproducible sequence of /api/weather request bodies.
+
+    Hot requests pick one of the ``hot_locations`` most populous gazetteer
+    places with Zipf weights (by name, which resolves locally, or by its
+    coordinates); long-tail requests use names only the Geocoding API knows
+    or uniformly scattered coordinates.
+
+    :param mix: Entry of SCENARIOS
+    :param count: Number of requests
+    :param places: List from load_places
+    :param seed: Random seed
+    :return: List of request bodies
+    """
+    rng = random.Random(seed)
+    hot = places[:mix["hot_locations"]]
+    weights = [1 / rank for rank in range(1, len(hot) + 1)]
+    units, unit_weights = zip(*mix["units"].items())
+    types, type_weights = zip(*mix["forecast_type"].items())
+    bodies = []
+    for _ in range(count):
+        by_city = rng.random() < mix["city"]
+        if rng.random() < mix["hot"]:
+            name, lat, lon = rng.choices(hot, weights)[0]
+            body = {"city": name} if by_city else {"lat": lat, "lon": lon}
+        elif by_city:
+            body = {"city": f"Tailtown {rng.randrange(100000)}"}
+        else:
+            body = {"lat": round(rng.uniform(-60, 70), 4), "lon": round(rng.uniform(-180, 180), 4)}
+        body["units"] = rng.choices(units, unit_weights)[0]
+        body["forecast_type"] = rng.choices(types, type_weights)[0]
+        bodies.append(body)
+    return bodies
+
+
+async def drive(url, bodies, concurrency):
+    """
+    POST every body to ``url`` in order with at most ``concurrency`` requests
+    in flight.
+
+    :return: Dict with req/s, latency percentiles (ms) and error count
+    """
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                body = queue.get_nowait()
+                started = time.perf_counter()
+                try:
+                    resp = await client.post(url, json=body)
+                    if resp.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(bodies),
+        "errors": errors,
+        "req_per_s": round(len(bodies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def rss_bytes(pid):
+    """
+    :return: Resident memory of a process and all its descendants (e.g. a
+        gunicorn master and its workers), or None where /proc is unavailable
+    """
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except (OSError, ValueError):
+        return total or None
+    return total
+
+
+def stub_calls(stub_url):
+    return httpx.get(f"{stub_url}/stats", timeout=5).json()["calls"]
+
+
+def run_scenario(name, bodies, args, stub_url):
+    """
+    Start an app server, replay ``bodies`` against it and collect the
+    scenario's results.
+    """
+    env = dict(
+        os.environ,
+        OPEN_METEO_BASE=f"{stub_url}/v1/forecast",
+        GEOCODING_API=f"{stub_url}/v1/search",
+        # The load comes from one address
+        RATE_LIMIT_ENABLED="0",
+    )
+    env.pop("FORECAST_SNAPSHOT_PATH", None)
+    base = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen(SERVERS[args.server](args.port, args.workers), env=env)
+    try:
+        wait_for_port(f"{base}/api/cache/stats")
+        before = stub_calls(stub_url)
+        result = asyncio.run(drive(f"{base}/api/weather", bodies, args.concurrency))
+        after = stub_calls(stub_url)
+        # Sampled from one worker; with several workers this is indicative
+        cache = httpx.get(f"{base}/api/cache/stats", timeout=5).json()
+        rss = rss_bytes(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+    result.update(
+        scenario=name,
+        upstream_calls={api: after[api] - before[api] for api in after},
+        cache_hit_ratio=cache.get("hit_ratio"),
+        rss_mb=None if rss is None else round(rss / 2 ** 20, 1),
+    )
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """
+    Print the change of each scenario's throughput, tail latency, upstream
+    calls and memory against a saved run.
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {row["scenario"]: row for row in json.load(f)["results"]}
+    for row in results:
+        old = baseline.get(row["scenario"])
+        if old is None:
+            continue
+        changes = []
+        for field in ("req_per_s", "p50_ms", "p99_ms", "rss_mb"):
+            if old.get(field) and row.get(field) is not None:
+                changes.append(f"{field} {(row[field] - old[field]) / old[field]:+.1%}")
+        calls = sum(row["upstream_calls"].values()) - sum(old["upstream_calls"].values())
+        changes.append(f"upstream calls {calls:+d}")
+        print(f"{row['scenario']:<10} vs baseline: " + ", ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="scenario to run, repeatable (default: all)")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--server", choices=SERVERS, default="sync")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub upstream delay in seconds")
+    parser.add_argument("--hours", type=int, default=HOURLY_HOURS, help="hourly steps per stub forecast")
+    parser.add_argument("--days", type=int, default=DAILY_DAYS, help="daily steps per stub forecast")
+    parser.add_argument("--port", type=int, default=9300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    places = load_places()
+    stub_port = args.port - 100
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    stub = serve_in_subprocess(stub_port, args.latency, hours=args.hours, days=args.days)
+    results = []
+    try:
+        for name in args.scenario or SCENARIOS:
+            bodies = generate_requests(SCENARIOS[name], args.requests, places, args.seed)
+            results.append(run_scenario(name, bodies, args, stub_url))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    for row in results:
+        calls = row["upstream_calls"]
+        print(f"{row['scenario']:<10} {row['req_per_s']:>8} req/s  p50 {row['p50_ms']:>8} ms"
+              f"  p99 {row['p99_ms']:>8} ms  errors {row['errors']:>4}"
+              f"  upstream {calls.get('search', 0):>4} search {calls.get('forecast', 0):>5} forecast"
+              f"  rss {row['rss_mb']} MB")
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    print(json.dumps(report))
+
+
+if __name__ == "__main__":
+    main()
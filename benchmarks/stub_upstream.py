@@ -0,0 +1,245 @@
+"""
+Local stand-in for the Open-Meteo Geocoding and Forecast APIs.
+
+Answers /v1/search and /v1/forecast after a configurable delay with payloads
+shaped like the real services, so benchmarks can drive the app without
+touching the network. The number of hourly and daily steps sets the payload
+size, a capacity makes requests beyond it queue (an overloaded upstream),
+and faults can be injected: a share of requests answered with 503 and a
+share stalled for several seconds. GET /stats reports the calls served.
+
+Run from the repository root:
+
+    python -m benchmarks.stub_upstream --port 9100 --latency 0.05 [--hours 168] [--error-rate 0.05] [--stall-rate 0.02]
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import parse_qs
+
+import numpy as np
+import uvicorn
+
+HOURLY_HOURS = 168
+DAILY_DAYS = 7
+
+# First time step of every series
+_START = np.datetime64("2024-01-01T00:00", "m")
+
+# Variables the real API reports as integers
+INTEGER_VARIABLES = ("weather_code", "relative_humidity", "precipitation_probability", "wind_direction")
+
+
+def _series(count, phase, name=""):
+    values = [round(10 + 8 * math.sin((i + phase) / 24 * 2 * math.pi), 1) for i in range(count)]
+    if name.startswith(INTEGER_VARIABLES):
+        return [int(v) for v in values]
+    return values
+
+
+def forecast_payload(params, hours=HOURLY_HOURS, days=DAILY_DAYS):
+    """
+    Build a forecast document for the requested variables.
+
+    :param params: Query parameters as a dict of strings
+    :param hours: Number of hourly steps
+    :param days: Number of daily steps
+    :return: Dict shaped like an Open-Meteo forecast response
+    """
+    lat = float(params.get("latitude", "0").split(",")[0])
+    lon = float(params.get("longitude", "0").split(",")[0])
+    phase = int(abs(lat * 100 + lon * 10)) % 24
+    doc = {
+        "latitude": lat,
+        "longitude": lon,
+        "generationtime_ms": 0.5,
+        "utc_offset_seconds": 0,
+        "timezone": "GMT",
+        "timezone_abbreviation": "GMT",
+        "elevation": 35.0,
+    }
+    if params.get("current"):
+        names = params["current"].split(",")
+        doc["current"] = {"time": "2024-01-01T12:00", "interval": 900}
+        doc["current"].update({name: _series(1, phase, name)[0] for name in names})
+    if params.get("hourly"):
+        names = params["hourly"].split(",")
+        doc["hourly"] = {
+            "time": [str(_START + np.timedelta64(h, "h")) for h in range(hours)]
+        }
+        doc["hourly"].update({name: _series(hours, phase, name) for name in names})
+    if params.get("daily"):
+        names = params["daily"].split(",")
+        doc["daily"] = {"time": [str(_START.astype("datetime64[D]") + d) for d in range(days)]}
+        doc["daily"].update({name: _series(days, phase, name) for name in names})
+    return doc
+
+
+def geocode_payload(params):
+    """
+    :param params: Query parameters as a dict of strings
+    :return: A single deterministic geocoding result for the searched name
+    """
+    name = params.get("name", "")
+    seed = sum(map(ord, name))
+    return {"results": [{
+        "name": name.title(),
+        "latitude": round((seed % 140) - 70 + 0.123, 4),
+        "longitude": round((seed * 7 % 360) - 180 + 0.456, 4),
+        "country": "Stubland",
+        "population": seed,
+    }]}
+
+
+class StubUpstream:
+    """
+    ASGI app emulating the Open-Meteo APIs.
+
+    :param latency: Seconds to wait before answering each request
+    :param error_rate: Share of requests answered with a 503 (fault injection)
+    :param stall_rate: Share of requests answered only after ``stall``
+        seconds (fault injection)
+    :param stall: Delay of a stalled request in seconds
+    :param seed: Seed of the fault injection
+    :param hours: Hourly steps per forecast
+    :param days: Daily steps per forecast
+    :param capacity: Requests served at once; the rest wait their turn (0
+        for no limit)
+    """
+
+    def __init__(self, latency=0.05, error_rate=0.0, stall_rate=0.0, stall=5.0, seed=0,
+                 hours=HOURLY_HOURS, days=DAILY_DAYS, capacity=0):
+        self.latency = latency
+        self.capacity = capacity
+        self._slots = asyncio.Semaphore(capacity) if capacity else None
+        self.hours = hours
+        self.days = days
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.calls = {"search": 0, "forecast": 0}
+        self.faults = {"errors": 0, "stalls": 0}
+        self._rng = random.Random(seed)
+        self._bodies = {}
+
+    def _forecast_body(self, params):
+        # Encoding a full hourly document costs more CPU than the app spends
+        # on it, so bodies are memoized per variable set (coordinates aside).
+        key = tuple(sorted((k, v) for k, v in params.items() if k not in ("latitude", "longitude")))
+        body = self._bodies.get(key)
+        if body is None:
+            body = self._bodies[key] = json.dumps(forecast_payload(params, self.hours, self.days)).encode()
+        # Comma-separated coordinates ask for a list with one document each
+        count = params.get("latitude", "").count(",") + 1
+        if count > 1:
+            return b"[" + b",".join([body] * count) + b"]"
+        return body
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        params = {k: v[-1] for k, v in parse_qs(scope["query_string"].decode()).items()}
+        status = 200
+        if scope["path"] == "/stats":
+            # Not an Open-Meteo API: answered at once and not counted
+            body = json.dumps({"calls": self.calls, "faults": self.faults}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        if scope["path"].endswith("/search"):
+            self.calls["search"] += 1
+            body = json.dumps(geocode_payload(params)).encode()
+        elif scope["path"].endswith("/forecast"):
+            self.calls["forecast"] += 1
+            body = self._forecast_body(params)
+        else:
+            status, body = 404, b'{"error": true}'
+        delay = self.latency
+        fault = self._rng.random()
+        if fault < self.error_rate:
+            self.faults["errors"] += 1
+            status, body = 503, b'{"error": true, "reason": "injected"}'
+        elif fault < self.error_rate + self.stall_rate:
+            self.faults["stalls"] += 1
+            delay = self.stall
+        if self._slots is not None:
+            async with self._slots:
+                await asyncio.sleep(delay)
+        elif delay:
+            await asyncio.sleep(delay)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def serve_in_subprocess(port, latency, error_rate=0.0, stall_rate=0.0, stall=5.0,
+                        hours=HOURLY_HOURS, days=DAILY_DAYS, capacity=0):
+    """
+    Start the stub as a separate process so it does not compete with the
+    caller for the GIL.
+
+    :return: subprocess.Popen handle (terminate it when done)
+    """
+    proc = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.stub_upstream",
+        "--port", str(port), "--latency", str(latency),
+        "--error-rate", str(error_rate), "--stall-rate", str(stall_rate), "--stall", str(stall),
+        "--hours", str(hours), "--days", str(days), "--capacity", str(capacity),
+    ])
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.terminate()
+    raise RuntimeError("Stub upstream did not start")
+
+
+def serve_in_thread(stub, port):
+    """
+    Start ``stub`` on 127.0.0.1:``port`` in a daemon thread.
+
+    :return: The running uvicorn.Server (call ``should_exit = True`` to stop)
+    """
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="share of requests delayed by --stall")
+    parser.add_argument("--stall", type=float, default=5.0)
+    parser.add_argument("--hours", type=int, default=HOURLY_HOURS, help="hourly steps per forecast")
+    parser.add_argument("--days", type=int, default=DAILY_DAYS, help="daily steps per forecast")
+    parser.add_argument("--capacity", type=int, default=0, help="requests served at once, 0 for no limit")
+    args = parser.parse_args()
+    stub = StubUpstream(args.latency, args.error_rate, args.stall_rate, args.stall,
+                        hours=args.hours, days=args.days, capacity=args.capacity)
+    uvicorn.run(stub, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,670 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from refresh import HotKeys
+from singleflight import SingleFlight
+
+# Default time-to-live (seconds) per forecast view, following the update
+# cadence of the Open-Meteo models: current conditions refresh every 15
+# minutes, hourly runs roughly every hour and daily aggregates every few hours.
+DEFAULT_TTLS = {
+    "current": 15 * 60,
+    "hourly": 60 * 60,
+    "daily": 3 * 60 * 60,
+}
+
+
+def _sizeof(value):
+    """
+    Approximate the stored size of a cached value in bytes.
+
+    :param value: Any picklable value
+    :return: Length of the pickled representation
+    """
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class Entry:
+    """
+    A single cached forecast together with its lifetime metadata.
+
+    An entry is fresh until ``stale_at``; between ``stale_at`` and
+    ``expires_at`` it is still served but should be revalidated.
+    """
+
+    __slots__ = ("value", "created_at", "expires_at", "size", "stale_at")
+
+    def __init__(self, value, created_at, expires_at, size=0, stale_at=None):
+        self.value = value
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.size = size
+        self.stale_at = expires_at if stale_at is None else stale_at
+
+    def stale(self, now=None):
+        """
+        :param now: Timestamp to compare against (defaults to time.time())
+        :return: True if the entry is past its soft TTL
+        """
+        return (time.time() if now is None else now) >= self.stale_at
+
+    def expired(self, now=None):
+        """
+        :param now: Timestamp to compare against (defaults to time.time())
+        :return: True if the entry is past its expiry time
+        """
+        return (time.time() if now is None else now) >= self.expires_at
+
+    def ttl_remaining(self, now=None):
+        """
+        :param now: Timestamp to compare against (defaults to time.time())
+        :return: Seconds until the entry expires (never negative)
+        """
+        return max(0.0, self.expires_at - (time.time() if now is None else now))
+
+
+class CacheStats:
+    """
+    Thread-safe hit/miss/eviction counters for a cache.
+    """
+
+    FIELDS = (
+        "hits", "misses", "evictions", "expirations", "coalesced",
+        "stale_hits", "refreshes", "refresh_errors", "errors_served_stale",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def incr(self, field, amount=1):
+        if not amount:
+            return
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def reset(self):
+        with self._lock:
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+
+    def as_dict(self):
+        """
+        :return: Snapshot of the counters plus the derived hit ratio
+        """
+        with self._lock:
+            data = {field: getattr(self, field) for field in self.FIELDS}
+        lookups = data["hits"] + data["misses"]
+        data["hit_ratio"] = data["hits"] / lookups if lookups else 0.0
+        return data
+
+
+class CacheBackend:
+    """
+    Storage interface used by ForecastCache.
+
+    Backends only store and evict entries; expiry is decided by the cache so
+    every backend behaves the same way. ``set`` returns the number of entries
+    evicted to make room for the new one.
+
+    Backends shared between processes override ``acquire_lock`` and
+    ``release_lock`` so only one worker fetches a missing key at a time.
+
+    Backends that purge expired entries on their own keep them for
+    ``retain_expired`` seconds past expiry, which the owning ForecastCache
+    sets to its ``stale_if_error`` window.
+    """
+
+    name = "base"
+    retain_expired = 0
+
+    def acquire_lock(self, key, ttl):
+        """
+        Try to take the cross-process fetch lock for ``key``.
+
+        :param key: Cache key
+        :param ttl: Seconds after which an unreleased lock is considered stale
+        :return: True if this caller holds the lock
+        """
+        return True
+
+    def release_lock(self, key):
+        pass
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, entry):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def items(self):
+        """
+        :return: List of (key, Entry) pairs, least recently used first
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process LRU store bounded by entry count and, optionally, total bytes.
+    """
+
+    name = "memory"
+
+    def __init__(self, maxsize=128, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        if self.max_bytes and not entry.size:
+            entry.size = _sizeof(entry.value)
+        evicted = 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._data[key] = entry
+            self._bytes += entry.size
+            while len(self._data) > 1 and (
+                (self.maxsize and len(self._data) > self.maxsize)
+                or (self.max_bytes and self._bytes > self.max_bytes)
+            ):
+                _, dropped = self._data.popitem(last=False)
+                self._bytes -= dropped.size
+                evicted += 1
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def bytes_used(self):
+        return self._bytes
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    On-disk store shared by every worker process on the node.
+
+    Each thread (and each forked worker) opens its own connection to the same
+    database file; WAL mode lets readers proceed while another worker writes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, maxsize=1024, max_bytes=None, timeout=5.0):
+        self.path = path
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS forecast_cache ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " stale_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(forecast_cache)")}
+            if "stale_at" not in columns:
+                conn.execute("ALTER TABLE forecast_cache ADD COLUMN stale_at REAL")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS forecast_cache_accessed"
+                " ON forecast_cache (accessed_at)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS forecast_locks ("
+                " key TEXT PRIMARY KEY,"
+                " owner INTEGER NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _key(key):
+        return repr(key)
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, created_at, expires_at, size, stale_at FROM forecast_cache WHERE key = ?",
+            (self._key(key),),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE forecast_cache SET accessed_at = ? WHERE key = ?",
+            (time.time(), self._key(key)),
+        )
+        value, created_at, expires_at, size, stale_at = row
+        return Entry(pickle.loads(value), created_at, expires_at, size, stale_at)
+
+    def set(self, key, entry):
+        blob = pickle.dumps(entry.value, pickle.HIGHEST_PROTOCOL)
+        entry.size = len(blob)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO forecast_cache"
+                " (key, value, created_at, expires_at, accessed_at, size, stale_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self._key(key), blob, entry.created_at, entry.expires_at,
+                    time.time(), entry.size, entry.stale_at,
+                ),
+            )
+            evicted = self._evict(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return evicted
+
+    def _evict(self, conn):
+        """
+        Drop rows past expiry and the ``retain_expired`` window first, then
+        least recently used rows until the count and byte limits hold again.
+        """
+        evicted = conn.execute(
+            "DELETE FROM forecast_cache WHERE expires_at <= ?", (time.time() - self.retain_expired,)
+        ).rowcount
+        if self.maxsize:
+            count = conn.execute("SELECT COUNT(*) FROM forecast_cache").fetchone()[0]
+            excess = count - self.maxsize
+            if excess > 0:
+                evicted += conn.execute(
+                    "DELETE FROM forecast_cache WHERE key IN ("
+                    " SELECT key FROM forecast_cache ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+        if self.max_bytes:
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM forecast_cache"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                victims = []
+                for key, size in conn.execute(
+                    "SELECT key, size FROM forecast_cache ORDER BY accessed_at"
+                ):
+                    if total <= self.max_bytes:
+                        break
+                    victims.append((key,))
+                    total -= size
+                conn.executemany("DELETE FROM forecast_cache WHERE key = ?", victims)
+                evicted += len(victims)
+        return evicted
+
+    def delete(self, key):
+        self._connect().execute(
+            "DELETE FROM forecast_cache WHERE key = ?", (self._key(key),)
+        )
+
+    def acquire_lock(self, key, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM forecast_locks WHERE expires_at <= ?", (now,))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO forecast_locks (key, owner, expires_at) VALUES (?, ?, ?)",
+                (self._key(key), os.getpid(), now + ttl),
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired
+
+    def release_lock(self, key):
+        self._connect().execute(
+            "DELETE FROM forecast_locks WHERE key = ? AND owner = ?",
+            (self._key(key), os.getpid()),
+        )
+
+    def locked(self, key):
+        """
+        :return: True if some worker currently holds the fetch lock for ``key``
+        """
+        return self._connect().execute(
+            "SELECT 1 FROM forecast_locks WHERE key = ? AND expires_at > ?",
+            (self._key(key), time.time()),
+        ).fetchone() is not None
+
+    def clear(self):
+        self._connect().execute("DELETE FROM forecast_cache")
+        self._connect().execute("DELETE FROM forecast_locks")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM forecast_cache").fetchone()[0]
+
+
+BACKENDS = {
+    MemoryBackend.name: MemoryBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def create_backend(name, **options):
+    """
+    Build a cache backend by name.
+
+    :param name: "memory" or "sqlite"
+    :param options: Keyword arguments for the backend constructor
+    :return: CacheBackend instance
+    :raises ValueError: if the backend name is unknown
+    """
+    try:
+        backend_cls = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown cache backend: {name}")
+    return backend_cls(**options)
+
+
+class ForecastCache:
+    """
+    TTL-aware forecast cache on top of a pluggable backend.
+
+    Entries expire according to the TTL of their forecast view; expired
+    entries count as misses and are removed on access.
+
+    Concurrent misses for one key are coalesced: threads of this process
+    share a single fetch, and with a shared backend the other workers wait
+    for the lock holder's result instead of fetching themselves.
+
+    With ``stale_ttl`` set, entries stay servable for that many seconds past
+    their TTL (stale-while-revalidate): a stale hit is answered immediately
+    and the entry is refreshed on a background thread. Accesses are tracked
+    in ``hot_keys`` so a BackgroundRefresher can renew popular entries before
+    they go stale. A SnapshotWriter set as ``snapshotter`` is started on
+    first use in the same way.
+
+    With ``stale_if_error`` set, expired entries are kept that many seconds
+    longer and served when fetching a replacement fails, e.g. while the
+    upstream circuit breaker is open.
+    """
+
+    # How long a cross-worker fetch lock is honoured, and how often waiters
+    # poll for the lock holder's result.
+    lock_ttl = 15.0
+    lock_poll_interval = 0.05
+
+    def __init__(self, backend=None, ttls=None, stale_ttl=0, refresh_workers=2, stale_if_error=0):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.stale_ttl = stale_ttl
+        self.stale_if_error = stale_if_error
+        self.backend.retain_expired = stale_if_error
+        self.refresh_workers = refresh_workers
+        self.stats = CacheStats()
+        self.flights = SingleFlight()
+        self.hot_keys = HotKeys()
+        self.refresher = None
+        self.snapshotter = None
+        self._executor = None
+        self._executor_pid = None
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+
+    def ttl_for(self, forecast_type):
+        """
+        :param forecast_type: "current", "hourly", "daily", or "all" for a
+            combined document, which lives as long as its shortest view
+        :return: TTL in seconds for entries of that forecast view
+        """
+        if forecast_type == "all":
+            return min(self.ttls["hourly"], self.ttls["daily"])
+        return self.ttls.get(forecast_type, self.ttls["hourly"])
+
+    def get(self, key):
+        """
+        Look up a live entry.
+
+        :param key: Hashable cache key
+        :return: Entry, or None on a miss or an expired entry
+        """
+        entry = self.backend.get(key)
+        if entry is not None and entry.expired():
+            # Kept for fallback until the stale_if_error window has passed too
+            if entry.expired(time.time() - self.stale_if_error):
+                self.backend.delete(key)
+                self.stats.incr("expirations")
+            entry = None
+        self.stats.incr("hits" if entry is not None else "misses")
+        return entry
+
+    def set(self, key, value, ttl):
+        """
+        Store a value that is fresh for ``ttl`` seconds and servable while
+        stale for another ``stale_ttl`` seconds.
+
+        :return: The stored Entry
+        """
+        now = time.time()
+        entry = Entry(value, now, now + ttl + self.stale_ttl, stale_at=now + ttl)
+        self.stats.incr("evictions", self.backend.set(key, entry))
+        return entry
+
+    def lookup(self, key, fetch, ttl):
+        """
+        Look up a servable entry, recording the access for the hot-key
+        ranking and scheduling a background refresh if the entry is stale.
+
+        :param key: Hashable cache key
+        :param fetch: Zero-argument callable that refetches the value
+        :param ttl: Lifetime in seconds of a refetched value
+        :return: Entry, or None on a miss
+        """
+        if self.refresher is not None:
+            self.refresher.ensure_running()
+        if self.snapshotter is not None:
+            self.snapshotter.ensure_running()
+        self.hot_keys.touch(key, fetch, ttl)
+        entry = self.get(key)
+        if entry is not None and entry.stale():
+            self.stats.incr("stale_hits")
+            self.refresh_in_background(key, fetch, ttl)
+        return entry
+
+    def get_or_fetch(self, key, fetch, ttl):
+        """
+        Return the cached value for ``key``, calling ``fetch()`` on a miss.
+
+        :param key: Hashable cache key
+        :param fetch: Zero-argument callable producing the value
+        :param ttl: Lifetime in seconds of a freshly fetched value
+        :return: The cached or freshly fetched value
+        """
+        return self.get_or_fetch_entry(key, fetch, ttl).value
+
+    def get_or_fetch_entry(self, key, fetch, ttl):
+        """
+        Like get_or_fetch, but return the Entry so callers can tell entry
+        versions apart by ``created_at``.
+
+        :return: The cached or freshly stored Entry
+        """
+        entry = self.lookup(key, fetch, ttl)
+        if entry is not None:
+            return entry
+        try:
+            entry, shared = self.flights.do(key, lambda: self._fetch_once(key, fetch, ttl))
+        except Exception:
+            entry = self.fallback(key)
+            if entry is None:
+                raise
+            return entry
+        if shared:
+            self.stats.incr("coalesced")
+        return entry
+
+    def fallback(self, key):
+        """
+        Look up an expired entry that may still be served because fetching
+        its replacement failed (see ``stale_if_error``).
+
+        :param key: Hashable cache key
+        :return: Entry, or None
+        """
+        if not self.stale_if_error:
+            return None
+        entry = self.backend.get(key)
+        if entry is None or entry.expired(time.time() - self.stale_if_error):
+            return None
+        self.stats.incr("errors_served_stale")
+        return entry
+
+    def peek(self, key):
+        """
+        Look up a servable (fresh or stale) entry without counting a hit or
+        miss or scheduling a refresh.
+
+        :param key: Hashable cache key
+        :return: Entry, or None
+        """
+        entry = self.backend.get(key)
+        return entry if entry is not None and not entry.expired() else None
+
+    def _peek_fresh(self, key):
+        entry = self.backend.get(key)
+        return entry if entry is not None and not entry.stale() else None
+
+    def _fetch_once(self, key, fetch, ttl, revalidate=False):
+        """
+        Fetch and store ``key`` while holding the backend's fetch lock. If
+        another worker holds it, wait for its result instead.
+
+        :param revalidate: Refetch even if a fresh entry is present
+        :return: The stored (or another worker's fresh) Entry
+        """
+        # Another thread may have stored the value between our miss and
+        # becoming the flight leader.
+        entry = None if revalidate else self._peek_fresh(key)
+        if entry is not None:
+            return entry
+        deadline = time.time() + self.lock_ttl
+        locked = self.backend.acquire_lock(key, self.lock_ttl)
+        while not locked and time.time() < deadline:
+            time.sleep(self.lock_poll_interval)
+            entry = self._peek_fresh(key)
+            if entry is not None:
+                self.stats.incr("coalesced")
+                return entry
+            locked = self.backend.acquire_lock(key, self.lock_ttl)
+        try:
+            return self.set(key, fetch(), ttl)
+        finally:
+            if locked:
+                self.backend.release_lock(key)
+
+    def refresh_in_background(self, key, fetch, ttl):
+        """
+        Schedule a refetch of ``key`` on the refresh thread pool unless one is
+        already queued or running.
+        """
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    self.refresh_workers, thread_name_prefix="forecast-refresh"
+                )
+                self._executor_pid = os.getpid()
+            executor = self._executor
+        executor.submit(self._refresh, key, fetch, ttl)
+
+    def _refresh(self, key, fetch, ttl):
+        try:
+            self.flights.do(key, lambda: self._fetch_once(key, fetch, ttl, revalidate=True))
+            self.stats.incr("refreshes")
+        except Exception:
+            # The stale entry keeps being served; the next access retries.
+            self.stats.incr("refresh_errors")
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def restore(self, entries):
+        """
+        Store entries kept from an earlier process, e.g. a snapshot, with
+        their original timestamps.
+
+        :param entries: Iterable of (key, Entry), least recently used first
+        :return: Number of entries restored
+        """
+        count = 0
+        now = time.time()
+        for key, entry in entries:
+            if not entry.expired(now):
+                self.backend.set(key, entry)
+                count += 1
+        return count
+
+    def clear(self):
+        self.backend.clear()
+        self.stats.reset()
+        self.hot_keys.clear()
+
+    def info(self):
+        """
+        :return: Backend name, current size and counters as a dict
+        """
+        data = self.stats.as_dict()
+        data["backend"] = self.backend.name
+        data["size"] = len(self.backend)
+        return data
@@ -0,0 +1,400 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+# Top-level scalar fields of a Forecast API response
+METADATA_FIELDS = (
+    "latitude",
+    "longitude",
+    "generationtime_ms",
+    "utc_offset_seconds",
+    "timezone",
+    "timezone_abbreviation",
+    "elevation",
+)
+
+# Sections holding one series per variable along a "time" axis
+SERIES_SECTIONS = ("hourly", "daily")
+
+# numpy datetime64 unit for each ISO 8601 time string length
+_TIME_UNITS = {16: "m", 10: "D"}
+
+_INT_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+# Marks a metadata slot the response did not contain
+_ABSENT = object()
+
+# Keys of the "current" section kept whatever variables are selected
+_CURRENT_KEYS = ("time", "interval")
+
+
+def _int_column(values):
+    """
+    :return: The smallest integer array holding ``values``, or None if the
+        values are not all plain ints
+    """
+    if not all(type(v) is int for v in values):
+        return None
+    low, high = min(values), max(values)
+    for dtype in _INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.array(values, dtype=dtype)
+    return None
+
+
+def _float_column(values):
+    """
+    :return: A float64 array with NaN for None, or None if the values are
+        not all floats or None
+    """
+    if not all(type(v) is float or v is None for v in values):
+        return None
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def encode_column(values):
+    """
+    Pack a series into a NumPy array if that round-trips exactly.
+
+    Lists of ints become the smallest fitting integer array and lists of
+    floats (with None for gaps) a float64 array. Anything else, including a
+    mix of ints and floats, is kept as the original list so ``decode_column``
+    always returns what was decoded from JSON.
+
+    :param values: List decoded from a JSON response
+    :return: numpy array or the list itself
+    """
+    if not isinstance(values, list) or not values:
+        return values
+    column = _int_column(values)
+    if column is None:
+        column = _float_column(values)
+    return values if column is None else column
+
+
+def decode_column(column):
+    """
+    :param column: Value from encode_column
+    :return: The original list
+    """
+    if not isinstance(column, np.ndarray):
+        return column
+    if column.dtype.kind == "f":
+        missing = np.isnan(column)
+        if missing.any():
+            return np.where(missing, None, column).tolist()
+    return column.tolist()
+
+
+class TimeAxis:
+    """
+    A regular series of ISO 8601 local times stored as start plus step.
+    """
+
+    __slots__ = ("start", "step", "count", "unit")
+
+    def __init__(self, start, step, count, unit):
+        self.start = start
+        self.step = step
+        self.count = count
+        self.unit = unit
+
+    @classmethod
+    def encode(cls, times):
+        """
+        :param times: List of "YYYY-MM-DDTHH:MM" or "YYYY-MM-DD" strings
+        :return: TimeAxis, or None if the times are not evenly spaced or
+            would not format back to the same strings
+        """
+        if not isinstance(times, list) or len(times) < 2 or not isinstance(times[0], str):
+            return None
+        unit = _TIME_UNITS.get(len(times[0]))
+        if unit is None:
+            return None
+        try:
+            stamps = np.array(times, dtype=f"datetime64[{unit}]")
+        except (TypeError, ValueError):
+            return None
+        steps = np.diff(stamps)
+        if not (steps == steps[0]).all():
+            return None
+        axis = cls(stamps[0], steps[0], len(times), unit)
+        if axis.to_list() != times:
+            return None
+        return axis
+
+    def to_list(self, rows=slice(None)):
+        """
+        :param rows: Slice of time steps to return
+        :return: The time strings as in the Forecast API response
+        """
+        stamps = self.start + self.step * np.arange(self.count)[rows]
+        return np.datetime_as_string(stamps, unit=self.unit).tolist()
+
+    def position(self, value, side):
+        """
+        Locate a time on the axis without expanding it.
+
+        :param value: numpy datetime64
+        :param side: "left" for the first step at or after ``value``, "right"
+            for the first step after it
+        :return: Step index between 0 and count
+        """
+        offset = (value - self.start) / self.step
+        index = int(np.ceil(offset)) if side == "left" else int(np.floor(offset)) + 1
+        return min(max(index, 0), self.count)
+
+
+class Series:
+    """
+    One series section (e.g. "hourly") as a time axis plus one column per
+    variable.
+    """
+
+    __slots__ = ("time", "columns")
+
+    def __init__(self, time, columns):
+        self.time = time
+        self.columns = columns
+
+    @classmethod
+    def encode(cls, section):
+        """
+        :param section: Section dict of the Forecast API response
+        :return: Series
+        """
+        time = TimeAxis.encode(section.get("time"))
+        # A None column stands for the time axis, keeping the key order
+        columns = {
+            name: None if name == "time" and time is not None else encode_column(values)
+            for name, values in section.items()
+        }
+        return cls(time, columns)
+
+    def __len__(self):
+        if self.time is not None:
+            return self.time.count
+        times = self.columns.get("time")
+        return len(times) if isinstance(times, list) else 0
+
+    def stamps(self):
+        """
+        :return: Local times of the time steps as datetime64[m], or None if
+            the series has no usable time axis
+        """
+        if self.time is not None:
+            return (self.time.start + self.time.step * np.arange(self.time.count)).astype("datetime64[m]")
+        times = self.columns.get("time")
+        if not isinstance(times, list) or not times:
+            return None
+        try:
+            return np.array(times, dtype="datetime64[m]")
+        except (TypeError, ValueError):
+            return None
+
+    def position(self, value, side):
+        """
+        :param value: numpy datetime64
+        :param side: "left" or "right", see TimeAxis.position
+        :return: Step index of ``value`` on the time axis
+        """
+        if self.time is not None:
+            return self.time.position(value, side)
+        # Irregular axes are kept as ISO strings, which sort chronologically
+        times = self.columns.get("time")
+        if not isinstance(times, list):
+            return 0
+        key = np.datetime_as_string(value, unit="m")
+        search = bisect_left if side == "left" else bisect_right
+        return search([t if len(t) > 10 else f"{t}T00:00" for t in times], key)
+
+    def to_dict(self, rows=slice(None), variables=None):
+        """
+        :param rows: Slice of time steps to decode
+        :param variables: Names of the variables to keep, or None for all
+        :return: The section dict of the Forecast API response
+        """
+        section = {}
+        for name, column in self.columns.items():
+            if variables is not None and name != "time" and name not in variables:
+                continue
+            if column is None:
+                section[name] = self.time.to_list(rows)
+            elif isinstance(column, (list, np.ndarray)):
+                section[name] = decode_column(column[rows])
+            else:
+                section[name] = column
+        return section
+
+
+class ResponseShape:
+    """
+    The part of a forecast view a client asked for: a window of time steps
+    and a selection of variables, applied as slices of the cached columns.
+
+    :param horizon: Number of time steps to return, counted from ``start``
+        or else from the location's current time
+    :param start: First time to include, ISO 8601 date or date-time
+    :param end: Last time to include, ISO 8601 date or date-time
+    :param variables: Variable names to include, as a list or a
+        comma-separated string; None keeps every variable
+    :raises ValueError: if a parameter is malformed
+    """
+
+    __slots__ = ("horizon", "start", "end", "variables")
+
+    def __init__(self, horizon=None, start=None, end=None, variables=None):
+        if horizon is not None and (type(horizon) is not int or horizon < 1):
+            raise ValueError("horizon must be a positive integer")
+        self.horizon = horizon
+        self.start = self._parse_time("start", start)
+        self.end = self._parse_time("end", end)
+        if isinstance(variables, str):
+            variables = [name for name in variables.split(",") if name]
+        if variables is not None and (
+            not isinstance(variables, (list, tuple)) or not all(isinstance(v, str) for v in variables)
+        ):
+            raise ValueError("variables must be a list of variable names")
+        self.variables = None if variables is None else frozenset(variables)
+
+    @staticmethod
+    def _parse_time(name, value):
+        if value is None:
+            return None
+        try:
+            if not isinstance(value, str):
+                raise ValueError(value)
+            return np.datetime64(value, "m")
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO 8601 date or date-time")
+
+    def __bool__(self):
+        return not (self.horizon is None and self.start is None and self.end is None and self.variables is None)
+
+    def key(self):
+        """
+        :return: Hashable value identifying the shape, for memoizing
+            rendered responses
+        """
+        variables = None if self.variables is None else tuple(sorted(self.variables))
+        return self.horizon, str(self.start), str(self.end), variables
+
+    def rows(self, series, now=None):
+        """
+        :param series: Series to window
+        :param now: Current local time of the location (numpy datetime64),
+            where a horizon without a start begins
+        :return: Slice of the series' time steps to return
+        """
+        count = len(series)
+        if self.start is not None:
+            first = series.position(self.start, "left")
+        elif self.horizon is not None and now is not None:
+            # The step containing the current time
+            first = max(series.position(now, "right") - 1, 0)
+        else:
+            first = 0
+        stop = count if self.end is None else series.position(self.end, "right")
+        if self.horizon is not None:
+            stop = min(stop, first + self.horizon)
+        return slice(first, max(first, stop))
+
+    def select(self, section):
+        """
+        Keep the selected variables of a dict section ("current" or a
+        "*_units" map).
+        """
+        if self.variables is None or not isinstance(section, dict):
+            return section
+        return {k: v for k, v in section.items() if k in self.variables or k in _CURRENT_KEYS}
+
+
+class CompactForecast:
+    """
+    A Forecast API response decoded once into a compact form for caching.
+
+    Scalar metadata lives in slots, "hourly" and "daily" series become
+    NumPy columns with a start-plus-step time axis, and every other key is
+    kept as decoded. ``to_dict`` rebuilds the original document on demand.
+    """
+
+    __slots__ = METADATA_FIELDS + ("series", "extra")
+
+    def __init__(self, weather):
+        """
+        :param weather: Decoded Forecast API response
+        """
+        self.series = {}
+        self.extra = {}
+        for name, value in weather.items():
+            if name in METADATA_FIELDS:
+                setattr(self, name, value)
+            elif name in SERIES_SECTIONS and isinstance(value, dict):
+                self.series[name] = Series.encode(value)
+            else:
+                self.extra[name] = value
+
+    def now(self):
+        """
+        :return: The location's current local time (numpy datetime64) from
+            the "current" section, or None
+        """
+        current = self.extra.get("current")
+        if isinstance(current, dict) and isinstance(current.get("time"), str):
+            try:
+                return np.datetime64(current["time"], "m")
+            except ValueError:
+                return None
+        return None
+
+    def replace(self, series=None, extra=None):
+        """
+        :param series: Series sections to add or replace, by name
+        :param extra: Other top-level keys to add or replace
+        :return: A shallow copy with those sections; the cached forecast
+            itself is never modified
+        """
+        copy = CompactForecast.__new__(CompactForecast)
+        for name in METADATA_FIELDS:
+            value = getattr(self, name, _ABSENT)
+            if value is not _ABSENT:
+                setattr(copy, name, value)
+        copy.series = {**self.series, **(series or {})}
+        copy.extra = {**self.extra, **(extra or {})}
+        return copy
+
+    def to_dict(self, exclude=(), shape=None):
+        """
+        :param exclude: Top-level keys to leave out, e.g. a view that was not
+            asked for, so its series are never decoded
+        :param shape: Optional ResponseShape; only the selected time steps
+            and variables are decoded
+        :return: The forecast document in the Forecast API response shape
+        """
+        weather = {}
+        for name in METADATA_FIELDS:
+            value = getattr(self, name, _ABSENT)
+            if value is not _ABSENT and name not in exclude:
+                weather[name] = value
+        for name, value in self.extra.items():
+            if name not in exclude:
+                if shape and (name == "current" or name.endswith("_units")):
+                    value = shape.select(value)
+                weather[name] = value
+        now = self.now() if shape else None
+        for name, series in self.series.items():
+            if name not in exclude:
+                if shape:
+                    weather[name] = series.to_dict(shape.rows(series, now), shape.variables)
+                else:
+                    weather[name] = series.to_dict()
+        return weather
+
+
+def compact_forecast(weather):
+    """
+    :param weather: Decoded Forecast API response
+    :return: CompactForecast, or ``weather`` unchanged if it is not a dict
+    """
+    return CompactForecast(weather) if isinstance(weather, dict) else weather
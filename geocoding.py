@@ -0,0 +1,222 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+
+# Column positions in a GeoNames "cities" dump (cities15000.txt and friends)
+GEONAMES_NAME = 1
+GEONAMES_ASCIINAME = 2
+GEONAMES_ALTERNATENAMES = 3
+GEONAMES_LATITUDE = 4
+GEONAMES_LONGITUDE = 5
+GEONAMES_COUNTRY_CODE = 8
+GEONAMES_POPULATION = 14
+
+# Ranked prefix results kept per prefix, and how many prefixes are kept
+PREFIX_MEMO_RESULTS = 20
+PREFIX_MEMO_MAXSIZE = 4096
+
+
+def normalize(name):
+    """
+    Normalize a place name for lookup: case-folded, diacritics removed and
+    whitespace collapsed, so "MÜNCHEN " and "munchen" match.
+
+    :param name: Place name
+    :return: Normalized lookup key
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+
+class Place:
+    """
+    A geocoded place as stored in the index.
+    """
+
+    __slots__ = ("name", "latitude", "longitude", "country", "population")
+
+    def __init__(self, name, latitude, longitude, country="", population=0):
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.country = country
+        self.population = population
+
+    def as_tuple(self):
+        """
+        :return: Tuple of latitude, longitude, name, country (the get_coords shape)
+        """
+        return self.latitude, self.longitude, self.name, self.country
+
+
+class GeocodingIndex:
+    """
+    In-memory place index with exact and prefix lookup on normalized names.
+
+    Exact lookups are a single dict probe. Prefix lookups bisect a sorted
+    array of keys, which is rebuilt lazily after insertions. Short prefixes
+    match a large share of the keys, so the ranked results of each prefix
+    are memoized (and kept up to date by insertions); ``warm`` ranks every
+    single-letter prefix ahead of the first keystroke.
+    """
+
+    def __init__(self):
+        self._places = {}
+        self._keys = []
+        self._keys_dirty = False
+        self._prefix_memo = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, countries_path=None):
+        """
+        Build an index from a GeoNames-style tab-separated gazetteer.
+
+        Each place is indexed under its name, ASCII name and alternate names.
+
+        :param path: Path of the gazetteer file
+        :param countries_path: Optional "code<TAB>name" file used to turn
+            country codes into country names
+        :return: GeocodingIndex
+        """
+        countries = {}
+        if countries_path:
+            with open(countries_path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip() and not line.startswith("#"):
+                        code, name = line.rstrip("\n").split("\t")[:2]
+                        countries[code] = name
+        index = cls()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) <= GEONAMES_POPULATION:
+                    continue
+                code = fields[GEONAMES_COUNTRY_CODE]
+                place = Place(
+                    fields[GEONAMES_NAME],
+                    float(fields[GEONAMES_LATITUDE]),
+                    float(fields[GEONAMES_LONGITUDE]),
+                    countries.get(code, code),
+                    int(fields[GEONAMES_POPULATION] or 0),
+                )
+                aliases = [fields[GEONAMES_ASCIINAME]]
+                aliases.extend(fields[GEONAMES_ALTERNATENAMES].split(","))
+                index.add(place, aliases)
+        index.warm()
+        return index
+
+    def add(self, place, aliases=()):
+        """
+        Index a place under its name and any aliases.
+
+        :param place: Place to add
+        :param aliases: Additional names the place should be found by
+        """
+        with self._lock:
+            for alias in {normalize(n) for n in (place.name, *aliases) if n}:
+                if not alias:
+                    continue
+                bucket = self._places.get(alias)
+                if bucket is None:
+                    self._places[alias] = [place]
+                    self._keys_dirty = True
+                elif place not in bucket:
+                    bucket.append(place)
+                    bucket.sort(key=lambda p: p.population, reverse=True)
+                if self._prefix_memo:
+                    self._update_prefix_memo(alias, place)
+
+    def remove(self, place, aliases=()):
+        """
+        Unindex a place added with ``add``; other places sharing its names
+        stay indexed.
+
+        :param place: Place to remove
+        :param aliases: The aliases it was added with
+        """
+        with self._lock:
+            for alias in {normalize(n) for n in (place.name, *aliases) if n}:
+                bucket = self._places.get(alias)
+                if bucket is None or place not in bucket:
+                    continue
+                bucket.remove(place)
+                if not bucket:
+                    del self._places[alias]
+                    self._keys_dirty = True
+                # Memoized lists holding the place are ranked again on use
+                for end in range(1, len(alias) + 1):
+                    matches = self._prefix_memo.get(alias[:end])
+                    if matches is not None and place in matches:
+                        del self._prefix_memo[alias[:end]]
+
+    def _update_prefix_memo(self, alias, place):
+        # A memoized list shorter than PREFIX_MEMO_RESULTS holds every match,
+        # so the new place belongs in it; a full one only if it outranks the
+        # last entry.
+        for end in range(1, len(alias) + 1):
+            matches = self._prefix_memo.get(alias[:end])
+            if matches is None or place in matches:
+                continue
+            if len(matches) < PREFIX_MEMO_RESULTS or place.population > matches[-1].population:
+                matches = sorted([*matches, place], key=lambda p: p.population, reverse=True)
+                self._prefix_memo[alias[:end]] = matches[:PREFIX_MEMO_RESULTS]
+
+    def lookup(self, name):
+        """
+        :param name: Place name, in any case and with or without diacritics
+        :return: The most populous Place with exactly that name, or None
+        """
+        bucket = self._places.get(normalize(name))
+        return bucket[0] if bucket else None
+
+    def prefix(self, prefix, limit=10):
+        """
+        :param prefix: Beginning of a place name
+        :param limit: Maximum number of results
+        :return: Places whose names start with ``prefix``, most populous first
+        """
+        key = normalize(prefix)
+        if not key:
+            return []
+        if limit > PREFIX_MEMO_RESULTS:
+            return self._rank(key, limit)
+        memo = self._prefix_memo
+        matches = memo.get(key)
+        if matches is None:
+            matches = self._rank(key, PREFIX_MEMO_RESULTS)
+            if len(memo) >= PREFIX_MEMO_MAXSIZE:
+                memo.clear()
+            memo[key] = matches
+        return matches[:limit]
+
+    def warm(self):
+        """
+        Memoize the ranked results of every single-character prefix, the
+        ones that match the most keys.
+        """
+        for first in sorted({key[0] for key in self._sorted_keys()}):
+            self.prefix(first)
+
+    def _rank(self, key, limit):
+        keys = self._sorted_keys()
+        start = bisect.bisect_left(keys, key)
+        end = bisect.bisect_left(keys, key + "\U0010ffff", start)
+        places = {}
+        for k in keys[start:end]:
+            for place in self._places[k]:
+                places[id(place)] = place
+        return heapq.nlargest(limit, places.values(), key=lambda p: p.population)
+
+    def _sorted_keys(self):
+        if self._keys_dirty:
+            with self._lock:
+                if self._keys_dirty:
+                    self._keys = sorted(self._places)
+                    self._keys_dirty = False
+        return self._keys
+
+    def __len__(self):
+        return len({id(p) for bucket in self._places.values() for p in bucket})
@@ -0,0 +1,337 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Add a Server-Timing header with the per-stage durations to responses
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") != "0"
+
+# Histogram bucket upper bounds in seconds, from 100 us to 10 s
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class _Sharded:
+    """
+    Base of the metric types: each thread updates its own shard, a list of
+    numbers, so recording a value takes no lock. Reads add up the shards.
+
+    Shards of threads that have exited are folded into one base shard when
+    a new thread registers, so servers starting a thread per request do
+    not grow a shard per request.
+    """
+
+    __slots__ = ("_local", "_shards", "_base", "_lock")
+
+    def __init__(self, size):
+        self._local = threading.local()
+        self._shards = []
+        self._base = [0] * size
+        self._lock = threading.Lock()
+
+    def _new_shard(self):
+        shard = [0] * len(self._base)
+        thread = threading.current_thread()
+        with self._lock:
+            live = []
+            for owner, other in self._shards:
+                if owner.is_alive():
+                    live.append((owner, other))
+                else:
+                    self._base = [a + b for a, b in zip(self._base, other)]
+            live.append((thread, shard))
+            self._shards = live
+        self._local.shard = shard
+        return shard
+
+    def _totals(self):
+        with self._lock:
+            shards = [self._base] + [shard for _, shard in self._shards]
+        return [sum(values) for values in zip(*shards)]
+
+
+class Counter(_Sharded):
+    """
+    Monotonically increasing value.
+    """
+
+    __slots__ = ()
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[0] += amount
+
+    @property
+    def value(self):
+        return self._totals()[0]
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class Gauge(Counter):
+    """
+    Value that goes up and down.
+    """
+
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[0] -= amount
+
+
+class Histogram(_Sharded):
+    """
+    Cumulative-bucket histogram in the Prometheus style.
+    """
+
+    __slots__ = ("bounds",)
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        # One count per bucket plus the +Inf bucket, not yet cumulative,
+        # then the sum of the observed values
+        super().__init__(len(bounds) + 2)
+        self.bounds = bounds
+
+    def observe(self, value):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_left(self.bounds, value)] += 1
+        shard[-1] += value
+
+    def samples(self, name, labels):
+        *counts, total = self._totals()
+        result = []
+        cumulative = 0
+        for bound, count in zip((*self.bounds, "+Inf"), counts):
+            cumulative += count
+            result.append((f"{name}_bucket", labels + (("le", str(bound)),), cumulative))
+        result.append((f"{name}_sum", labels, total))
+        result.append((f"{name}_count", labels, cumulative))
+        return result
+
+
+class Family:
+    """
+    A metric with a fixed set of label names and one child per label
+    values, e.g. a histogram per pipeline stage.
+    """
+
+    def __init__(self, kind, name, documentation, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        :param values: One value per label name
+        :return: The child metric for those label values
+        """
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        result = []
+        for values, child in children:
+            result.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return result
+
+
+class Registry:
+    """
+    Metric families plus collectors that report values read at scrape time
+    (e.g. cache counters), rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.families = []
+        self.collectors = []
+
+    def _add(self, kind, name, documentation, labelnames, factory):
+        family = Family(kind, name, documentation, tuple(labelnames), factory)
+        self.families.append(family)
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add("counter", name, documentation, labelnames, Counter)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._add("gauge", name, documentation, labelnames, Gauge)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add("histogram", name, documentation, labelnames, lambda: Histogram(buckets))
+
+    def collector(self, collect):
+        """
+        Register a callable returning a list of (name, kind, documentation,
+        samples) tuples, with samples as (labels dict, value) pairs.
+        """
+        self.collectors.append(collect)
+        return collect
+
+    def render(self):
+        """
+        :return: All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for family in self.families:
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples():
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for collect in self.collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels.items()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "weather_request_duration_seconds", "Time to produce a response, by route.", ("route",)
+)
+stage_duration = registry.histogram(
+    "weather_stage_duration_seconds",
+    "Time spent per request processing stage (geocode, cache, upstream, render, encode).",
+    ("stage",),
+)
+requests_total = registry.counter(
+    "weather_requests_total", "Responses sent, by route and status code.", ("route", "status")
+)
+requests_in_flight = registry.gauge(
+    "weather_requests_in_flight", "Requests being processed by this worker."
+).labels()
+
+# Stage timings of the request being handled in this thread or task
+_timings = contextvars.ContextVar("timings", default=None)
+
+# Children of the families above by label values, so recording a request
+# skips Family.labels
+_stage_histograms = {}
+_route_histograms = {}
+_response_counters = {}
+
+
+class timed:
+    """
+    Context manager timing one stage of a request with the monotonic clock:
+
+        with timed("upstream"):
+            resp = upstream.get(...)
+
+    The duration is added to the stage histogram and, inside a request
+    started with RequestTimer, to that request's Server-Timing header.
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        histogram = _stage_histograms.get(self.name)
+        if histogram is None:
+            histogram = _stage_histograms[self.name] = stage_duration.labels(self.name)
+        histogram.observe(elapsed)
+        timings = _timings.get()
+        if timings is not None:
+            timings.append((self.name, elapsed))
+        return False
+
+
+class RequestTimer:
+    """
+    Times one request: in-flight gauge, total duration and the stages run
+    while it is current.
+    """
+
+    __slots__ = ("route", "start", "elapsed", "timings")
+
+    def __init__(self, route):
+        self.route = route
+        self.timings = []
+        requests_in_flight.inc()
+        _timings.set(self.timings)
+        self.start = time.perf_counter()
+
+    def finish(self, status):
+        """
+        Record the request as answered with ``status``.
+        """
+        self.elapsed = elapsed = time.perf_counter() - self.start
+        _timings.set(None)
+        requests_in_flight.dec()
+        histogram = _route_histograms.get(self.route)
+        if histogram is None:
+            histogram = _route_histograms[self.route] = request_duration.labels(self.route)
+        histogram.observe(elapsed)
+        counter = _response_counters.get((self.route, status))
+        if counter is None:
+            counter = _response_counters[self.route, status] = requests_total.labels(self.route, status)
+        counter.inc()
+
+    def server_timing(self):
+        """
+        :return: Server-Timing header value for the finished request, only
+            formatted when the header is sent
+        """
+        return server_timing(self.timings, self.elapsed)
+
+
+def server_timing(timings, total):
+    """
+    :param timings: List of (stage name, seconds)
+    :param total: Total seconds
+    :return: Server-Timing header value, durations in milliseconds
+    """
+    return ", ".join([f"{name};dur={seconds * 1000:.3f}" for name, seconds in (*timings, ("total", total))])
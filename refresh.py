@@ -0,0 +1,131 @@
+import heapq
+import os
+import threading
+import time
+
+
+class HotKeys:
+    """
+    Exponentially decayed access frequency per cache key.
+
+    Each access adds one to the key's score and scores halve every
+    ``half_life`` seconds, so the ranking follows current popularity. The
+    most recent fetch function and TTL are remembered per key so hot entries
+    can be refreshed without a request.
+    """
+
+    def __init__(self, maxsize=10000, half_life=600.0):
+        self.maxsize = maxsize
+        self.half_life = half_life
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, score, last, now):
+        return score * 0.5 ** ((now - last) / self.half_life)
+
+    def touch(self, key, fetch, ttl):
+        """
+        Record an access to ``key``.
+
+        :param key: Cache key
+        :param fetch: Zero-argument callable that refetches the key
+        :param ttl: TTL to store a refetched value with
+        """
+        now = time.time()
+        with self._lock:
+            item = self._keys.get(key)
+            score = 1.0 if item is None else self._decayed(item[0], item[1], now) + 1.0
+            self._keys[key] = (score, now, fetch, ttl)
+            if len(self._keys) > self.maxsize:
+                self._prune(now)
+
+    def _prune(self, now):
+        # Drop the coldest half so pruning stays amortized O(1) per touch
+        keep = heapq.nlargest(
+            self.maxsize // 2, self._keys.items(),
+            key=lambda kv: self._decayed(kv[1][0], kv[1][1], now),
+        )
+        self._keys = dict(keep)
+
+    def top(self, n, min_score=0.0):
+        """
+        :param n: Number of keys to return
+        :param min_score: Leave out keys whose decayed score is below this
+        :return: List of (key, fetch, ttl) for the ``n`` hottest keys
+        """
+        now = time.time()
+        with self._lock:
+            scored = [
+                (self._decayed(score, last, now), key, fetch, ttl)
+                for key, (score, last, fetch, ttl) in self._keys.items()
+            ]
+        hottest = heapq.nlargest(n, scored, key=lambda item: item[0])
+        return [(key, fetch, ttl) for score, key, fetch, ttl in hottest if score >= min_score]
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class BackgroundRefresher:
+    """
+    Periodically refresh the hottest cache entries before they go stale.
+
+    Every ``interval`` seconds the ``top_n`` hottest keys of the cache are
+    checked; those missing or due to go stale before the next run are
+    refetched on the cache's refresh pool, so popular locations are always
+    served from a fresh entry. Keys whose decayed access score is below
+    ``min_score`` are left to expire.
+    """
+
+    def __init__(self, cache, top_n=50, interval=60.0, min_score=2.0):
+        self.cache = cache
+        self.top_n = top_n
+        self.interval = interval
+        self.min_score = min_score
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        """
+        Start the refresh thread in this process if it is not running (it
+        does not survive a fork, so each worker starts its own).
+        """
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name="forecast-refresher", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """
+        Refresh the hot entries that are missing or about to go stale.
+
+        :return: Number of refreshes scheduled
+        """
+        deadline = time.time() + self.interval
+        scheduled = 0
+        for key, fetch, ttl in self.cache.hot_keys.top(self.top_n, self.min_score):
+            entry = self.cache.backend.get(key)
+            if entry is None or entry.stale_at <= deadline:
+                self.cache.refresh_in_background(key, fetch, ttl)
+                scheduled += 1
+        return scheduled
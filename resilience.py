@@ -0,0 +1,584 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+# Retries of failed upstream GETs, with "full jitter" exponential backoff:
+# retry n sleeps a random time up to min(BACKOFF_MAX, BACKOFF * 2 ** n).
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", "0.1"))
+UPSTREAM_RETRY_BACKOFF_MAX = float(os.getenv("UPSTREAM_RETRY_BACKOFF_MAX", "2"))
+# Adaptive timeouts: the read timeout of a call is this multiple of the
+# endpoint's observed latency percentile, between TIMEOUT_MIN and the
+# caller's timeout, once enough calls have been observed.
+UPSTREAM_ADAPTIVE_TIMEOUT = os.getenv("UPSTREAM_ADAPTIVE_TIMEOUT", "1") != "0"
+UPSTREAM_TIMEOUT_PERCENTILE = float(os.getenv("UPSTREAM_TIMEOUT_PERCENTILE", "99"))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+UPSTREAM_TIMEOUT_MIN = float(os.getenv("UPSTREAM_TIMEOUT_MIN", "1"))
+# Hedged requests: a second identical request is sent once the first has
+# taken longer than this latency percentile; the first answer wins.
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0") != "0"
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+# Circuit breaker: after this many consecutive failed calls an endpoint is
+# not called for BREAKER_RESET seconds, then one probe call decides.
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+# Bulkhead: at most this many upstream calls in flight per worker process
+# (0 for no limit). A call beyond it waits up to ADMISSION_WAIT seconds for
+# a slot, then fails fast with UpstreamBusyError instead of queueing.
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+UPSTREAM_ADMISSION_WAIT = float(os.getenv("UPSTREAM_ADMISSION_WAIT", "0.1"))
+# Retry-After suggested to clients turned away by the bulkhead
+UPSTREAM_BUSY_RETRY_AFTER = 1
+
+# Latencies kept per endpoint, and how many are needed for percentiles
+LATENCY_WINDOW = 256
+LATENCY_MIN_SAMPLES = 20
+
+# Response statuses worth retrying; other responses are returned as they are.
+# A 429 is retried after its Retry-After, if that is given and fits in the
+# caller's timeout.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Exceptions worth retrying: the request may not have reached the upstream
+# or the upstream did not answer in time
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httpx.TransportError,
+)
+TIMEOUT_EXCEPTIONS = (requests.exceptions.Timeout, httpx.TimeoutException)
+
+
+def retry_after_seconds(value):
+    """
+    :param value: Retry-After header value: seconds or an HTTP date
+    :return: Seconds to wait (at least 0), or None if absent or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamUnavailableError(Exception):
+    """
+    Raised instead of calling an upstream endpoint that must not be called
+    now; the request can be retried later.
+
+    :param endpoint: Endpoint name
+    :param retry_after: Seconds after which a retry may succeed
+    """
+
+    reason = "unavailable"
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Upstream {self.reason}: {endpoint}")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    """
+    Raised instead of calling an upstream endpoint whose circuit breaker is
+    open.
+    """
+
+
+class UpstreamBusyError(UpstreamUnavailableError):
+    """
+    Raised instead of calling an upstream endpoint when this worker already
+    has the maximum number of upstream calls in flight.
+    """
+
+    reason = "busy"
+
+
+class Bulkhead:
+    """
+    Cap on concurrent calls. A caller beyond the cap may wait a short time
+    for a slot; after that it is turned away rather than queued.
+
+    :param limit: Maximum calls in flight, 0 for no limit
+    :param wait: Seconds a caller waits for a free slot
+    """
+
+    def __init__(self, limit=UPSTREAM_MAX_CONCURRENCY, wait=UPSTREAM_ADMISSION_WAIT):
+        self.limit = limit
+        self.wait = wait
+        self.active = 0
+        self.peak = 0
+        self.rejected = 0
+        self._free = threading.Condition()
+
+    def acquire(self, wait=None):
+        """
+        :param wait: Seconds to wait for a slot (defaults to ``self.wait``)
+        :return: True if a slot was taken (release it when done), False if
+            the call must be turned away
+        """
+        if not self.limit:
+            return True
+        wait = self.wait if wait is None else wait
+        with self._free:
+            if self.active >= self.limit and wait > 0:
+                self._free.wait_for(lambda: self.active < self.limit, wait)
+            if self.active >= self.limit:
+                self.rejected += 1
+                return False
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            return True
+
+    def release(self):
+        if not self.limit:
+            return
+        with self._free:
+            self.active -= 1
+            self._free.notify()
+
+    def info(self):
+        return {"limit": self.limit, "active": self.active, "peak": self.peak, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent call latencies with percentile lookup.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW, min_samples=LATENCY_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._sorted = None
+
+    def percentile(self, p):
+        """
+        :param p: Percentile between 0 and 100
+        :return: Latency in seconds, or None with too few samples
+        """
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            if self._sorted is None:
+                self._sorted = sorted(self._samples)
+            values = self._sorted
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    Closed, calls pass. After ``failures`` consecutive failures it opens and
+    calls are refused for ``reset_timeout`` seconds; then it is half open
+    and lets a single probe call through, whose outcome closes or reopens it.
+    """
+
+    def __init__(self, failures=UPSTREAM_BREAKER_FAILURES, reset_timeout=UPSTREAM_BREAKER_RESET):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        :return: True if a call may be made now
+        """
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.time() >= self.opened_at + self.reset_timeout:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed" and self.failures and self.consecutive_failures >= self.failures
+            ):
+                self.state = "open"
+                self.opened_at = time.time()
+                self.opens += 1
+            self._probing = False
+
+    def retry_after(self):
+        """
+        :return: Seconds until a probe call will be let through
+        """
+        return max(0.0, self.opened_at + self.reset_timeout - time.time())
+
+
+class Endpoint:
+    """
+    Resilience state of one upstream endpoint (host and path).
+    """
+
+    FIELDS = (
+        "calls", "attempts", "retries", "failures", "timeouts", "hedges", "hedge_wins", "short_circuits", "shed",
+    )
+
+    def __init__(self, name, breaker):
+        self.name = name
+        self.latency = LatencyTracker()
+        self.breaker = breaker
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self._lock = threading.Lock()
+
+    def count(self, field):
+        with self._lock:
+            self.counts[field] += 1
+
+    def info(self):
+        with self._lock:
+            data = dict(self.counts)
+        data["state"] = self.breaker.state
+        data["opens"] = self.breaker.opens
+        for p in (50, 95, 99):
+            latency = self.latency.percentile(p)
+            data[f"p{p}_ms"] = None if latency is None else round(latency * 1000, 1)
+        return data
+
+
+class ResilientClient:
+    """
+    Retries, adaptive timeouts, hedging and a circuit breaker around an
+    UpstreamClient, tracked per endpoint.
+
+    Every call is a GET and therefore safe to repeat. A call fails fast with
+    UpstreamBusyError when the client's bulkhead has no free slot, and with
+    CircuitOpenError while its endpoint's breaker is open. Otherwise it is
+    attempted up to ``retries + 1`` times on connection errors, timeouts and
+    retryable statuses (RETRY_STATUSES), all within the caller's timeout: a
+    retry is only made if its wait plus UPSTREAM_TIMEOUT_MIN fits in what
+    is left of it. The last response is returned (or its exception raised)
+    if every attempt fails, and the breaker counts one failure for the call.
+    """
+
+    def __init__(
+        self,
+        client,
+        retries=UPSTREAM_RETRIES,
+        backoff=UPSTREAM_RETRY_BACKOFF,
+        backoff_max=UPSTREAM_RETRY_BACKOFF_MAX,
+        adaptive_timeout=UPSTREAM_ADAPTIVE_TIMEOUT,
+        hedge=UPSTREAM_HEDGE,
+        breaker_failures=UPSTREAM_BREAKER_FAILURES,
+        breaker_reset=UPSTREAM_BREAKER_RESET,
+        max_concurrency=UPSTREAM_MAX_CONCURRENCY,
+        admission_wait=UPSTREAM_ADMISSION_WAIT,
+    ):
+        self.client = client
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.adaptive_timeout = adaptive_timeout
+        self.hedge = hedge
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.bulkhead = Bulkhead(max_concurrency, admission_wait)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def endpoint(self, url):
+        """
+        :return: The Endpoint state for ``url``, keyed by host and path
+        """
+        parts = urlsplit(url)
+        name = f"{parts.netloc}{parts.path}"
+        endpoint = self._endpoints.get(name)
+        if endpoint is None:
+            with self._lock:
+                endpoint = self._endpoints.get(name)
+                if endpoint is None:
+                    breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+                    endpoint = self._endpoints[name] = Endpoint(name, breaker)
+        return endpoint
+
+    def timeout_for(self, endpoint, timeout=None):
+        """
+        :param endpoint: Endpoint
+        :param timeout: Read timeout the caller allows (defaults to the
+            client's read timeout)
+        :return: Read timeout in seconds for the next attempt
+        """
+        limit = self.client.read_timeout if timeout is None else timeout
+        # Probes of a tripped breaker get the full timeout, so an upstream
+        # that became slower (not dead) is measured and the timeout adapts
+        if not self.adaptive_timeout or endpoint.breaker.state != "closed":
+            return limit
+        latency = endpoint.latency.percentile(UPSTREAM_TIMEOUT_PERCENTILE)
+        if latency is None:
+            return limit
+        return min(limit, max(UPSTREAM_TIMEOUT_MIN, latency * UPSTREAM_TIMEOUT_MULTIPLIER))
+
+    def hedge_delay(self, endpoint, timeout):
+        """
+        :return: Seconds after which to send a hedged request, or None
+        """
+        if not self.hedge:
+            return None
+        delay = endpoint.latency.percentile(UPSTREAM_HEDGE_PERCENTILE)
+        return delay if delay is not None and delay < timeout else None
+
+    def backoff_delay(self, retry):
+        """
+        :param retry: Retry number, from 1
+        :return: Jittered sleep in seconds before that retry
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** retry))
+
+    def retry_delay(self, retry, outcome, deadline):
+        """
+        :param retry: Retry number, from 1
+        :param outcome: Response or exception of the failed attempt
+        :param deadline: time.monotonic() by which the call must be done
+        :return: Seconds to sleep before that retry (the Retry-After of a
+            429 response, else backoff_delay), or None if the retry would
+            not fit before ``deadline``
+        """
+        delay = None
+        if not isinstance(outcome, Exception) and outcome.status_code == 429:
+            delay = retry_after_seconds(outcome.headers.get("Retry-After"))
+        if delay is None:
+            delay = self.backoff_delay(retry)
+        if time.monotonic() + delay + UPSTREAM_TIMEOUT_MIN > deadline:
+            return None
+        return delay
+
+    def _admit(self, endpoint, wait=None):
+        """
+        Take a bulkhead slot for a call (release it when done), checked
+        before the breaker so a refused call never holds a breaker probe.
+
+        :raises UpstreamBusyError: if no slot freed up in time
+        :raises CircuitOpenError: if the endpoint's breaker is open
+        """
+        endpoint.count("calls")
+        if not self.bulkhead.acquire(wait):
+            endpoint.count("shed")
+            raise UpstreamBusyError(endpoint.name, UPSTREAM_BUSY_RETRY_AFTER)
+        if not endpoint.breaker.allow():
+            self.bulkhead.release()
+            endpoint.count("short_circuits")
+            raise CircuitOpenError(endpoint.name, endpoint.breaker.retry_after())
+
+    def _failed(self, endpoint, outcome):
+        """
+        :return: True if ``outcome`` (response or exception) calls for a
+            retry; other exceptions are not the upstream's fault and are
+            raised at once
+        """
+        if isinstance(outcome, Exception):
+            if isinstance(outcome, TIMEOUT_EXCEPTIONS):
+                endpoint.count("timeouts")
+            return isinstance(outcome, RETRY_EXCEPTIONS)
+        return outcome.status_code in RETRY_STATUSES
+
+    def _settle(self, endpoint, outcome, failed):
+        if failed:
+            endpoint.count("failures")
+            endpoint.breaker.record_failure()
+        else:
+            endpoint.breaker.record_success()
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def get(self, url, params=None, timeout=None):
+        """
+        Resilient version of UpstreamClient.get.
+
+        :return: requests.Response
+        :raises UpstreamUnavailableError: if the bulkhead is full or the
+            endpoint's circuit breaker is open
+        :raises requests.exceptions.RequestException: if every attempt failed
+            with an exception
+        """
+        endpoint = self.endpoint(url)
+        self._admit(endpoint)
+        deadline = time.monotonic() + (self.client.read_timeout if timeout is None else timeout)
+        try:
+            failed = True
+            outcome = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    delay = self.retry_delay(attempt, outcome, deadline)
+                    if delay is None:
+                        break
+                    endpoint.count("retries")
+                    time.sleep(delay)
+                attempt_timeout = min(self.timeout_for(endpoint, timeout), deadline - time.monotonic())
+                try:
+                    outcome = self._send(endpoint, url, params, attempt_timeout)
+                except Exception as e:
+                    outcome = e
+                failed = self._failed(endpoint, outcome)
+                if not failed:
+                    break
+            return self._settle(endpoint, outcome, failed)
+        finally:
+            self.bulkhead.release()
+
+    def _timed(self, endpoint, url, params, timeout):
+        endpoint.count("attempts")
+        start = time.perf_counter()
+        resp = self.client.get(url, params=params, timeout=timeout)
+        endpoint.latency.record(time.perf_counter() - start)
+        return resp
+
+    def _hedge_executor(self):
+        if self._executor is None or self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(
+                        self.client.pool_maxsize, thread_name_prefix="upstream-hedge"
+                    )
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def _send(self, endpoint, url, params, timeout):
+        delay = self.hedge_delay(endpoint, timeout)
+        if delay is None:
+            return self._timed(endpoint, url, params, timeout)
+        executor = self._hedge_executor()
+        first = executor.submit(self._timed, endpoint, url, params, timeout)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        endpoint.count("hedges")
+        second = executor.submit(self._timed, endpoint, url, params, timeout)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                if future is second:
+                    endpoint.count("hedge_wins")
+                # The slower request finishes in the background
+                return future.result()
+        raise error
+
+    async def async_get(self, url, params=None, timeout=None):
+        """
+        Resilient version of UpstreamClient.async_get.
+
+        :return: httpx.Response
+        :raises UpstreamUnavailableError: if the bulkhead is full or the
+            endpoint's circuit breaker is open
+        :raises httpx.HTTPError: if every attempt failed with an exception
+        """
+        endpoint = self.endpoint(url)
+        # Waiting for a slot would block the event loop
+        self._admit(endpoint, wait=0)
+        deadline = time.monotonic() + (self.client.read_timeout if timeout is None else timeout)
+        try:
+            failed = True
+            outcome = None
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    delay = self.retry_delay(attempt, outcome, deadline)
+                    if delay is None:
+                        break
+                    endpoint.count("retries")
+                    await asyncio.sleep(delay)
+                attempt_timeout = min(self.timeout_for(endpoint, timeout), deadline - time.monotonic())
+                try:
+                    outcome = await self._async_send(endpoint, url, params, attempt_timeout)
+                except Exception as e:
+                    outcome = e
+                failed = self._failed(endpoint, outcome)
+                if not failed:
+                    break
+            return self._settle(endpoint, outcome, failed)
+        finally:
+            self.bulkhead.release()
+
+    async def _async_timed(self, endpoint, url, params, timeout):
+        endpoint.count("attempts")
+        start = time.perf_counter()
+        resp = await self.client.async_get(url, params=params, timeout=timeout)
+        endpoint.latency.record(time.perf_counter() - start)
+        return resp
+
+    async def _async_send(self, endpoint, url, params, timeout):
+        delay = self.hedge_delay(endpoint, timeout)
+        if delay is None:
+            return await self._async_timed(endpoint, url, params, timeout)
+        first = asyncio.ensure_future(self._async_timed(endpoint, url, params, timeout))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        endpoint.count("hedges")
+        second = asyncio.ensure_future(self._async_timed(endpoint, url, params, timeout))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is second:
+                        endpoint.count("hedge_wins")
+                    return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """
+        :return: Dict of per-endpoint counters, breaker state and latency
+            percentiles
+        """
+        with self._lock:
+            endpoints = list(self._endpoints.values())
+        return {endpoint.name: endpoint.info() for endpoint in endpoints}
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
@@ -0,0 +1,200 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# "auto" uses orjson when it is installed, "json" forces the stdlib encoder.
+JSON_ENCODER = os.getenv("JSON_ENCODER", "auto")
+# Content codings offered to clients, in order of preference, and the
+# smallest body worth compressing.
+RESPONSE_COMPRESSION = [c for c in os.getenv("RESPONSE_COMPRESSION", "br,gzip").split(",") if c]
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+_COMPRESSORS = {"gzip": lambda body: gzip.compress(body, GZIP_LEVEL, mtime=0)}
+if brotli is not None:
+    _COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def dumps(obj):
+    """
+    Encode ``obj`` as compact UTF-8 JSON, with orjson when available.
+
+    :return: bytes
+    """
+    if orjson is not None and JSON_ENCODER != "json":
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers beyond 64 bits, which the stdlib encoder handles
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def negotiate(accept_encoding, codings=None):
+    """
+    Pick a content coding for a response.
+
+    :param accept_encoding: Accept-Encoding request header
+    :param codings: Codings to choose from, by preference (defaults to the
+        available RESPONSE_COMPRESSION codings)
+    :return: The chosen coding, or None for identity
+    """
+    if codings is None:
+        codings = [c for c in RESPONSE_COMPRESSION if c in _COMPRESSORS]
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for coding in codings:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+class EncodedResponse:
+    """
+    An encoded JSON response body with its ETag and lazily compressed
+    variants, kept so repeated responses are a write of stored bytes.
+    """
+
+    __slots__ = ("body", "digest", "_variants")
+
+    def __init__(self, body):
+        """
+        :param body: Encoded JSON bytes
+        """
+        self.body = body
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._variants = {}
+
+    @classmethod
+    def of(cls, obj):
+        return cls(dumps(obj))
+
+    def etag(self, coding=None):
+        """
+        :param coding: Content coding of the representation
+        :return: Quoted strong ETag; each coding has its own
+        """
+        return f'"{self.digest}-{coding}"' if coding else f'"{self.digest}"'
+
+    def variant(self, accept_encoding):
+        """
+        :param accept_encoding: Accept-Encoding request header
+        :return: Tuple of (coding or None, body bytes)
+        """
+        if len(self.body) < RESPONSE_COMPRESSION_MIN_BYTES:
+            return None, self.body
+        coding = negotiate(accept_encoding)
+        if coding is None:
+            return None, self.body
+        data = self._variants.get(coding)
+        if data is None:
+            # Concurrent first requests may both compress; either result is fine
+            data = self._variants[coding] = _COMPRESSORS[coding](self.body)
+        return coding, data
+
+    def matches(self, if_none_match):
+        """
+        :param if_none_match: If-None-Match request header
+        :return: True if it names any representation of this body
+        """
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag.strip('"').split("-")[0] == self.digest:
+                return True
+        return False
+
+    def respond(self, accept_encoding="", if_none_match=None, content_type="application/json"):
+        """
+        Pick the representation for a request.
+
+        :return: Tuple of (status, headers as a list of (name, value), body)
+        """
+        coding, body = self.variant(accept_encoding)
+        headers = [("ETag", self.etag(coding)), ("Vary", "Accept-Encoding")]
+        if self.matches(if_none_match):
+            return 304, headers, b""
+        headers.append(("Content-Type", content_type))
+        if coding:
+            headers.append(("Content-Encoding", coding))
+        return 200, headers, body
+
+    def size(self):
+        return len(self.body) + sum(len(v) for v in self._variants.values())
+
+
+class ResponseMemo:
+    """
+    LRU of EncodedResponse objects keyed by everything that determines the
+    response body. Keys include the cache entry's ``created_at`` so a
+    refreshed forecast never reuses bytes of the previous one.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            encoded = self._data.get(key)
+            if encoded is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return encoded
+
+    def set(self, key, encoded):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = encoded
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            size = sum(encoded.size() for encoded in self._data.values())
+            return {"entries": len(self._data), "bytes": size, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._data)
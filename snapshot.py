@@ -0,0 +1,259 @@
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+
+from cache import Entry
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on POSIX
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# File signature and format version, followed by the time of writing
+MAGIC = b"WXSNAP\x00\x01"
+_HEADER = struct.Struct("<8sd")
+
+# Per record: kind, created_at, stale_at, expires_at, then the lengths of
+# the pickled key and value that follow the record header
+_RECORD = struct.Struct("<BdddII")
+
+KIND_FORECAST = 0
+KIND_PLACE = 1
+
+
+def write_snapshot(path, entries=(), places=()):
+    """
+    Write cache entries and geocoded places to a snapshot file.
+
+    The file is a fixed header followed by one record per item: a fixed-size
+    header with the entry's timestamps and the lengths of its pickled key
+    and value, then those bytes. Readers can therefore skip expired entries
+    without unpickling them. The file is written next to ``path`` and
+    renamed over it, so readers never see a partial snapshot.
+
+    :param path: Snapshot file path
+    :param entries: Iterable of (cache key, Entry), oldest first
+    :param places: Iterable of (searched name, Place)
+    :return: Size of the snapshot in bytes
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, time.time()))
+        for key, entry in entries:
+            _write_record(f, KIND_FORECAST, entry.created_at, entry.stale_at, entry.expires_at, key, entry.value)
+        for name, place in places:
+            _write_record(f, KIND_PLACE, 0.0, 0.0, 0.0, name, place)
+        size = f.tell()
+    os.replace(tmp, path)
+    return size
+
+
+def _write_record(f, kind, created_at, stale_at, expires_at, key, value):
+    key = pickle.dumps(key, pickle.HIGHEST_PROTOCOL)
+    value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    f.write(_RECORD.pack(kind, created_at, stale_at, expires_at, len(key), len(value)))
+    f.write(key)
+    f.write(value)
+
+
+def read_snapshot(path, now=None):
+    """
+    Read a snapshot written by write_snapshot.
+
+    The file is memory-mapped and walked record by record; expired forecast
+    entries are skipped by their header alone. A missing, foreign or
+    truncated file yields what could be read, never an error.
+
+    :param path: Snapshot file path
+    :param now: Timestamp entries must still be servable at (defaults to
+        time.time())
+    :return: Tuple of (list of (cache key, Entry) oldest first, list of
+        (searched name, Place))
+    """
+    now = time.time() if now is None else now
+    entries = []
+    places = []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return entries, places
+    with f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size:
+            return entries, places
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if _HEADER.unpack_from(data)[0] != MAGIC:
+                return entries, places
+            offset = _HEADER.size
+            view = memoryview(data)
+            try:
+                while offset + _RECORD.size <= len(data):
+                    kind, created_at, stale_at, expires_at, key_len, value_len = _RECORD.unpack_from(data, offset)
+                    start = offset + _RECORD.size
+                    offset = start + key_len + value_len
+                    if offset > len(data):
+                        break
+                    if kind == KIND_FORECAST and expires_at <= now:
+                        continue
+                    key = pickle.loads(view[start:start + key_len])
+                    value = pickle.loads(view[start + key_len:offset])
+                    if kind == KIND_FORECAST:
+                        entries.append((key, Entry(value, created_at, expires_at, value_len, stale_at)))
+                    elif kind == KIND_PLACE:
+                        places.append((key, value))
+            except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+                # Written by an incompatible version: keep what was read
+                pass
+            finally:
+                view.release()
+    return entries, places
+
+
+def merge_entries(stored, current, limit=None):
+    """
+    :param stored: (key, Entry) pairs read from the snapshot on disk
+    :param current: This worker's (key, Entry) pairs, least recently used
+        first
+    :param limit: Most entries to keep, or None (or 0) for all
+    :return: (key, Entry) pairs, least recently used first, with this
+        worker's entries last; for a key in both, the entry created last
+    """
+    merged = dict(stored)
+    for key, entry in current:
+        other = merged.pop(key, None)
+        merged[key] = entry if other is None or entry.created_at >= other.created_at else other
+    items = list(merged.items())
+    return items[-limit:] if limit else items
+
+
+def merge_places(stored, current, limit=None):
+    """
+    :param stored: (name, Place) pairs read from the snapshot on disk
+    :param current: This worker's (name, Place) pairs
+    :param limit: Most places to keep, or None (or 0) for all
+    :return: (name, Place) pairs with this worker's places last
+    """
+    merged = dict(stored)
+    for name, place in current:
+        merged.pop(name, None)
+        merged[name] = place
+    items = list(merged.items())
+    return items[-limit:] if limit else items
+
+
+class _FileLock:
+    """
+    Exclusive lock on a file across processes (where fcntl is available),
+    so workers sharing a snapshot path merge into it one at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+class SnapshotWriter:
+    """
+    Periodically write a snapshot of the forecast cache and geocoded places,
+    so a new worker can start from a warm cache (see read_snapshot).
+
+    Workers sharing a snapshot path merge their cache into the snapshot on
+    disk under a file lock, so no worker overwrites the others' entries.
+    """
+
+    def __init__(self, path, entries, places=lambda: (), interval=300.0, max_entries=None, max_places=None):
+        """
+        :param path: Snapshot file path
+        :param entries: Zero-argument callable returning (key, Entry) pairs
+        :param places: Zero-argument callable returning (name, Place) pairs
+        :param interval: Seconds between snapshots
+        :param max_entries: Most forecasts kept in the merged snapshot, the
+            most recently used; None keeps all that have not expired
+        :param max_places: Most geocoded places kept in the merged snapshot
+        """
+        self.path = path
+        self.entries = entries
+        self.places = places
+        self.interval = interval
+        self.max_entries = max_entries
+        self.max_places = max_places
+        self.writes = 0
+        self.last_size = 0
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_running(self):
+        """
+        Start the snapshot thread in this process if it is not running (it
+        does not survive a fork, so each worker starts its own).
+        """
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._run, name="forecast-snapshot", daemon=True
+            )
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except OSError as e:
+                # e.g. a full disk; the next run tries again
+                logger.warning("Could not write the snapshot %s: %s", self.path, e)
+
+    def run_once(self):
+        """
+        Merge this worker's cache into the snapshot on disk now.
+
+        :return: Size of the snapshot in bytes
+        """
+        with _FileLock(f"{self.path}.lock"):
+            entries, places = read_snapshot(self.path)
+            self.last_size = write_snapshot(
+                self.path,
+                merge_entries(entries, self.entries(), self.max_entries),
+                merge_places(places, self.places(), self.max_places),
+            )
+        self.writes += 1
+        return self.last_size
+
+    def run_at_exit(self):
+        """
+        Write a last snapshot as the worker exits; a failure (e.g. a
+        read-only or full disk) is logged instead of raised.
+        """
+        try:
+            self.run_once()
+        except OSError as e:
+            logger.warning("Could not write the snapshot %s at exit: %s", self.path, e)
+
+    def info(self):
+        return {"path": self.path, "writes": self.writes, "bytes": self.last_size}
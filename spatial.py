@@ -0,0 +1,113 @@
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+_GEOHASH_INDEX = {c: i for i, c in enumerate(_GEOHASH_ALPHABET)}
+
+
+def geohash_encode(lat, lon, precision=5):
+    """
+    Encode a coordinate as a geohash string.
+
+    :param lat: Latitude in degrees
+    :param lon: Longitude in degrees
+    :param precision: Number of geohash characters
+    :return: Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """
+    Decode a geohash into its bounding box.
+
+    :param geohash: Geohash string
+    :return: Tuple of (lat_min, lat_max, lon_min, lon_max)
+    :raises ValueError: if the string contains non-geohash characters
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        try:
+            value = _GEOHASH_INDEX[char]
+        except KeyError:
+            raise ValueError(f"Invalid geohash: {geohash}")
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+class SpatialKeyer:
+    """
+    Map raw coordinates to the canonical point of the cell containing them.
+
+    Every request inside a cell resolves to the same coordinates, so they
+    share one cache key and one upstream fetch.
+
+    Modes:
+      - "exact": no bucketing, coordinates are used as given
+      - "grid": snap to a regular lat/lon grid of ``resolution`` degrees,
+        ideally matching the forecast model's grid spacing
+      - "geohash": snap to the centre of the geohash cell of ``precision``
+        characters
+    """
+
+    MODES = ("exact", "grid", "geohash")
+
+    def __init__(self, mode="grid", resolution=0.1, precision=5):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown spatial key mode: {mode}")
+        if mode == "grid" and resolution <= 0:
+            raise ValueError("Grid resolution must be positive")
+        self.mode = mode
+        self.resolution = resolution
+        self.precision = precision
+
+    def cell(self, lat, lon):
+        """
+        :param lat: Latitude in degrees
+        :param lon: Longitude in degrees
+        :return: Tuple of the cell's canonical latitude and longitude
+        """
+        lat = float(lat)
+        lon = float(lon)
+        if self.mode == "grid":
+            res = self.resolution
+            lat = min(90.0, max(-90.0, round(round(lat / res) * res, 6)))
+            lon = round(round(lon / res) * res, 6)
+            if lon > 180.0:
+                lon -= 360.0
+            elif lon < -180.0:
+                lon += 360.0
+        elif self.mode == "geohash":
+            lat_min, lat_max, lon_min, lon_max = geohash_bounds(
+                geohash_encode(lat, lon, self.precision)
+            )
+            lat = round((lat_min + lat_max) / 2, 6)
+            lon = round((lon_min + lon_max) / 2, 6)
+        return lat, lon
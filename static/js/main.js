@@ -4,6 +4,8 @@ document.addEventListener("DOMContentLoaded", function () {
     const errorDiv = document.getElementById("error-message");
     const forecastTypeToggle = document.getElementById("forecast-type");
     const themeToggle = document.getElementById("theme-toggle");
+    const cityInput = document.getElementById("city");
+    const cityList = document.getElementById("city-list");
 
     // --- Weather code to Font Awesome icon mapping ---
     const weatherIcons = {
@@ -37,6 +39,15 @@ document.addEventListener("DOMContentLoaded", function () {
         99: { icon: "fa-bolt", desc: "Thunderstorm with heavy hail" }
     };
 
+    // --- Variables the dashboard displays; the server leaves out the rest ---
+    const dashboardVariables = [
+        "temperature_2m", "apparent_temperature", "weather_code", "wind_speed_10m",
+        "wind_direction_10m", "precipitation", "precipitation_probability",
+        "relative_humidity_2m", "uv_index", "temperature_2m_max", "temperature_2m_min"
+    ];
+    // Time steps shown per view: the next two days hourly, the whole week daily
+    const dashboardHorizon = { hourly: 48, daily: 7 };
+
     // --- Helper: Human-friendly date/time ---
     function formatDateTime(dtString) {
         const d = new Date(dtString);
@@ -50,9 +61,12 @@ document.addEventListener("DOMContentLoaded", function () {
         });
     }
 
-    // --- Main Dashboard Rendering Function ---
-    function renderDashboard(data) {
-        const { location, units, forecast_type, weather } = data;
+    // --- Dashboard header: location, current weather and forecast table head ---
+    // "meta" is the first record of a streamed response: the response body
+    // without the forecast series, plus "columns" naming the series fields.
+    function renderHeader(meta) {
+        const { location, units, weather, columns } = meta;
+        const has = (field) => columns.includes(field);
         let html = `<h2>${location}</h2>`;
 
         // --- Current Weather ---
@@ -79,68 +93,144 @@ document.addEventListener("DOMContentLoaded", function () {
         }
 
         // --- Forecast Table ---
-        let forecast = weather[forecast_type];
-        if (forecast && forecast.time) {
+        if (has("time")) {
             html += `<div class="table-responsive"><table class="table table-striped"><thead><tr>`;
             html += `<th>Date/Time</th><th>Weather</th>`;
-            if (forecast.temperature_2m) html += `<th>Temp (${units === "celsius" ? "°C" : "°F"})</th>`;
-            if (forecast.apparent_temperature) html += `<th>Feels Like</th>`;
-            if (forecast.temperature_2m_max) html += `<th>Max Temp</th>`;
-            if (forecast.temperature_2m_min) html += `<th>Min Temp</th>`;
-            if (forecast.wind_speed_10m) html += `<th>Wind</th>`;
-           // if (forecast.wind_speed_10m_max) html += `<th>Max Wind</th>`;
-            if (forecast.wind_direction_10m) html += `<th>Wind Dir</th>`;
-          //  if (forecast.wind_direction_10m_dominant) html += `<th>Dom Wind Dir</th>`;
-            if (forecast.precipitation) html += `<th>Precipitation</th>`;
-           // if (forecast.precipitation_sum) html += `<th>Precip Sum</th>`;
-            if (forecast.precipitation_probability) html += `<th>Precip Prob</th>`;
-          //  if (forecast.precipitation_probability_max) html += `<th>Max Precip Prob</th>`;
-            if (forecast.relative_humidity_2m) html += `<th>Humidity</th>`;
-         //   if (forecast.relative_humidity_2m_max) html += `<th>Max Humidity</th>`;
-            if (forecast.uv_index) html += `<th>UV Index</th>`;
-        //    if (forecast.uv_index_max) html += `<th>Max UV</th>`;
-            html += `</tr></thead><tbody>`;
-
-            for (let i = 0; i < forecast.time.length; i++) {
-                html += `<tr>`;
-                // Date/Time
-                html += `<td>${formatDateTime(forecast.time[i])}</td>`;
-                // Icon
-                let code = null;
-                if (forecast.weather_code) code = forecast.weather_code[i];
-                const icon = code && weatherIcons[code] ? weatherIcons[code].icon : "";
-                const desc = code && weatherIcons[code] ? weatherIcons[code].desc : "";
-                html += `<td>${icon ? `<i class="fas ${icon} fa-lg text-primary" title="${desc}" aria-label="${desc}"></i>` : ""}</td>`;
-                // Forecast data columns
-                if (forecast.temperature_2m) html += `<td>${forecast.temperature_2m[i]}</td>`;
-                if (forecast.apparent_temperature) html += `<td>${forecast.apparent_temperature[i]}</td>`;
-                if (forecast.temperature_2m_max) html += `<td>${forecast.temperature_2m_max[i]}</td>`;
-                if (forecast.temperature_2m_min) html += `<td>${forecast.temperature_2m_min[i]}</td>`;
-                if (forecast.wind_speed_10m) html += `<td>${forecast.wind_speed_10m[i]}</td>`;
-            //    if (forecast.wind_speed_10m_max) html += `<td>${forecast.wind_speed_10m_max[i]}</td>`;
-                if (forecast.wind_direction_10m) html += `<td>${forecast.wind_direction_10m[i]}</td>`;
-            //    if (forecast.wind_direction_10m_dominant) html += `<td>${forecast.wind_direction_10m_dominant[i]}</td>`;
-                if (forecast.precipitation) html += `<td>${forecast.precipitation[i]}</td>`;
-            //    if (forecast.precipitation_sum) html += `<td>${forecast.precipitation_sum[i]}</td>`;
-                if (forecast.precipitation_probability) html += `<td>${forecast.precipitation_probability[i] ?? "-"}</td>`;
-            //    if (forecast.precipitation_probability_max) html += `<td>${forecast.precipitation_probability_max[i] ?? "-"}</td>`;
-                if (forecast.relative_humidity_2m) html += `<td>${forecast.relative_humidity_2m[i]}</td>`;
-            //    if (forecast.relative_humidity_2m_max) html += `<td>${forecast.relative_humidity_2m_max[i]}</td>`;
-                if (forecast.uv_index) html += `<td>${forecast.uv_index[i]}</td>`;
-            //    if (forecast.uv_index_max) html += `<td>${forecast.uv_index_max[i]}</td>`;
-                html += `</tr>`;
+            if (has("temperature_2m")) html += `<th>Temp (${units === "celsius" ? "°C" : "°F"})</th>`;
+            if (has("apparent_temperature")) html += `<th>Feels Like</th>`;
+            if (has("temperature_2m_max")) html += `<th>Max Temp</th>`;
+            if (has("temperature_2m_min")) html += `<th>Min Temp</th>`;
+            if (has("wind_speed_10m")) html += `<th>Wind</th>`;
+           // if (has("wind_speed_10m_max")) html += `<th>Max Wind</th>`;
+            if (has("wind_direction_10m")) html += `<th>Wind Dir</th>`;
+          //  if (has("wind_direction_10m_dominant")) html += `<th>Dom Wind Dir</th>`;
+            if (has("precipitation")) html += `<th>Precipitation</th>`;
+           // if (has("precipitation_sum")) html += `<th>Precip Sum</th>`;
+            if (has("precipitation_probability")) html += `<th>Precip Prob</th>`;
+          //  if (has("precipitation_probability_max")) html += `<th>Max Precip Prob</th>`;
+            if (has("relative_humidity_2m")) html += `<th>Humidity</th>`;
+         //   if (has("relative_humidity_2m_max")) html += `<th>Max Humidity</th>`;
+            if (has("uv_index")) html += `<th>UV Index</th>`;
+        //    if (has("uv_index_max")) html += `<th>Max UV</th>`;
+            html += `</tr></thead><tbody></tbody></table></div>`;
+        }
+
+        const container = document.getElementById("weather-dashboard-container");
+        container.classList.remove("d-none");
+        // Clear previous content and show dashboard
+        dashboard.classList.remove("d-none");
+        // Render the HTML
+        dashboard.innerHTML = html;
+    }
+
+    // --- One forecast table row per time step ---
+    function rowHtml(row, columns) {
+        const has = (field) => columns.includes(field);
+        let html = `<tr>`;
+        // Date/Time
+        html += `<td>${formatDateTime(row.time)}</td>`;
+        // Icon
+        const code = has("weather_code") ? row.weather_code : null;
+        const icon = code && weatherIcons[code] ? weatherIcons[code].icon : "";
+        const desc = code && weatherIcons[code] ? weatherIcons[code].desc : "";
+        html += `<td>${icon ? `<i class="fas ${icon} fa-lg text-primary" title="${desc}" aria-label="${desc}"></i>` : ""}</td>`;
+        // Forecast data columns
+        if (has("temperature_2m")) html += `<td>${row.temperature_2m}</td>`;
+        if (has("apparent_temperature")) html += `<td>${row.apparent_temperature}</td>`;
+        if (has("temperature_2m_max")) html += `<td>${row.temperature_2m_max}</td>`;
+        if (has("temperature_2m_min")) html += `<td>${row.temperature_2m_min}</td>`;
+        if (has("wind_speed_10m")) html += `<td>${row.wind_speed_10m}</td>`;
+    //    if (has("wind_speed_10m_max")) html += `<td>${row.wind_speed_10m_max}</td>`;
+        if (has("wind_direction_10m")) html += `<td>${row.wind_direction_10m}</td>`;
+    //    if (has("wind_direction_10m_dominant")) html += `<td>${row.wind_direction_10m_dominant}</td>`;
+        if (has("precipitation")) html += `<td>${row.precipitation}</td>`;
+    //    if (has("precipitation_sum")) html += `<td>${row.precipitation_sum}</td>`;
+        if (has("precipitation_probability")) html += `<td>${row.precipitation_probability ?? "-"}</td>`;
+    //    if (has("precipitation_probability_max")) html += `<td>${row.precipitation_probability_max ?? "-"}</td>`;
+        if (has("relative_humidity_2m")) html += `<td>${row.relative_humidity_2m}</td>`;
+    //    if (has("relative_humidity_2m_max")) html += `<td>${row.relative_humidity_2m_max}</td>`;
+        if (has("uv_index")) html += `<td>${row.uv_index}</td>`;
+    //    if (has("uv_index_max")) html += `<td>${row.uv_index_max}</td>`;
+        html += `</tr>`;
+        return html;
+    }
+
+    // --- Append rows to the forecast table as they arrive ---
+    function appendRows(rows, columns) {
+        const tbody = dashboard.querySelector("tbody");
+        if (tbody && rows.length) {
+            tbody.insertAdjacentHTML("beforeend", rows.map((row) => rowHtml(row, columns)).join(""));
+        }
+    }
+
+    // --- City autocomplete: suggestions by datalist label, with exact coordinates ---
+    const suggestions = new Map();
+    let suggestTimer = null;
+    let suggestController = null;
+
+    function suggestionLabel(place) {
+        return place.country ? `${place.name}, ${place.country}` : place.name;
+    }
+
+    async function suggestCities(query) {
+        if (suggestController) suggestController.abort();
+        suggestController = new AbortController();
+        try {
+            const params = new URLSearchParams({ q: query });
+            const res = await fetch(`/api/geocode/suggest?${params}`, { signal: suggestController.signal });
+            if (!res.ok) return;
+            const { results } = await res.json();
+            suggestions.clear();
+            cityList.innerHTML = "";
+            for (const place of results) {
+                const label = suggestionLabel(place);
+                if (suggestions.has(label)) continue;
+                suggestions.set(label, place);
+                const option = document.createElement("option");
+                option.value = label;
+                cityList.appendChild(option);
             }
-            html += `</tbody></table></div>`;
+        } catch (err) {
+            // Superseded by a newer keystroke, or offline: keep the old list
         }
+    }
 
+    cityInput.addEventListener("input", function () {
+        const query = cityInput.value.trim();
+        clearTimeout(suggestTimer);
+        // A picked suggestion needs no new list
+        if (!query || suggestions.has(query)) return;
+        suggestTimer = setTimeout(() => suggestCities(query), 100);
+    });
 
-            const container = document.getElementById("weather-dashboard-container");
-            container.classList.remove("d-none");
-            // Clear previous content and show dashboard
-            dashboard.classList.remove("d-none");
-            // Render the HTML
-            dashboard.innerHTML = html;
+    // --- Read an NDJSON response, rendering each batch of records as it arrives ---
+    // "location" overrides the label of a request made by coordinates.
+    async function renderStream(res, location) {
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        let columns = [];
+        for (;;) {
+            const { value, done } = await reader.read();
+            buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+            const lines = buffer.split("\n");
+            buffer = lines.pop();
+            const rows = [];
+            for (const line of lines) {
+                if (!line) continue;
+                const record = JSON.parse(line);
+                if (record.type === "meta") {
+                    columns = record.columns;
+                    if (location) record.location = location;
+                    renderHeader(record);
+                } else if (record.type === "row") {
+                    rows.push(record);
+                }
+            }
+            appendRows(rows, columns);
+            if (done) return;
         }
+    }
 
     // Load defaults from sessionStorage
     const defaultLocation = sessionStorage.getItem("defaultLocation");
@@ -168,15 +258,36 @@ document.addEventListener("DOMContentLoaded", function () {
         localStorage.setItem("defaultLocation", JSON.stringify({ city, lat, lon, units, forecastType }));
 
         try {
-            const res = await fetch("/api/weather", {
-                method: "POST",
-                headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({ city, lat, lon, units, forecast_type: forecastType })
+            // GET with the query in canonical order so the browser (and any
+            // CDN) can cache the forecast; the server redirects other forms
+            const query = new URLSearchParams();
+            // A picked suggestion is requested by its exact coordinates
+            // (as canonical 4-decimal values), so no geocoding is needed
+            const place = suggestions.get(city);
+            if (place) {
+                query.set("lat", Number(place.lat.toFixed(4)));
+                query.set("lon", Number(place.lon.toFixed(4)));
+            } else if (city) {
+                query.set("city", city.toLowerCase());
+            } else {
+                query.set("lat", lat);
+                query.set("lon", lon);
+            }
+            if (forecastType !== "hourly") query.set("forecast_type", forecastType);
+            query.set("horizon", dashboardHorizon[forecastType]);
+            if (units !== "celsius") query.set("units", units);
+            query.set("variables", [...dashboardVariables].sort().join(","));
+            query.sort();
+            const res = await fetch(`/api/weather?${query}`, {
+                headers: { "Accept": "application/x-ndjson" }
             });
-            const data = await res.json();
-            if (!res.ok) throw new Error(data.error || "Unknown error");
+            if (!res.ok) {
+                const data = await res.json();
+                throw new Error(data.error || "Unknown error");
+            }
 
-            renderDashboard(data);
+            // Render rows as they stream in; errors still come back as JSON
+            await renderStream(res, place && suggestionLabel(place));
         } catch (err) {
             errorDiv.textContent = err.message;
             errorDiv.classList.remove("d-none");
@@ -35,7 +35,7 @@ def test_fetch_weather_data_success():
     weather_response = Mock()
     weather_response.json.return_value = weather_mock
     weather_response.raise_for_status = Mock()
-    with patch("weather_function.requests.get", side_effect=[geo_response, weather_response]):
+    with patch("weather_function.upstream.get", side_effect=[geo_response, weather_response]):
         result = fetch_weather_data("New York")
         assert result["location"].startswith("New York")
         assert result["temperature"] == 20.5
@@ -56,7 +56,7 @@ def test_fetch_weather_data_city_not_found():
     geo_response = Mock()
     geo_response.json.return_value = geo_mock
     geo_response.raise_for_status = Mock()
-    with patch("weather_function.requests.get", return_value=geo_response):
+    with patch("weather_function.upstream.get", return_value=geo_response):
         result = fetch_weather_data("UnknownCity")
         assert "error" in result
         assert "not found" in result["error"]
@@ -85,7 +85,7 @@ def test_fetch_weather_data_no_weather():
     weather_response = Mock()
     weather_response.json.return_value = weather_mock
     weather_response.raise_for_status = Mock()
-    with patch("weather_function.requests.get", side_effect=[geo_response, weather_response]):
+    with patch("weather_function.upstream.get", side_effect=[geo_response, weather_response]):
         result = fetch_weather_data("New York")
         assert "error" in result
         assert "unavailable" in result["error"]
@@ -100,7 +100,7 @@ def test_fetch_weather_data_request_exception():
     is raised during the API call.
     """
 
-    with patch("weather_function.requests.get", side_effect=requests.exceptions.RequestException("Network error")):
+    with patch("weather_function.upstream.get", side_effect=requests.exceptions.RequestException("Network error")):
         result = fetch_weather_data("New York")
         assert "error" in result
         assert "Request failed" in result["error"]
@@ -1,5 +1,7 @@
 import requests
 
+import upstream
+
 def fetch_weather_data(city_name):
   
     """
@@ -23,7 +25,7 @@ def fetch_weather_data(city_name):
         # Step 1: Get coordinates from Geocoding API
         geo_url = "https://geocoding-api.open-meteo.com/v1/search"
         geo_params = {"name": city_name, "count": 1, "format": "json"}
-        geo_response = requests.get(geo_url, params=geo_params)
+        geo_response = upstream.get(geo_url, params=geo_params)
         geo_response.raise_for_status()
         geo_data = geo_response.json()
 
@@ -41,7 +43,7 @@ def fetch_weather_data(city_name):
             "longitude": lon,
             "current_weather": True
         }
-        weather_response = requests.get(weather_url, params=weather_params)
+        weather_response = upstream.get(weather_url, params=weather_params)
         weather_response.raise_for_status()
         weather_data = weather_response.json()
 
@@ -0,0 +1,42 @@
+from collections import OrderedDict
+
+import pytest
+
+import app
+from geocoding import GeocodingIndex
+
+
+@pytest.fixture(autouse=True)
+def clear_forecast_cache():
+    """
+    Start every test with an empty forecast cache so cached results from one
+    test cannot leak into the next.
+    """
+    app.forecast_cache.clear()
+    app.response_memo.clear()
+    yield
+    app.forecast_cache.clear()
+    app.response_memo.clear()
+
+
+@pytest.fixture(autouse=True)
+def empty_geocoding_index(monkeypatch):
+    """
+    Replace the bundled gazetteer with an empty index so get_coords tests
+    exercise the Geocoding API path unless a test adds places itself.
+    """
+    index = GeocodingIndex()
+    monkeypatch.setattr(app, "geocoding_index", index)
+    monkeypatch.setattr(app, "geocoded_places", OrderedDict())
+    return index
+
+
+@pytest.fixture(autouse=True)
+def reset_rate_limits():
+    """
+    Give every test fresh rate limit counters, as all test client requests
+    come from the same address.
+    """
+    app.limiter.reset()
+    yield
+    app.limiter.reset()
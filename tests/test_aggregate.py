@@ -0,0 +1,135 @@
+import numpy as np
+
+from aggregate import daily_from_hourly, derive_views, heat_index, rolling_sum, wind_chill
+from forecast import CompactForecast, TimeAxis
+
+
+def _hourly(days=2):
+    hours = days * 24
+    times = np.datetime64("2024-07-01T00:00") + np.arange(hours) * np.timedelta64(1, "h")
+    return {
+        "time": np.datetime_as_string(times, unit="m").tolist(),
+        "temperature_2m": [float(h % 24) for h in range(hours)],
+        "weather_code": [3 if h == 30 else 1 for h in range(hours)],
+        "wind_speed_10m": [10.0] * hours,
+        "wind_direction_10m": [350 if h % 2 else 20 for h in range(hours)],
+        "precipitation": [None if h == 5 else 0.1 for h in range(hours)],
+        "relative_humidity_2m": [50] * hours,
+    }
+
+# Daily values are reduced from the hours of each local day.
+def test_daily_from_hourly_reductions():
+    """
+    Test max, min, sum (skipping gaps), most severe weather code and the
+    circular mean wind direction, which must not average 350° and 20° to
+    185°.
+    """
+    hourly = CompactForecast({"hourly": _hourly()}).series["hourly"]
+    series, units = daily_from_hourly(hourly)
+    daily = series.to_dict()
+    assert isinstance(series.time, TimeAxis)
+    assert units is None
+    assert daily["time"] == ["2024-07-01", "2024-07-02"]
+    assert daily["temperature_2m_max"] == [23.0, 23.0]
+    assert daily["temperature_2m_min"] == [0.0, 0.0]
+    assert daily["weather_code"] == [1, 3]
+    assert daily["precipitation_sum"] == [2.3, 2.4]
+    assert daily["wind_direction_10m_dominant"] == [5, 5]
+    assert daily["relative_humidity_2m_max"] == [50, 50]
+    assert "uv_index_max" not in daily and "heat_index_max" not in daily
+
+# Days follow the local calendar of the series, including DST changes.
+def test_daily_from_hourly_irregular_local_days():
+    """
+    Test that a local day with a skipped hour (a daylight saving change) is
+    still one day, grouped by the date part of the local times.
+    """
+    section = _hourly()
+    del section["time"][2], section["temperature_2m"][2], section["weather_code"][2]
+    for name in ("wind_speed_10m", "wind_direction_10m", "precipitation", "relative_humidity_2m"):
+        del section[name][2]
+    hourly = CompactForecast({"hourly": section}).series["hourly"]
+    assert hourly.time is None
+    series, units = daily_from_hourly(hourly, {"time": "iso8601", "temperature_2m": "°C", "precipitation": "mm"})
+    daily = series.to_dict()
+    assert daily["time"] == ["2024-07-01", "2024-07-02"]
+    assert daily["precipitation_sum"] == [2.2, 2.4]
+    assert units == {
+        "time": "iso8601", "temperature_2m_max": "°C", "temperature_2m_min": "°C", "precipitation_sum": "mm",
+    }
+
+# The indices match the NWS and Environment Canada tables.
+def test_heat_index_wind_chill_and_rolling_sum():
+    """
+    Test the heat index at 90 °F and 70 % humidity (106 °F), the wind chill
+    at -10 °C and 20 km/h (-18 °C), their pass-through outside their ranges,
+    and a trailing sum over an irregular axis.
+    """
+    index = heat_index(np.array([(90 - 32) / 1.8, 20.0]), np.array([70.0, 50.0]))
+    assert round(index[0] * 1.8 + 32) == 106
+    assert index[1] == 20.0
+    chill = wind_chill(np.array([-10.0, 15.0, -5.0]), np.array([20.0, 30.0, 3.0]))
+    assert round(chill[0]) == -18
+    assert chill[1:].tolist() == [15.0, -5.0]
+    times = np.array(["2024-01-01T00:00", "2024-01-01T01:00", "2024-01-01T03:00"], dtype="datetime64[m]")
+    sums = rolling_sum(np.array([1.0, np.nan, 2.0]), times, hours=2)
+    assert sums.tolist() == [1.0, 1.0, 2.0]
+
+# Computed variables are added to a copy of the cached forecast on demand.
+def test_derive_views():
+    """
+    Test that derived hourly variables are only computed when selected, get
+    the unit label of their input, and that the cached forecast keeps its
+    series; derived daily variables are added to a cached daily series.
+    """
+    section = _hourly()
+    forecast = CompactForecast({
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C", "precipitation": "mm"},
+        "hourly": section,
+        "daily": {"time": ["2024-07-01", "2024-07-02"], "temperature_2m_max": [30.0, 31.0]},
+    })
+    assert derive_views(forecast, "hourly") is forecast
+    derived = derive_views(forecast, "hourly", frozenset({"wind_chill", "precipitation_24h"}))
+    assert derived.extra["hourly_units"]["precipitation_24h"] == "mm"
+    hourly = derived.series["hourly"].to_dict()
+    assert hourly["wind_chill"][:2] == [-3.3, -2.1]
+    assert hourly["wind_chill"][12] == 12.0
+    assert hourly["precipitation_24h"][23:25] == [2.3, 2.3]
+    assert hourly["precipitation_24h"][29] == 2.4
+    assert "wind_chill" not in forecast.series["hourly"].columns
+
+    assert derive_views(forecast, "daily") is forecast
+    daily = derive_views(forecast, "daily", frozenset({"heat_index_max"})).series["daily"].to_dict()
+    assert daily["temperature_2m_max"] == [30.0, 31.0]
+    assert daily["heat_index_max"] == [23.0, 23.0]
+
+# Derived daily variables join the upstream daily series, never replace it.
+def test_derive_views_keeps_upstream_daily_values():
+    """
+    Test that asking for a derived daily variable of a forecast with both
+    series keeps the upstream daily values and units, adds the derived
+    column aligned on the upstream days, and leaves days the hourly series
+    does not cover empty.
+    """
+    forecast = CompactForecast({
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": _hourly(),
+        "daily_units": {"time": "iso8601", "temperature_2m_max": "°C", "precipitation_sum": "mm"},
+        "daily": {
+            "time": ["2024-07-01", "2024-07-02", "2024-07-03"],
+            "temperature_2m_max": [30.0, 31.0, 32.0],
+            "precipitation_sum": [0.0, 1.5, 0.2],
+        },
+    })
+    derived = derive_views(forecast, "daily", frozenset({"temperature_2m_max", "wind_chill_min"}))
+    daily = derived.series["daily"].to_dict()
+    assert daily == {
+        "time": ["2024-07-01", "2024-07-02", "2024-07-03"],
+        "temperature_2m_max": [30.0, 31.0, 32.0],
+        "precipitation_sum": [0.0, 1.5, 0.2],
+        "wind_chill_min": [-3.3, -3.3, None],
+    }
+    assert derived.extra["daily_units"] == {
+        "time": "iso8601", "temperature_2m_max": "°C", "precipitation_sum": "mm", "wind_chill_min": "°C",
+    }
+    assert "wind_chill_min" not in forecast.series["daily"].columns
@@ -1,8 +1,26 @@
+import json
 import pytest
 from unittest.mock import Mock
 import requests
 
-from app import get_coords, cached_fetch_weather
+import app
+from app import RequestError, get_coords
+from forecast import ResponseShape
+
+
+def fetch_cached(lat, lon, units, forecast_type, shape=None):
+    """
+    Serve a forecast the way /api/weather does: look up the location's
+    spatial cell with cached_weather_entry, then render and encode it with
+    encode_weather_response.
+
+    :return: The "weather" document of the response body
+    """
+    key, entry = app.cached_weather_entry(*app.spatial_keyer.cell(lat, lon), forecast_type)
+    encoded = app.encode_weather_response(
+        entry, key, forecast_type, app.parse_units(units), shape or ResponseShape(), ("Coordinates", "", lat, lon, units)
+    )
+    return json.loads(encoded.body)["weather"]
 
 # Function returns correct coordinates, city name, and country for a valid city input.
 def test_get_coords_valid_city(mocker):
@@ -20,7 +38,7 @@ def test_get_coords_valid_city(mocker):
         }]
     }
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     result = get_coords("London")
     assert result == (51.5074, -0.1278, "London", "United Kingdom")
 
@@ -41,7 +59,7 @@ def test_get_coords_city_without_country(mocker):
         }]
     }
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     result = get_coords("Paris")
     assert result == (48.8566, 2.3522, "Paris", "")
 
@@ -63,7 +81,7 @@ def test_get_coords_city_with_special_characters(mocker):
         }]
     }
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     result = get_coords("München")
     assert result == (52.5200, 13.4050, "München", "Deutschland")
 
@@ -76,7 +94,7 @@ def test_get_coords_city_not_found(mocker):
     mock_response = Mock()
     mock_response.json.return_value = {"results": []}
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     with pytest.raises(ValueError, match="City not found"):
         get_coords("UnknownCity")
 
@@ -92,7 +110,7 @@ def test_get_coords_api_http_error(mocker):
     """
     mock_response = Mock()
     mock_response.raise_for_status.side_effect = requests.HTTPError("404 Client Error")
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     with pytest.raises(requests.HTTPError):
         get_coords("London")
 
@@ -103,12 +121,12 @@ def test_get_coords_api_timeout(mocker):
     does not respond within the specified timeout.
 
     The test uses a mock object to simulate a timeout by setting the
-    side_effect of the mocked requests.get method to raise a Timeout exception.
+    side_effect of the mocked upstream.get function to raise a Timeout exception.
     The function call is then wrapped in a pytest.raises context manager to
     verify that the appropriate exception is raised.
     """
 
-    mocker.patch("weather-app.app.requests.get", side_effect=requests.Timeout("Request timed out"))
+    mocker.patch("app.upstream.get", side_effect=requests.Timeout("Request timed out"))
     with pytest.raises(requests.Timeout):
         get_coords("London")
 
@@ -134,7 +152,7 @@ def test_get_coords_with_extra_fields_in_response(mocker):
         "meta": {"info": "extra"}
     }
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     result = get_coords("New York")
     assert result == (40.7128, -74.0060, "New York", "USA")
 
@@ -152,7 +170,7 @@ def test_get_coords_malformed_api_response(mocker):
     # Missing 'results' key
     mock_response.json.return_value = {"unexpected": "data"}
     mock_response.raise_for_status = Mock()
-    mocker.patch("weather-app.app.requests.get", return_value=mock_response)
+    mocker.patch("app.upstream.get", return_value=mock_response)
     with pytest.raises(ValueError, match="City not found"):
         get_coords("London")
 
@@ -161,37 +179,143 @@ def test_get_coords_malformed_api_response(mocker):
     ("hourly", "hourly"),
     ("daily", "daily"),
 ])
-def test_cached_fetch_weather_forecast_type_variation(mocker, forecast_type, expected_key):
+def test_cached_weather_entry_forecast_type_variation(mocker, forecast_type, expected_key):
     """
-    Test that the cached_fetch_weather function correctly handles different
+    Test that the cached forecast lookup correctly handles different
     forecast_type parameter values by verifying that the underlying
     fetch_weather function is called with the correct argument and that the
     result is cached correctly.
     """
     mock_result = {expected_key: {"some": "data"}}
     mock_fetch = mocker.patch("app.fetch_weather", return_value=mock_result)
-    result = cached_fetch_weather(10.0, 20.0, "celsius", forecast_type)
-    mock_fetch.assert_called_once_with(10.0, 20.0, "celsius", forecast_type)
+    result = fetch_cached(10.0, 20.0, "celsius", forecast_type)
+    mock_fetch.assert_called_once_with(10.0, 20.0, forecast_type)
     assert result == mock_result
 
 @pytest.mark.parametrize("units", ["celsius", "fahrenheit"])
-def test_cached_fetch_weather_units_handling(mocker, units):
+def test_cached_weather_entry_units_handling(mocker, units):
     """
-    Test that the cached_fetch_weather function correctly handles different
+    Test that the cached forecast lookup correctly handles different
     units parameter values by verifying that the underlying fetch_weather
-    function is called with the correct units and that the result is as
-    expected.
+    function is called without units (forecasts are fetched in canonical
+    units) and that the result is as expected.
     """
 
     mock_result = {"units": units}
     mock_fetch = mocker.patch("app.fetch_weather", return_value=mock_result)
-    result = cached_fetch_weather(10.0, 20.0, units, "hourly")
-    mock_fetch.assert_called_once_with(10.0, 20.0, units, "hourly")
+    result = fetch_cached(10.0, 20.0, units, "hourly")
+    mock_fetch.assert_called_once_with(10.0, 20.0, "hourly")
     assert result == mock_result
 
-def test_cached_fetch_weather_int_float_equivalence(mocker):
+def test_cached_weather_entry_units_share_entry(mocker):
+    """
+    Test that celsius and fahrenheit requests for one location are served by
+    a single fetch, each converted to its own units, without modifying the
+    cached canonical document.
+    """
+    canonical = {
+        "hourly_units": {"temperature_2m": "°C", "wind_speed_10m": "km/h"},
+        "hourly": {"time": ["2024-01-01T00:00"], "temperature_2m": [20.0], "wind_speed_10m": [16.1]},
+    }
+    mock_fetch = mocker.patch("app.fetch_weather", return_value=canonical)
+    celsius = fetch_cached(10.0, 20.0, "celsius", "hourly")
+    fahrenheit = fetch_cached(10.0, 20.0, "fahrenheit", "hourly")
+    mock_fetch.assert_called_once_with(10.0, 20.0, "hourly")
+    assert celsius["hourly"]["temperature_2m"] == [20.0]
+    assert fahrenheit["hourly"]["temperature_2m"] == [68.0]
+    assert fahrenheit["hourly"]["wind_speed_10m"] == [10.0]
+    assert fahrenheit["hourly_units"] == {"temperature_2m": "°F", "wind_speed_10m": "mp/h"}
+    assert canonical["hourly"]["temperature_2m"] == [20.0]
+
+def test_cached_weather_entry_combined_mode_serves_both_views(mocker):
+    """
+    Test that in the "combined" fetch mode switching between the hourly and
+    daily views costs one upstream fetch, and that each response only carries
+    the requested view.
+    """
+    combined = {
+        "current": {"temperature_2m": 5.0},
+        "hourly_units": {"temperature_2m": "°C"},
+        "hourly": {"time": ["2024-01-01T00:00"], "temperature_2m": [4.0]},
+        "daily_units": {"temperature_2m_max": "°C"},
+        "daily": {"time": ["2024-01-01"], "temperature_2m_max": [7.0]},
+    }
+    mocker.patch("app.FORECAST_FETCH_MODE", "combined")
+    mock_fetch = mocker.patch("app.fetch_weather", return_value=combined)
+    hourly = fetch_cached(10.0, 20.0, "celsius", "hourly")
+    daily = fetch_cached(10.0, 20.0, "celsius", "daily")
+    mock_fetch.assert_called_once_with(10.0, 20.0, "all")
+    assert set(hourly) == {"current", "hourly_units", "hourly"}
+    assert set(daily) == {"current", "daily_units", "daily"}
+    assert daily["daily"]["temperature_2m_max"] == [7.0]
+
+def test_cached_weather_entry_daily_from_cached_hourly(mocker):
+    """
+    Test that a daily view is computed from the location's cached hourly
+    forecast without another upstream fetch when FORECAST_DAILY_FROM_HOURLY
+    is on, that computed variables are converted like the variables they
+    derive from, and that the "derived" fetch mode never fetches the daily
+    view.
+    """
+    mocker.patch("app.FORECAST_DAILY_FROM_HOURLY", True)
+    hourly = {
+        "current": {"time": "2024-01-01T00:00", "temperature_2m": 5.0},
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": {
+            "time": ["2024-01-01T22:00", "2024-01-01T23:00", "2024-01-02T00:00"],
+            "temperature_2m": [4.0, 6.0, -2.0],
+            "relative_humidity_2m": [80, 80, 80],
+        },
+    }
+    mock_fetch = mocker.patch("app.fetch_weather", return_value=hourly)
+    fetch_cached(10.0, 20.0, "celsius", "hourly")
+    daily = fetch_cached(
+        10.0, 20.0, "fahrenheit", "daily", shape=ResponseShape(variables=["temperature_2m_max", "heat_index_max"])
+    )
+    mock_fetch.assert_called_once_with(10.0, 20.0, "hourly")
+    assert set(daily) == {"current", "daily_units", "daily"}
+    assert daily["daily"] == {
+        "time": ["2024-01-01", "2024-01-02"], "temperature_2m_max": [42.8, 28.4], "heat_index_max": [42.8, 28.4],
+    }
+    assert daily["daily_units"] == {"time": "iso8601", "temperature_2m_max": "°F", "heat_index_max": "°F"}
+
+    mocker.patch("app.FORECAST_FETCH_MODE", "derived")
+    fetch_cached(30.0, 40.0, "celsius", "daily")
+    mock_fetch.assert_called_with(30.0, 40.0, "hourly")
+
+def test_cached_weather_entry_daily_fetched_by_default(mocker):
+    """
+    Test that in the default "split" mode a daily view is fetched from
+    upstream even when the location's hourly forecast is cached.
+    """
+    hourly = {
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": {"time": ["2024-01-01T00:00"], "temperature_2m": [4.0]},
+    }
+    daily = {
+        "daily_units": {"time": "iso8601", "temperature_2m_max": "°C"},
+        "daily": {"time": ["2024-01-01"], "temperature_2m_max": [7.0]},
+    }
+    mock_fetch = mocker.patch("app.fetch_weather", side_effect=[hourly, daily])
+    fetch_cached(10.0, 20.0, "celsius", "hourly")
+    result = fetch_cached(10.0, 20.0, "celsius", "daily")
+    assert mock_fetch.call_args_list == [mocker.call(10.0, 20.0, "hourly"), mocker.call(10.0, 20.0, "daily")]
+    assert result["daily"]["temperature_2m_max"] == [7.0]
+
+def test_forecast_params_all_requests_every_section():
+    """
+    Test that the combined forecast type asks for current, hourly and daily
+    variables in a single query.
+    """
+    from app import forecast_params
+    params = forecast_params(10.0, 20.0, "all")
+    assert {"current", "hourly", "daily"} <= set(params)
+    assert "daily" not in forecast_params(10.0, 20.0, "hourly")
+    assert "hourly" not in forecast_params(10.0, 20.0, "daily")
+
+def test_cached_weather_entry_int_float_equivalence(mocker):
     """
-    Test that the cached_fetch_weather function correctly handles int and float
+    Test that the cached forecast lookup correctly handles int and float
     inputs for the latitude and longitude parameters by verifying that the
     underlying fetch_weather function is called with the correct arguments and
     that the result is cached correctly.
@@ -203,51 +327,53 @@ def test_cached_fetch_weather_int_float_equivalence(mocker):
     mock_result = {"weather": "ok"}
     mock_fetch = mocker.patch("app.fetch_weather", return_value=mock_result)
     # First call with float
-    result1 = cached_fetch_weather(10.0, 20.0, "celsius", "hourly")
+    result1 = fetch_cached(10.0, 20.0, "celsius", "hourly")
     # Second call with int (should hit cache, so fetch_weather not called again)
-    result2 = cached_fetch_weather(10, 20, "celsius", "hourly")
+    result2 = fetch_cached(10, 20, "celsius", "hourly")
     assert result1 == result2
     # fetch_weather should only be called once due to cache
-    mock_fetch.assert_called_once_with(10.0, 20.0, "celsius", "hourly")
+    mock_fetch.assert_called_once_with(10.0, 20.0, "hourly")
 
 @pytest.mark.parametrize("lat,lon", [
     ("not_a_number", 20.0),
     (10.0, "not_a_number"),
     ("abc", "xyz"),
 ])
-def test_cached_fetch_weather_non_numeric_lat_lon(mocker, lat, lon):
+def test_serve_weather_non_numeric_lat_lon(mocker, lat, lon):
     # fetch_weather should not be called
     """
-    Test that the cached_fetch_weather function correctly handles non-numeric
-    latitude and longitude inputs by verifying that a ValueError is raised and
-    that the underlying fetch_weather function is not called.
+    Test that serve_weather correctly handles non-numeric latitude and
+    longitude inputs by verifying that a RequestError is raised and that the
+    underlying fetch_weather function is not called.
     """
     
-    mocker.patch("app.fetch_weather")
-    with pytest.raises(ValueError):
-        cached_fetch_weather(lat, lon, "celsius", "hourly")
+    mock_fetch = mocker.patch("app.fetch_weather")
+    with app.app.test_request_context(), pytest.raises(RequestError):
+        app.serve_weather({"lat": lat, "lon": lon})
+    mock_fetch.assert_not_called()
 
 @pytest.mark.parametrize("lat,lon", [
     (None, 20.0),
     (10.0, None),
     (None, None),
 ])
-def test_cached_fetch_weather_none_lat_lon(mocker, lat, lon):
+def test_serve_weather_none_lat_lon(mocker, lat, lon):
     # fetch_weather should not be called
     """
-    Test that the cached_fetch_weather function correctly handles None values for
-    latitude and longitude by verifying that a TypeError is raised and that the
+    Test that serve_weather correctly handles None values for latitude and
+    longitude by verifying that a RequestError is raised and that the
     underlying fetch_weather function is not called.
     """
     
-    mocker.patch("app.fetch_weather")
-    with pytest.raises(TypeError):
-        cached_fetch_weather(lat, lon, "celsius", "hourly")
+    mock_fetch = mocker.patch("app.fetch_weather")
+    with app.app.test_request_context(), pytest.raises(RequestError):
+        app.serve_weather({"lat": lat, "lon": lon})
+    mock_fetch.assert_not_called()
 
-def test_cached_fetch_weather_cache_eviction(mocker):
+def test_cached_weather_entry_cache_eviction(mocker):
     # Patch fetch_weather to return unique results per call
     """
-    Test that the cached_fetch_weather function correctly implements cache eviction
+    Test that the cached forecast lookup correctly implements cache eviction
     by verifying that the oldest cached result is evicted after the cache is full
     and that the underlying fetch_weather function is called again when the
     evicted key is accessed again.
@@ -259,7 +385,7 @@ def test_cached_fetch_weather_cache_eviction(mocker):
     verifies that the call_results contains the re-fetched key.
     """
     call_results = {}
-    def fake_fetch_weather(lat, lon, units, forecast_type):
+    def fake_fetch_weather(lat, lon, forecast_type):
         """
         A fake implementation of fetch_weather that records the inputs in call_results
         and returns a result with the input as the value for the "call" key.
@@ -267,13 +393,12 @@ def test_cached_fetch_weather_cache_eviction(mocker):
         Args:
             lat (float): Latitude
             lon (float): Longitude
-            units (str): Units for temperature and wind speed
             forecast_type (str): Type of weather forecast
 
         Returns:
             dict: A dictionary with a single key "call" containing the input values.
         """
-        key = (lat, lon, units, forecast_type)
+        key = (lat, lon, forecast_type)
         result = {"call": key}
         call_results[key] = result
         return result
@@ -281,13 +406,438 @@ def test_cached_fetch_weather_cache_eviction(mocker):
     mocker.patch("app.fetch_weather", side_effect=fake_fetch_weather)
     # Fill the cache to its maxsize (128)
     for i in range(128):
-        assert cached_fetch_weather(i, i+1, "celsius", "hourly") == {"call": (float(i), float(i+1), "celsius", "hourly")}
+        assert fetch_cached(i - 64, i, "celsius", "hourly") == {"call": [float(i - 64), float(i), "hourly"]}
     # The first inserted key should be evicted after the next unique call
-    assert cached_fetch_weather(999, 1000, "celsius", "hourly") == {"call": (999.0, 1000.0, "celsius", "hourly")}
+    assert fetch_cached(80, 170, "celsius", "hourly") == {"call": [80.0, 170.0, "hourly"]}
     # Now, calling the very first key again should result in a cache miss (fetch_weather called again)
     # To test this, we clear call_results and call again
     call_results.clear()
-    result = cached_fetch_weather(0, 1, "celsius", "hourly")
-    assert result == {"call": (0.0, 1.0, "celsius", "hourly")}
+    result = fetch_cached(-64, 0, "celsius", "hourly")
+    assert result == {"call": [-64.0, 0.0, "hourly"]}
     # The call_results should now contain the re-fetched key
-    assert (0.0, 1.0, "celsius", "hourly") in call_results
\ No newline at end of file
+    assert (-64.0, 0.0, "hourly") in call_results
+def test_api_weather_nearby_coordinates_share_fetch(mocker):
+    """
+    Test that two coordinate requests inside one spatial cell are served by a
+    single upstream fetch for the cell, while each response still reports the
+    caller's own coordinates.
+    """
+    import app
+    mocker.patch.object(app, "spatial_keyer", app.SpatialKeyer("grid", resolution=0.1))
+    mock_fetch = mocker.patch("app.fetch_weather", return_value={"hourly": {}})
+    client = app.app.test_client()
+    first = client.post("/api/weather", json={"lat": 51.50741, "lon": -0.12781})
+    second = client.post("/api/weather", json={"lat": 51.50702, "lon": -0.12745})
+    assert first.status_code == second.status_code == 200
+    mock_fetch.assert_called_once_with(51.5, -0.1, "hourly")
+    assert first.get_json()["coordinates"] == {"lat": 51.50741, "lon": -0.12781}
+    assert second.get_json()["coordinates"] == {"lat": 51.50702, "lon": -0.12745}
+
+def test_api_weather_batch_dedupes_and_uses_one_upstream_call(mocker):
+    """
+    Test that a batch with repeated, nearby and invalid locations fetches
+    each distinct cell once, in a single multi-coordinate upstream call, and
+    reports per-item results and errors in request order.
+    """
+    import app
+    mocker.patch.object(app, "spatial_keyer", app.SpatialKeyer("grid", resolution=0.1))
+    mock_response = mocker.Mock()
+    mock_response.raise_for_status.return_value = None
+    mock_response.json.return_value = [
+        {"latitude": 51.5, "hourly": {"temperature_2m": [1.0]}},
+        {"latitude": 48.9, "hourly": {"temperature_2m": [2.0]}},
+    ]
+    mock_get = mocker.patch("app.upstream.get", return_value=mock_response)
+    client = app.app.test_client()
+    response = client.post("/api/weather/batch", json={"locations": [
+        {"lat": 51.50741, "lon": -0.12781},
+        {"lat": 48.85661, "lon": 2.35222, "units": "fahrenheit"},
+        {"lat": 51.50702, "lon": -0.12745},
+        {"lat": 100, "lon": 0},
+    ]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    mock_get.assert_called_once()
+    params = mock_get.call_args.kwargs["params"]
+    assert (params["latitude"], params["longitude"]) == ("51.5,48.9", "-0.1,2.4")
+    assert results[0]["weather"]["hourly"]["temperature_2m"] == [1.0]
+    assert results[1]["weather"]["hourly"]["temperature_2m"] == [35.6]
+    assert results[2]["coordinates"] == {"lat": 51.50702, "lon": -0.12745}
+    assert results[3] == {"error": "Invalid latitude or longitude range", "status": 400}
+
+def test_api_weather_batch_geocodes_concurrently(mocker):
+    """
+    Test that the cities of a batch missing from the local index are
+    geocoded concurrently, each distinct name once, and that a city that is
+    not found is reported for its own location only.
+    """
+    import threading
+    import app
+    mocker.patch("app.BATCH_FETCH_WORKERS", 3)
+    # Sequential lookups would never get all three through the barrier
+    barrier = threading.Barrier(3, timeout=5)
+
+    def geocode(url, params, timeout):
+        barrier.wait()
+        response = mocker.Mock()
+        response.raise_for_status.return_value = None
+        found = params["name"] != "Atlantis"
+        response.json.return_value = {"results": [
+            {"name": params["name"], "latitude": len(params["name"]), "longitude": 1.0}
+        ]} if found else {}
+        return response
+
+    mock_get = mocker.patch("app.upstream.get", side_effect=geocode)
+    mocker.patch("app.fetch_weather_many", side_effect=lambda cells, forecast_type: [
+        {"hourly": {"temperature_2m": [1.0]}} for _ in cells
+    ])
+    client = app.app.test_client()
+    response = client.post("/api/weather/batch", json={"locations": [
+        {"city": "Oslo"}, {"city": "Atlantis"}, {"city": "Lima"}, {"city": "Oslo"},
+    ]})
+    results = response.get_json()["results"]
+    assert mock_get.call_count == 3
+    assert [r.get("location") for r in results] == ["Oslo", None, "Lima", "Oslo"]
+    assert results[1] == {"error": "City not found", "status": 500}
+
+def test_api_weather_batch_serves_cache_hits(mocker):
+    """
+    Test that batch locations already in the cache are served without an
+    upstream call, and that an empty batch is rejected.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [3.0]}})
+    fetch_cached(10.0, 20.0, "celsius", "hourly")
+    mock_get = mocker.patch("app.upstream.get")
+    client = app.app.test_client()
+    response = client.post("/api/weather/batch", json={"locations": [{"lat": 10, "lon": 20}]})
+    assert response.get_json()["results"][0]["weather"] == {"hourly": {"temperature_2m": [3.0]}}
+    mock_get.assert_not_called()
+    assert client.post("/api/weather/batch", json={"locations": []}).status_code == 400
+
+def test_api_weather_stream_ndjson(mocker):
+    """
+    Test that the streaming mode, requested through the Accept header,
+    returns the response as a meta record followed by one record per time
+    step, and that the rows carry the converted units.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": {"time": ["2024-01-01T00:00", "2024-01-01T01:00"], "temperature_2m": [0.0, 10.0]},
+    })
+    mocker.patch.object(app, "STREAM_ROWS_PER_CHUNK", 1)
+    client = app.app.test_client()
+    response = client.post(
+        "/api/weather",
+        json={"lat": 10, "lon": 20, "units": "fahrenheit"},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.mimetype == "application/x-ndjson"
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r["type"] for r in records] == ["meta", "row", "row", "end"]
+    assert records[0]["weather"] == {"hourly_units": {"time": "iso8601", "temperature_2m": "°F"}}
+    assert records[0]["location"] == "Coordinates"
+    assert records[1] == {"type": "row", "time": "2024-01-01T00:00", "temperature_2m": 32.0}
+
+def test_api_weather_batch_stream(mocker):
+    """
+    Test that a streamed batch emits one indexed record per location, errors
+    included, followed by an end record.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [3.0]}})
+    fetch_cached(10.0, 20.0, "celsius", "hourly")
+    client = app.app.test_client()
+    response = client.post("/api/weather/batch", json={
+        "stream": True, "locations": [{"lat": 10, "lon": 20}, {"lat": "x", "lon": 0}],
+    })
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert records[-1] == {"type": "end", "count": 2}
+    by_index = {r["index"]: r for r in records[:-1]}
+    assert by_index[0]["weather"] == {"hourly": {"temperature_2m": [3.0]}}
+    assert by_index[1]["status"] == 400
+
+def test_api_weather_shaping_slices_cached_entry(mocker):
+    """
+    Test that horizon and variable selection are served from one cached
+    entry without refetching, and that a malformed horizon is a 400 error.
+    """
+    import app
+    times = [f"2024-01-01T{h:02d}:00" for h in range(24)]
+    mock_fetch = mocker.patch("app.fetch_weather", return_value={
+        "current": {"time": "2024-01-01T06:00", "temperature_2m": 1.0, "uv_index": 0.0},
+        "hourly": {"time": times, "temperature_2m": [float(h) for h in range(24)], "uv_index": [0.0] * 24},
+    })
+    client = app.app.test_client()
+    full = client.post("/api/weather", json={"lat": 10, "lon": 20}).get_json()
+    shaped = client.post("/api/weather", json={
+        "lat": 10, "lon": 20, "horizon": 2, "variables": ["temperature_2m"],
+    }).get_json()
+    assert len(full["weather"]["hourly"]["time"]) == 24
+    assert shaped["weather"]["hourly"] == {
+        "time": ["2024-01-01T06:00", "2024-01-01T07:00"], "temperature_2m": [6.0, 7.0],
+    }
+    assert "uv_index" not in shaped["weather"]["current"]
+    mock_fetch.assert_called_once()
+    response = client.post("/api/weather", json={"lat": 10, "lon": 20, "horizon": -1})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "horizon must be a positive integer"}
+
+# Encoded bodies are memoized, compressed on request and revalidated by ETag.
+def test_api_weather_compression_etag_and_memo(mocker):
+    """
+    Test that a repeated request reuses the memoized encoded body, that gzip
+    is applied when accepted, and that If-None-Match gets a 304.
+    """
+    import gzip
+    import app
+    mocker.patch("serialization.RESPONSE_COMPRESSION", ["gzip"])
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [20.5] * 500}})
+    client = app.app.test_client()
+    first = client.post("/api/weather", json={"lat": 10, "lon": 20})
+    second = client.post("/api/weather", json={"lat": 10, "lon": 20}, headers={"Accept-Encoding": "gzip"})
+    assert first.get_json()["weather"]["hourly"]["temperature_2m"][0] == 20.5
+    assert second.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(second.get_data())) == first.get_json()
+    assert app.response_memo.info()["hits"] == 1
+    not_modified = client.post(
+        "/api/weather", json={"lat": 10, "lon": 20}, headers={"If-None-Match": first.headers["ETag"]}
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b""
+
+# Non-canonical GET queries redirect to one canonical URL per request.
+def test_canonical_weather_query():
+    """
+    Test that the canonical query sorts fields, drops defaults and unknown
+    fields, folds city names and rounds coordinates.
+    """
+    from werkzeug.datastructures import MultiDict
+    from app import canonical_weather_query
+    args = MultiDict({"lon": "13.40499", "lat": "52.520008", "units": "celsius", "x": "1",
+                      "variables": "weather_code, temperature_2m,weather_code"})
+    assert canonical_weather_query(args) == "lat=52.52&lon=13.405&variables=temperature_2m%2Cweather_code"
+    args = MultiDict({"city": "  New   York ", "lat": "1", "forecast_type": "daily"})
+    assert canonical_weather_query(args) == "city=new+york&forecast_type=daily"
+    assert canonical_weather_query(MultiDict({"lat": "-0.00001", "lon": "abc"})) == "lat=0&lon=abc"
+
+# GET responses are cacheable and revalidate against the cached entry.
+def test_api_weather_get_caching_headers(mocker):
+    """
+    Test the canonical redirect, Cache-Control from the entry's remaining
+    lifetime, Last-Modified, and 304 responses for If-None-Match and
+    If-Modified-Since.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [20.5, 21.0]}})
+    client = app.app.test_client()
+    redirect = client.get("/api/weather?lon=20&lat=10.00")
+    assert redirect.status_code == 301
+    assert redirect.headers["Location"].endswith("/api/weather?lat=10&lon=20")
+
+    response = client.get("/api/weather?lat=10&lon=20")
+    assert response.status_code == 200
+    assert response.get_json()["weather"]["hourly"]["temperature_2m"] == [20.5, 21.0]
+    control = response.headers["Cache-Control"]
+    max_age = int(control.split("max-age=")[1].split(",")[0])
+    assert control.startswith("public") and 0 < max_age <= app.forecast_cache.ttl_for("hourly")
+    assert "stale-while-revalidate" in control
+    assert "Accept" in response.headers["Vary"]
+    last_modified = response.headers["Last-Modified"]
+
+    by_etag = client.get("/api/weather?lat=10&lon=20", headers={"If-None-Match": response.headers["ETag"]})
+    by_date = client.get("/api/weather?lat=10&lon=20", headers={"If-Modified-Since": last_modified})
+    stale = client.get("/api/weather?lat=10&lon=20", headers={"If-Modified-Since": "Sat, 01 Jan 2000 00:00:00 GMT"})
+    assert by_etag.status_code == by_date.status_code == 304
+    assert "max-age" in by_date.headers["Cache-Control"] and by_date.get_data() == b""
+    assert stale.status_code == 200
+    assert app.fetch_weather.call_count == 1
+
+# GET requests can stream and still revalidate by date.
+def test_api_weather_get_stream(mocker):
+    """
+    Test that a GET request accepting NDJSON streams the forecast with
+    caching headers and answers If-Modified-Since with 304.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"time": ["2024-01-01T00:00"], "temperature_2m": [1.0]}})
+    client = app.app.test_client()
+    headers = {"Accept": "application/x-ndjson"}
+    response = client.get("/api/weather?lat=10&lon=20", headers=headers)
+    records = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [r["type"] for r in records] == ["meta", "row", "end"]
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    headers["If-Modified-Since"] = response.headers["Last-Modified"]
+    assert client.get("/api/weather?lat=10&lon=20", headers=headers).status_code == 304
+
+# An unavailable upstream is reported as 503 with Retry-After.
+def test_api_weather_circuit_open(mocker):
+    """
+    Test that a request that cannot be served because the upstream's
+    circuit breaker is open gets a 503 with a Retry-After header, and that
+    an expired cached forecast is served instead when there is one.
+    """
+    import app
+    from resilience import CircuitOpenError
+    mocker.patch("app.fetch_weather", side_effect=CircuitOpenError("api.open-meteo.com/v1/forecast", 12.3))
+    client = app.app.test_client()
+    response = client.post("/api/weather", json={"lat": 10, "lon": 20})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+
+    key = (*app.spatial_keyer.cell(10, 20), "hourly")
+    key = (float(key[0]), float(key[1]), "hourly")
+    app.forecast_cache.set(key, {"hourly": {"temperature_2m": [3.5]}}, ttl=-1)
+    response = client.post("/api/weather", json={"lat": 10, "lon": 20})
+    assert response.status_code == 200
+    assert response.get_json()["weather"]["hourly"]["temperature_2m"] == [3.5]
+
+# Autocomplete suggestions come from the local index with coordinates.
+def test_api_geocode_suggest(mocker, empty_geocoding_index):
+    """
+    Test that suggestions are ranked by population, carry exact coordinates
+    that /api/weather accepts without a geocoding call, and that a bad
+    limit is a 400 error.
+    """
+    import app
+    from geocoding import Place
+    empty_geocoding_index.add(Place("Springfield", 39.80172, -89.64371, "United States", 114394))
+    empty_geocoding_index.add(Place("Split", 43.50891, 16.43915, "Croatia", 176314))
+    empty_geocoding_index.add(Place("Berlin", 52.52437, 13.41053, "Germany", 3426354))
+    mock_get = mocker.patch("app.upstream.get")
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [1.0]}})
+    client = app.app.test_client()
+
+    response = client.get("/api/geocode/suggest?q=SP&limit=5")
+    assert response.status_code == 200
+    assert "max-age" in response.headers["Cache-Control"]
+    results = response.get_json()["results"]
+    assert [r["name"] for r in results] == ["Split", "Springfield"]
+    assert results[0] == {
+        "name": "Split", "country": "Croatia", "lat": 43.50891, "lon": 16.43915, "population": 176314,
+    }
+    assert client.get("/api/geocode/suggest?q=sp&limit=1").get_json()["results"][0]["name"] == "Split"
+    assert client.get("/api/geocode/suggest?q=").get_json()["results"] == []
+    assert client.get("/api/geocode/suggest?q=sp&limit=0").status_code == 400
+
+    weather = client.post("/api/weather", json={"lat": results[0]["lat"], "lon": results[0]["lon"]})
+    assert weather.status_code == 200
+    mock_get.assert_not_called()
+
+# Admission control: rate limits answer 429, a full upstream budget 503.
+def test_api_weather_admission_control(mocker):
+    """
+    Test that a client over its rate limit gets a JSON 429 with Retry-After,
+    and that when the worker's upstream budget is used up a miss gets a 503
+    with Retry-After while a cached forecast is still served.
+    """
+    import app
+    from resilience import UpstreamBusyError
+    client = app.app.test_client()
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [1.0]}})
+    assert client.post("/api/weather", json={"lat": 10, "lon": 20}).status_code == 200
+
+    mocker.patch("app.fetch_weather", side_effect=UpstreamBusyError("api.open-meteo.com/v1/forecast", 1))
+    busy = client.post("/api/weather", json={"lat": -10, "lon": -20})
+    assert busy.status_code == 503
+    assert busy.headers["Retry-After"] == "1"
+    assert client.post("/api/weather", json={"lat": 10, "lon": 20}).status_code == 200
+
+    app.limiter.reset()
+    limit = int(app.RATE_LIMIT_PER_CLIENT.split(" per ")[0])
+    statuses = [client.get("/api/weather?lat=10&lon=20").status_code for _ in range(limit + 1)]
+    assert statuses == [200] * limit + [429]
+    response = client.post("/api/weather", json={"lat": 10, "lon": 20})
+    assert response.status_code == 429
+    assert response.get_json()["error"].startswith("Rate limit exceeded")
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/metrics").status_code == 200
+
+# A batch costs one request per location; rejected requests cost nothing.
+def test_rate_limits_charge_admitted_requests_per_location(mocker):
+    """
+    Test that a batch uses up one request of the client's budget per
+    location, that a batch larger than the budget is a 400, and that a
+    request rejected by the global limit leaves the client's budget alone.
+    """
+    import app
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [1.0]}})
+    mocker.patch("app.fetch_weather_many", side_effect=lambda cells, forecast_type: [
+        {"hourly": {"temperature_2m": [1.0]}} for _ in cells
+    ])
+    client = app.app.test_client()
+    limit = int(app.RATE_LIMIT_PER_CLIENT.split(" per ")[0])
+    too_many = client.post("/api/weather/batch", json={"locations": [{"lat": 10, "lon": 20}] * (limit + 1)})
+    assert too_many.status_code == 400
+    assert too_many.get_json()["error"] == f"At most {limit} locations per batch"
+    app.limiter.reset()
+    batch = client.post("/api/weather/batch", json={"locations": [{"lat": 10, "lon": i} for i in range(limit - 1)]})
+    assert batch.status_code == 200
+    assert client.get("/api/weather?lat=10&lon=20").status_code == 200
+    assert client.get("/api/weather?lat=10&lon=20").status_code == 429
+
+    mocker.patch("app.RATE_LIMIT_GLOBAL", "1 per minute")
+    assert app.hit_rate_limits("a", "2 per minute", "weather") is None
+    assert app.hit_rate_limits("a", "2 per minute", "weather") >= 1
+    mocker.patch("app.RATE_LIMIT_GLOBAL", "")
+    assert app.hit_rate_limits("a", "2 per minute", "weather") is None
+    assert app.hit_rate_limits("a", "2 per minute", "weather") >= 1
+
+# Fetched forecasts are archived and served back by /api/archive.
+def test_api_archive(mocker, tmp_path):
+    """
+    Test that every forecast fetched from upstream is queued and appended
+    to the archive, that /api/archive returns each archived forecast or the
+    latest value per time in the requested units, that bad parameters are
+    400 errors and that a disabled archive is a 404.
+    """
+    import app
+    from archive import ForecastArchive
+    mocker.patch("app.forecast_archive", ForecastArchive(str(tmp_path)))
+    forecasts = [
+        {
+            "utc_offset_seconds": 3600,
+            "current": {"time": "2024-05-01T00:00", "interval": 900, "temperature_2m": 10.0},
+            "hourly": {"time": ["2024-05-01T00:00", "2024-05-01T01:00"], "temperature_2m": [10.0, 11.0]},
+        },
+        {
+            "utc_offset_seconds": 3600,
+            "current": {"time": "2024-05-01T01:00", "interval": 900, "temperature_2m": 20.0},
+            "hourly": {"time": ["2024-05-01T01:00", "2024-05-01T02:00"], "temperature_2m": [20.0, 21.0]},
+        },
+    ]
+    mock_fetch = mocker.patch("app.fetch_weather", side_effect=forecasts)
+    client = app.app.test_client()
+    assert client.post("/api/weather", json={"lat": 10, "lon": 20}).status_code == 200
+    app.forecast_cache.clear()
+    assert client.post("/api/weather", json={"lat": 10, "lon": 20}).status_code == 200
+    assert mock_fetch.call_count == 2
+    app.forecast_archive.flush()
+    assert app.forecast_archive.info()["hourly"]["forecasts"] == 2
+
+    runs = client.get("/api/archive?lat=10&lon=20&start=2024-05-01T01:00").get_json()["runs"]
+    assert [run["hourly"] for run in runs] == [
+        {"time": ["2024-05-01T01:00"], "temperature_2m": [11.0]},
+        {"time": ["2024-05-01T01:00", "2024-05-01T02:00"], "temperature_2m": [20.0, 21.0]},
+    ]
+    assert runs[0]["utc_offset_seconds"] == 3600
+    assert runs[0]["issued"].endswith("Z")
+
+    latest = client.get("/api/archive?lat=10&lon=20&view=latest&units=fahrenheit").get_json()
+    assert latest["series"] == {
+        "time": ["2024-05-01T00:00", "2024-05-01T01:00", "2024-05-01T02:00"],
+        "temperature_2m": [50.0, 68.0, 69.8],
+    }
+    current = client.get("/api/archive?lat=10&lon=20&section=current").get_json()["runs"]
+    assert [run["current"] for run in current] == [
+        {"time": ["2024-05-01T00:00"], "temperature_2m": [10.0]},
+        {"time": ["2024-05-01T01:00"], "temperature_2m": [20.0]},
+    ]
+    assert client.get("/api/archive?lat=30&lon=40").get_json()["runs"] == []
+    assert client.get("/api/archive?lat=10&lon=20&section=minutely_15").status_code == 400
+    assert client.get("/api/archive?lat=10&lon=20&start=tomorrow").status_code == 400
+    assert client.get("/api/archive?lat=10&lon=20&view=all").status_code == 400
+
+    mocker.patch("app.forecast_archive", None)
+    assert client.get("/api/archive?lat=10&lon=20").status_code == 404
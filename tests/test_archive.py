@@ -0,0 +1,168 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from archive import INDEX_DTYPE, ArchiveError, ArchiveTable, ForecastArchive, decode, latest_values
+from forecast import CompactForecast
+
+
+def _forecast(start, temperatures, codes=None):
+    times = np.datetime64(start, "m") + np.arange(len(temperatures)) * np.timedelta64(1, "h")
+    hourly = {"time": np.datetime_as_string(times, unit="m").tolist(), "temperature_2m": temperatures}
+    if codes is not None:
+        hourly["weather_code"] = codes
+    return CompactForecast({
+        "utc_offset_seconds": 7200,
+        "current": {"time": start, "interval": 900, "temperature_2m": temperatures[0]},
+        "hourly": hourly,
+    })
+
+# Appended forecasts are read back by cell, issue time and local time.
+def test_archive_round_trip(tmp_path):
+    """
+    Test that a query returns each forecast of the cell within the time
+    window, oldest issue first, as views of the mapped files; that a
+    variable first seen in a later forecast reads as gaps before it; and
+    that another instance on the same directory sees the appends.
+    """
+    archive = ForecastArchive(str(tmp_path))
+    assert archive.add((1.0, 2.0), _forecast("2024-05-01T00:00", [10.0, 11.5, None]), issued=100.0) == 4
+    archive.add((3.0, 4.0), _forecast("2024-05-01T00:00", [30.0]), issued=150.0)
+    archive.add((1.0, 2.0), _forecast("2024-05-01T01:00", [12.25, 13.0], codes=[3, 61]), issued=200.0)
+
+    reader = ForecastArchive(str(tmp_path))
+    runs = reader.tables["hourly"].query((1, 2), start=np.datetime64("2024-05-01T01:00"))
+    assert [float(record["issued"]) for record, _, _ in runs] == [100.0, 200.0]
+    record, times, values = runs[0]
+    assert int(record["utc_offset"]) == 7200
+    assert np.datetime_as_string(times).tolist() == ["2024-05-01T01:00", "2024-05-01T02:00"]
+    assert not values["temperature_2m"].flags.owndata
+    assert decode(values["temperature_2m"]) == [11.5, None]
+    assert decode(values["weather_code"]) == [None, None]
+    assert decode(runs[1][2]["weather_code"]) == [3, 61]
+    assert decode(runs[1][2]["temperature_2m"]) == [12.25, 13.0]
+
+    assert len(reader.tables["hourly"].query((1.0, 2.0), issued_from=150.0)) == 1
+    assert reader.tables["hourly"].query((5.0, 6.0)) == []
+    assert reader.info()["hourly"]["rows"] == 6
+    assert reader.info()["current"]["forecasts"] == 3
+
+# The latest view keeps the most recently issued value per time.
+def test_latest_values(tmp_path):
+    """
+    Test that overlapping forecasts merge into one ascending series where
+    the newer forecast wins.
+    """
+    archive = ForecastArchive(str(tmp_path))
+    archive.add((1.0, 2.0), _forecast("2024-05-01T00:00", [10.0, 11.0, 12.0]), issued=100.0)
+    archive.add((1.0, 2.0), _forecast("2024-05-01T01:00", [21.0, 22.0, 23.0]), issued=200.0)
+    times, values = latest_values(archive.tables["hourly"].query((1.0, 2.0)))
+    assert np.datetime_as_string(times).tolist() == [
+        "2024-05-01T00:00", "2024-05-01T01:00", "2024-05-01T02:00", "2024-05-01T03:00",
+    ]
+    assert decode(values["temperature_2m"]) == [10.0, 21.0, 22.0, 23.0]
+
+# Rows of an append that never committed are ignored and overwritten.
+def test_archive_uncommitted_rows(tmp_path):
+    """
+    Test that rows written without an index record, and a torn index
+    record, are invisible to readers and replaced by the next append.
+    """
+    table = ArchiveTable(str(tmp_path))
+    times = np.array(["2024-05-01T00:00"], dtype="datetime64[m]")
+    table.append((1.0, 2.0), 100.0, 0, times, {"temperature_2m": np.array([1.0])})
+    with open(os.path.join(table.path, "temperature_2m.f4"), "ab") as f:
+        f.write(np.array([99.0] * 3, np.float32).tobytes())
+    with open(os.path.join(table.path, "index"), "ab") as f:
+        f.write(b"\x00" * (INDEX_DTYPE.itemsize // 2))
+    assert len(table.query((1.0, 2.0))) == 1
+
+    table.append((1.0, 2.0), 200.0, 0, times, {"temperature_2m": np.array([2.0])})
+    runs = ArchiveTable(str(tmp_path)).query((1.0, 2.0))
+    assert [decode(values["temperature_2m"]) for _, _, values in runs] == [[1.0], [2.0]]
+    assert os.path.getsize(os.path.join(table.path, "temperature_2m.f4")) == 8
+
+# A column file cut short behind the index is repaired, not skipped.
+def test_archive_short_column_files(tmp_path):
+    """
+    Test that a value column shorter than the committed rows is padded
+    with gaps on read, and that a short time column raises ArchiveError.
+    """
+    table = ArchiveTable(str(tmp_path))
+    times = np.array(["2024-05-01T00:00", "2024-05-01T01:00"], dtype="datetime64[m]")
+    table.append((1.0, 2.0), 100.0, 0, times, {"temperature_2m": np.array([1.0, 2.0])})
+    os.truncate(os.path.join(table.path, "temperature_2m.f4"), 6)
+    runs = ArchiveTable(str(tmp_path)).query((1.0, 2.0))
+    assert decode(runs[0][2]["temperature_2m"]) == [1.0, None]
+
+    os.truncate(os.path.join(table.path, "time.i8"), 8)
+    with pytest.raises(ArchiveError):
+        ArchiveTable(str(tmp_path)).query((1.0, 2.0))
+
+# Forecasts are appended by the writer thread while queries run.
+def test_archive_submit_and_concurrent_queries(tmp_path):
+    """
+    Test that submitted forecasts are all appended by the writer thread,
+    that queries running meanwhile only see complete forecasts, and that
+    forecasts beyond a full queue are dropped and counted.
+    """
+    archive = ForecastArchive(str(tmp_path))
+    failures = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            try:
+                for _, times, values in archive.tables["hourly"].query((1.0, 2.0)):
+                    assert len(times) == len(values["temperature_2m"]) == 3
+            except Exception as e:
+                failures.append(e)
+                return
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for number in range(50):
+        assert archive.submit((1.0, 2.0), _forecast("2024-05-01T00:00", [float(number), 1.0, 2.0]))
+    archive.flush()
+    done.set()
+    reader.join()
+    assert failures == []
+    assert archive.info()["hourly"]["forecasts"] == 50
+
+    full = ForecastArchive(str(tmp_path / "full"), queue_size=1)
+    full._thread, full._pid = threading.current_thread(), os.getpid()
+    assert full.submit((1.0, 2.0), _forecast("2024-05-01T00:00", [1.0]))
+    assert not full.submit((1.0, 2.0), _forecast("2024-05-01T00:00", [1.0]))
+    assert full.info()["dropped"] == 1
+
+# A failing append is counted, and the writer thread keeps going.
+def test_archive_writer_survives_errors(tmp_path, mocker):
+    """
+    Test that an append raising something other than OSError is counted in
+    errors without stopping the writer thread, that a dead writer thread is
+    restarted on the next submit, and that flush does not wait on a dead
+    thread.
+    """
+    archive = ForecastArchive(str(tmp_path))
+    add = mocker.patch.object(archive, "add", side_effect=[ValueError("odd column"), 3])
+    assert archive.submit((1.0, 2.0), _forecast("2024-05-01T00:00", [1.0]))
+    assert archive.submit((1.0, 2.0), _forecast("2024-05-01T01:00", [2.0]))
+    assert archive.flush(timeout=5)
+    assert add.call_count == 2
+    assert archive.info()["errors"] == 1
+
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    archive._thread = dead
+    archive._queue.put_nowait(((1.0, 2.0), None, 0.0))
+    assert not archive.flush()
+    archive._queue.get_nowait()
+    archive._queue.task_done()
+    add.side_effect = None
+    assert archive.submit((1.0, 2.0), _forecast("2024-05-01T02:00", [3.0]))
+    assert archive._thread is not dead and archive._thread.is_alive()
+    assert archive.flush(timeout=5)
+    assert add.call_count == 3
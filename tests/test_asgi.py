@@ -0,0 +1,150 @@
+import asyncio
+import json
+
+import httpx
+
+import asgi
+
+
+def _post(payload, upstream_handler, mocker):
+    """
+    POST ``payload`` to the ASGI /api/weather handler with upstream calls
+    answered by ``upstream_handler``.
+
+    :return: Tuple of the httpx.Response and the list of upstream requests
+    """
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return upstream_handler(request)
+
+    async def run():
+        upstream = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        mocker.patch("upstream.default_client.async_client", return_value=upstream)
+        transport = httpx.ASGITransport(app=asgi.application)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/weather", json=payload)
+        await upstream.aclose()
+        return response
+
+    return asyncio.run(run()), seen
+
+# The async handler returns the same document shape as the Flask view.
+def test_async_api_weather_coordinates(mocker):
+    """
+    Test that a coordinate request is answered through the async client and
+    that the response matches the synchronous API format.
+    """
+    mocker.patch("asgi.weather_app.OPEN_METEO_BASE", "http://upstream/v1/forecast")
+    response, seen = _post(
+        {"lat": 52.52, "lon": 13.41, "forecast_type": "daily"},
+        lambda request: httpx.Response(200, json={"daily": {"time": []}}),
+        mocker,
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["weather"] == {"daily": {"time": []}}
+    assert body["coordinates"] == {"lat": 52.52, "lon": 13.41}
+    assert body["forecast_type"] == "daily"
+    assert "upstream;dur=" in response.headers["server-timing"]
+    assert len(seen) == 1
+    assert seen[0].url.params["daily"]
+
+# City names go through the async geocoder before the forecast fetch.
+def test_async_api_weather_city(mocker):
+    """
+    Test that a city missing from the local index is geocoded through the
+    async client and then used for the forecast fetch.
+    """
+    mocker.patch("asgi.weather_app.GEOCODING_API", "http://upstream/v1/search")
+    mocker.patch("asgi.weather_app.OPEN_METEO_BASE", "http://upstream/v1/forecast")
+
+    def upstream(request):
+        if request.url.path == "/v1/search":
+            return httpx.Response(200, json={"results": [
+                {"latitude": 47.8, "longitude": 13.04, "name": "Salzburg", "country": "Austria"}
+            ]})
+        return httpx.Response(200, json={"hourly": {"time": []}})
+
+    response, seen = _post({"city": "Salzburg"}, upstream, mocker)
+    assert response.status_code == 200
+    assert response.json()["location"] == "Salzburg, Austria"
+    assert [r.url.path for r in seen] == ["/v1/search", "/v1/forecast"]
+
+# Validation errors and upstream failures keep their status codes.
+def test_async_api_weather_errors(mocker):
+    """
+    Test that invalid input gives a 400 and upstream errors a 500, both with
+    an "error" key.
+    """
+    response, _ = _post({"lat": 100, "lon": 0}, lambda r: httpx.Response(200), mocker)
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid latitude or longitude range"}
+
+    mocker.patch("asgi.weather_app.OPEN_METEO_BASE", "http://upstream/v1/forecast")
+    response, _ = _post({"lat": 1, "lon": 2}, lambda r: httpx.Response(502), mocker)
+    assert response.status_code == 500
+    assert "error" in response.json()
+
+# Streaming requests get NDJSON records from the async handler too.
+def test_async_api_weather_stream(mocker):
+    """
+    Test that "stream": true answers with a meta record, one row per time
+    step and an end record.
+    """
+    mocker.patch("asgi.weather_app.OPEN_METEO_BASE", "http://upstream/v1/forecast")
+    response, _ = _post(
+        {"lat": 52.52, "lon": 13.41, "stream": True},
+        lambda request: httpx.Response(200, json={"hourly": {
+            "time": ["2024-01-01T00:00", "2024-01-01T01:00"], "temperature_2m": [1.5, 2.5],
+        }}),
+        mocker,
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["type"] for r in records] == ["meta", "row", "row", "end"]
+    assert records[0]["columns"] == ["time", "temperature_2m"]
+    assert records[2] == {"type": "row", "time": "2024-01-01T01:00", "temperature_2m": 2.5}
+
+# Both servers count a client's requests against one rate limit budget.
+def test_async_rate_limits_shared_with_flask(mocker):
+    """
+    Test that requests admitted by the async server use up the client's
+    Flask /api/weather budget, and that the global limit is counted for
+    all clients together.
+    """
+    limit = int(asgi.weather_app.RATE_LIMIT_PER_CLIENT.split(" per ")[0])
+    scope = {"client": ("127.0.0.1", 50000)}
+    assert [asgi.rate_limit_retry_after(scope) for _ in range(limit)] == [None] * limit
+    response = asgi.weather_app.app.test_client().get("/api/weather?lat=10&lon=20")
+    assert response.status_code == 429
+    assert asgi.rate_limit_retry_after(scope) >= 1
+
+    mocker.patch("app.RATE_LIMIT_GLOBAL", "2 per minute")
+    hits = [asgi.weather_app.hit_rate_limits(client, "", "weather") for client in ("a", "b", "c")]
+    assert hits[:2] == [None, None] and hits[2] >= 1
+
+# A failing rate limit store must not fail the request or leak the timer.
+def test_async_rate_limit_store_failure(mocker):
+    """
+    Test that the async server admits requests when the rate limit counter
+    store raises, as the Flask views do, and that every request is counted
+    as finished.
+    """
+    from flask_limiter import Limiter
+    from metrics import requests_in_flight
+    strategy = mocker.Mock()
+    strategy.hit.side_effect = ConnectionError("store unreachable")
+    mocker.patch.object(Limiter, "limiter", property(lambda self: strategy))
+    mocker.patch("asgi.weather_app.OPEN_METEO_BASE", "http://upstream/v1/forecast")
+    in_flight = requests_in_flight.value
+    response, _ = _post({"lat": 52.52, "lon": 13.41}, lambda request: httpx.Response(200, json={}), mocker)
+    assert response.status_code == 200
+    strategy.hit.assert_called()
+    assert requests_in_flight.value == in_flight
+
+    mocker.patch("asgi.rate_limit_retry_after", side_effect=RuntimeError("boom"))
+    response, _ = _post({"lat": 52.52, "lon": 13.41}, lambda request: httpx.Response(200, json={}), mocker)
+    assert response.status_code == 500
+    assert requests_in_flight.value == in_flight
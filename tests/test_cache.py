@@ -0,0 +1,150 @@
+import pytest
+
+from cache import ForecastCache, MemoryBackend, SQLiteBackend, create_backend
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    """
+    Provide each cache backend so every test runs against both.
+    """
+    if request.param == "memory":
+        return MemoryBackend(maxsize=3)
+    return SQLiteBackend(str(tmp_path / "cache.sqlite3"), maxsize=3)
+
+# A stored value is returned until its TTL runs out.
+def test_entry_expires_after_ttl(backend, mocker):
+    """
+    Test that an entry is served while fresh and treated as a miss (and
+    counted as an expiration) once its TTL has elapsed.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(backend)
+    cache.set(("k",), {"v": 1}, ttl=60)
+    assert cache.get(("k",)).value == {"v": 1}
+    clock.return_value = 1061.0
+    assert cache.get(("k",)) is None
+    info = cache.info()
+    assert info["hits"] == 1
+    assert info["misses"] == 1
+    assert info["expirations"] == 1
+    assert info["size"] == 0
+
+# The least recently used entry is evicted when the backend is full.
+def test_lru_eviction_counts(backend):
+    """
+    Test that touching an entry protects it from eviction and that evictions
+    are counted.
+    """
+    cache = ForecastCache(backend)
+    for i in range(3):
+        cache.set((i,), i, ttl=60)
+    assert cache.get((0,)).value == 0
+    cache.set((3,), 3, ttl=60)
+    assert cache.get((1,)) is None
+    assert cache.get((0,)).value == 0
+    assert cache.info()["evictions"] == 1
+
+# get_or_fetch only calls the fetcher on a miss.
+def test_get_or_fetch_calls_fetch_once(backend):
+    """
+    Test that get_or_fetch caches the fetched value.
+    """
+    cache = ForecastCache(backend)
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return {"weather": "ok"}
+
+    assert cache.get_or_fetch(("k",), fetch, ttl=60) == {"weather": "ok"}
+    assert cache.get_or_fetch(("k",), fetch, ttl=60) == {"weather": "ok"}
+    assert len(calls) == 1
+
+# The memory backend honours a byte budget.
+def test_memory_backend_byte_limit():
+    """
+    Test that the memory backend evicts old entries once the total size of
+    stored values exceeds max_bytes.
+    """
+    backend = MemoryBackend(maxsize=None, max_bytes=300)
+    cache = ForecastCache(backend)
+    for i in range(10):
+        cache.set((i,), "x" * 100, ttl=60)
+    assert backend.bytes_used <= 300
+    assert cache.info()["evictions"] == 10 - len(backend)
+
+# Two SQLite backends on one file see each other's entries.
+def test_sqlite_backend_is_shared(tmp_path):
+    """
+    Test that entries written through one SQLite backend instance are visible
+    to another instance opened on the same file, as separate workers would.
+    """
+    path = str(tmp_path / "shared.sqlite3")
+    writer = ForecastCache(SQLiteBackend(path))
+    reader = ForecastCache(SQLiteBackend(path))
+    writer.set((1.0, 2.0, "celsius", "hourly"), {"hourly": [1, 2]}, ttl=60)
+    assert reader.get((1.0, 2.0, "celsius", "hourly")).value == {"hourly": [1, 2]}
+
+# Per-view TTLs can be overridden.
+def test_ttl_for_forecast_type():
+    """
+    Test that ttl_for returns the configured TTL for each forecast view and
+    falls back to the hourly TTL for unknown views.
+    """
+    cache = ForecastCache(ttls={"daily": 42})
+    assert cache.ttl_for("daily") == 42
+    assert cache.ttl_for("current") == 15 * 60
+    assert cache.ttl_for("unknown") == cache.ttl_for("hourly")
+
+# Unknown backend names are rejected.
+def test_create_backend_unknown():
+    """
+    Test that create_backend raises a ValueError for an unknown backend name.
+    """
+    with pytest.raises(ValueError, match="Unknown cache backend"):
+        create_backend("redis")
+
+# Expired entries are served when fetching a replacement fails.
+def test_stale_if_error_fallback(backend, mocker):
+    """
+    Test that an expired entry is kept for the stale_if_error window and
+    returned when the fetch raises, and that the error propagates once the
+    window has passed.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(backend, stale_if_error=300)
+    cache.set(("k",), {"v": 1}, ttl=60)
+
+    def failing_fetch():
+        raise ConnectionError("upstream down")
+
+    clock.return_value = 1100.0
+    assert cache.get_or_fetch(("k",), failing_fetch, 60) == {"v": 1}
+    assert cache.info()["errors_served_stale"] == 1
+    clock.return_value = 1400.0
+    with pytest.raises(ConnectionError):
+        cache.get_or_fetch(("k",), failing_fetch, 60)
+
+# The sqlite backend keeps expired rows for the stale_if_error window.
+def test_sqlite_eviction_keeps_stale_if_error_rows(tmp_path, mocker):
+    """
+    Test that writing other keys, which purges expired rows from the sqlite
+    backend, leaves an expired entry in place for the fallback until the
+    stale_if_error window has passed.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(SQLiteBackend(str(tmp_path / "cache.sqlite3")), stale_if_error=300)
+    cache.set(("k",), {"v": 1}, ttl=60)
+
+    def failing_fetch():
+        raise ConnectionError("upstream down")
+
+    clock.return_value = 1100.0
+    cache.set(("other",), {"v": 2}, ttl=60)
+    assert cache.get_or_fetch(("k",), failing_fetch, 60) == {"v": 1}
+    clock.return_value = 1400.0
+    cache.set(("other",), {"v": 3}, ttl=60)
+    assert len(cache.backend) == 1
+    with pytest.raises(ConnectionError):
+        cache.get_or_fetch(("k",), failing_fetch, 60)
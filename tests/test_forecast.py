@@ -0,0 +1,146 @@
+import json
+import pickle
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from benchmarks.stub_upstream import forecast_payload
+from forecast import CompactForecast, ResponseShape, TimeAxis, compact_forecast, encode_column
+
+
+def _response(forecast_type):
+    params = {
+        "latitude": "51.5", "longitude": "-0.1",
+        "current": "temperature_2m,weather_code",
+        forecast_type: "temperature_2m,weather_code,precipitation_probability",
+    }
+    doc = forecast_payload(params)
+    doc[f"{forecast_type}_units"] = {"time": "iso8601", "temperature_2m": "°C"}
+    return json.loads(json.dumps(doc))
+
+# A response round-trips exactly through the compact form.
+def test_compact_forecast_round_trip():
+    """
+    Test that hourly and daily documents, metadata and current conditions
+    come back unchanged from to_dict.
+    """
+    for forecast_type in ("hourly", "daily"):
+        weather = _response(forecast_type)
+        compact = CompactForecast(weather)
+        assert isinstance(compact.series[forecast_type].time, TimeAxis)
+        assert compact.to_dict() == weather
+        assert pickle.loads(pickle.dumps(compact)).to_dict() == weather
+
+# Columns use typed arrays only where decoding is exact.
+def test_encode_column_types():
+    """
+    Test the column encodings: small ints, floats with gaps, and lists that
+    must stay lists because an array would change their JSON values.
+    """
+    assert encode_column([0, 3, 95]).dtype == np.int8
+    assert encode_column([1.5, None]).dtype == np.float64
+    assert encode_column([1, 2.5]) == [1, 2.5]
+    assert encode_column([True, False]) == [True, False]
+    assert encode_column(["a", "b"]) == ["a", "b"]
+    weather = {"hourly": {"time": ["2024-01-01T00:00", "2024-01-01T01:00"], "rain": [0.5, None]}}
+    assert CompactForecast(weather).to_dict() == weather
+
+# Irregular time axes are kept as strings.
+def test_irregular_time_kept():
+    """
+    Test that unevenly spaced or unparseable times are stored as given.
+    """
+    assert TimeAxis.encode(["2024-01-01T00:00", "2024-01-01T01:00", "2024-01-01T03:00"]) is None
+    assert TimeAxis.encode(["tomorrow", "later"]) is None
+    weather = {"daily": {"time": ["2024-01-01", "2024-01-03", "2024-01-04"], "x": [1, 2, 3]}}
+    assert CompactForecast(weather).to_dict() == weather
+
+# Excluded sections are left out without being decoded.
+def test_to_dict_exclude_and_passthrough():
+    """
+    Test that to_dict can leave out a view and that non-dict values are not
+    compacted.
+    """
+    weather = _response("hourly")
+    weather["daily"] = {"time": ["2024-01-01", "2024-01-02"], "uv_index_max": [1.0, 2.0]}
+    result = CompactForecast(weather).to_dict(exclude=("hourly", "hourly_units"))
+    assert set(result) == set(weather) - {"hourly", "hourly_units"}
+    assert compact_forecast("not a forecast") == "not a forecast"
+
+# The compact form takes far less memory than the decoded JSON.
+def test_compact_forecast_is_smaller():
+    """
+    Test that a cached hourly forecast in compact form retains well under
+    half the heap memory of the plain decoded document.
+    """
+    body = json.dumps(_response("hourly"))
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        plain = [json.loads(body) for _ in range(20)]
+        plain_bytes = tracemalloc.get_traced_memory()[0] - before
+        before = tracemalloc.get_traced_memory()[0]
+        compact = [CompactForecast(json.loads(body)) for _ in range(20)]
+        compact_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(plain) == len(compact)
+    assert compact_bytes < plain_bytes / 2
+
+def _hourly_forecast():
+    times = [f"2024-01-0{1 + h // 24}T{h % 24:02d}:00" for h in range(48)]
+    return CompactForecast({
+        "current": {"time": "2024-01-01T12:15", "interval": 900, "temperature_2m": 5.0, "weather_code": 3},
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C", "weather_code": "wmo code"},
+        "hourly": {"time": times, "temperature_2m": [float(h) for h in range(48)], "weather_code": [1] * 48},
+    })
+
+# A horizon counts from the location's current time step.
+def test_shape_horizon_from_current_time():
+    """
+    Test that a horizon without a start begins at the step containing the
+    location's current time and only decodes the selected steps.
+    """
+    hourly = _hourly_forecast().to_dict(shape=ResponseShape(horizon=3))["hourly"]
+    assert hourly["time"] == ["2024-01-01T12:00", "2024-01-01T13:00", "2024-01-01T14:00"]
+    assert hourly["temperature_2m"] == [12.0, 13.0, 14.0]
+
+# Start and end select an inclusive window; variables filter every section.
+def test_shape_window_and_variables():
+    """
+    Test an inclusive start/end window combined with a variable selection
+    that also applies to the current conditions and the unit labels.
+    """
+    shape = ResponseShape(start="2024-01-02T22:30", end="2024-01-05", variables="temperature_2m")
+    weather = _hourly_forecast().to_dict(shape=shape)
+    assert weather["hourly"] == {"time": ["2024-01-02T23:00"], "temperature_2m": [47.0]}
+    assert weather["hourly_units"] == {"time": "iso8601", "temperature_2m": "°C"}
+    assert weather["current"] == {"time": "2024-01-01T12:15", "interval": 900, "temperature_2m": 5.0}
+    empty = _hourly_forecast().to_dict(shape=ResponseShape(start="2030-01-01"))["hourly"]
+    assert empty["time"] == [] and empty["temperature_2m"] == []
+
+# Windows work on irregular time axes kept as strings.
+def test_shape_irregular_axis():
+    """
+    Test that start and end also slice a time axis that could not be
+    stored as start plus step.
+    """
+    weather = CompactForecast({"daily": {"time": ["2024-01-01", "2024-01-03", "2024-01-04"], "x": [1, 2, 3]}})
+    daily = weather.to_dict(shape=ResponseShape(start="2024-01-02", end="2024-01-03"))["daily"]
+    assert daily == {"time": ["2024-01-03"], "x": [2]}
+
+# Malformed shaping parameters are rejected.
+@pytest.mark.parametrize("kwargs", [
+    {"horizon": 0},
+    {"horizon": "12"},
+    {"start": "yesterday"},
+    {"end": 1704067200},
+    {"variables": [1, 2]},
+])
+def test_shape_validation(kwargs):
+    """
+    Test that invalid horizon, window and variable values raise ValueError.
+    """
+    with pytest.raises(ValueError):
+        ResponseShape(**kwargs)
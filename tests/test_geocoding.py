@@ -0,0 +1,149 @@
+import os
+
+import pytest
+
+import app
+from geocoding import GeocodingIndex, Place, normalize
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    """
+    Load the bundled gazetteer once for the module.
+    """
+    return GeocodingIndex.load(
+        os.path.join(DATA_DIR, "cities.tsv"), os.path.join(DATA_DIR, "countries.tsv")
+    )
+
+# Normalization ignores case, diacritics and surrounding whitespace.
+@pytest.mark.parametrize("name", ["München", "MUNCHEN", "  munchen ", "MÜNCHEN"])
+def test_normalize_case_and_diacritics(name):
+    """
+    Test that differently cased and accented spellings share one lookup key.
+    """
+    assert normalize(name) == "munchen"
+
+# Exact lookup resolves names and alternate names from the gazetteer.
+@pytest.mark.parametrize("query,expected", [
+    ("london", ("London", "United Kingdom")),
+    ("München", ("Munich", "Germany")),
+    ("sao paulo", ("São Paulo", "Brazil")),
+    ("Bombay", ("Mumbai", "India")),
+])
+def test_lookup_exact(gazetteer, query, expected):
+    """
+    Test that exact lookups find places by name and alternate name,
+    returning the country name rather than its code.
+    """
+    place = gazetteer.lookup(query)
+    assert (place.name, place.country) == expected
+
+# Ambiguous names resolve to the most populous place.
+def test_lookup_prefers_population(gazetteer):
+    """
+    Test that "Paris" resolves to Paris, France rather than Paris, Texas.
+    """
+    assert gazetteer.lookup("Paris").country == "France"
+
+# Prefix lookup returns matches ordered by population.
+def test_prefix_ranked_by_population(gazetteer):
+    """
+    Test that prefix lookups return every matching place, most populous
+    first, and honour the limit.
+    """
+    names = [p.name for p in gazetteer.prefix("san", limit=20)]
+    assert names.index("Santiago") < names.index("San Francisco")
+    assert "São Paulo" not in names
+    assert len(gazetteer.prefix("s", limit=3)) == 3
+    assert gazetteer.prefix("") == []
+
+# Places added at runtime are found by their aliases.
+def test_add_with_alias():
+    """
+    Test that a place added to an empty index can be found by its name, its
+    alias and a prefix of either.
+    """
+    index = GeocodingIndex()
+    index.add(Place("Kraków", 50.06, 19.94, "Poland", 755050), aliases=("Cracow",))
+    assert index.lookup("krakow").name == "Kraków"
+    assert index.lookup("CRACOW").name == "Kraków"
+    assert [p.name for p in index.prefix("cra")] == ["Kraków"]
+    assert len(index) == 1
+
+# Memoized prefix results follow places added afterwards.
+def test_prefix_memo_updated_by_add():
+    """
+    Test that a place added after a prefix was ranked appears in that
+    prefix's results in population order, and that results match an
+    unmemoized ranking.
+    """
+    index = GeocodingIndex()
+    for i in range(30):
+        index.add(Place(f"Town {i}", 0.0, 0.0, "X", 1000 + i))
+    index.warm()
+    assert [p.population for p in index.prefix("t", limit=3)] == [1029, 1028, 1027]
+    index.add(Place("Tiny", 0.0, 0.0, "X", 1))
+    index.add(Place("Toronto", 43.7, -79.4, "Canada", 2731571), aliases=("Tkaronto",))
+    assert [p.name for p in index.prefix("t", limit=2)] == ["Toronto", "Town 29"]
+    assert [p.name for p in index.prefix("tk")] == ["Toronto"]
+    assert "Tiny" not in [p.name for p in index.prefix("t", limit=20)]
+    assert index.prefix("ti") == [p for p in index._rank("ti", 10)]
+
+# get_coords answers from the local index without calling the API.
+def test_get_coords_local_hit(mocker, empty_geocoding_index):
+    """
+    Test that get_coords serves indexed cities without a network request.
+    """
+    empty_geocoding_index.add(Place("London", 51.50853, -0.12574, "United Kingdom", 8961989))
+    mock_get = mocker.patch("app.upstream.get")
+    assert app.get_coords("LONDON") == (51.50853, -0.12574, "London", "United Kingdom")
+    mock_get.assert_not_called()
+
+# A remote answer is written back so the next lookup is local.
+def test_get_coords_writes_back(mocker):
+    """
+    Test that a city resolved through the Geocoding API is added to the index
+    and the second lookup does not hit the network.
+    """
+    mock_response = mocker.Mock()
+    mock_response.json.return_value = {
+        "results": [{"latitude": 47.8, "longitude": 13.04, "name": "Salzburg", "country": "Austria"}]
+    }
+    mock_get = mocker.patch("app.upstream.get", return_value=mock_response)
+    assert app.get_coords("salzburg") == (47.8, 13.04, "Salzburg", "Austria")
+    assert app.get_coords("Salzburg") == (47.8, 13.04, "Salzburg", "Austria")
+    mock_get.assert_called_once()
+
+# Names resolved through the API are user input, so their number is capped.
+def test_geocoded_places_bounded(mocker, empty_geocoding_index):
+    """
+    Test that only the GEOCODED_PLACES_MAXSIZE most recently used API
+    results stay indexed, and that evicting one keeps gazetteer places with
+    the same name and refreshes memoized prefixes.
+    """
+    mocker.patch("app.GEOCODED_PLACES_MAXSIZE", 2)
+    empty_geocoding_index.add(Place("Split", 43.50891, 16.43915, "Croatia", 176314))
+    empty_geocoding_index.warm()
+
+    def resolve(url, params, timeout):
+        response = mocker.Mock()
+        response.json.return_value = {"results": [{"latitude": 1.0, "longitude": 2.0, "name": params["name"].title()}]}
+        return response
+
+    mock_get = mocker.patch("app.upstream.get", side_effect=resolve)
+    app.get_coords("spl")
+    app.get_coords("atlantis")
+    app.get_coords("SPL")
+    app.get_coords("mu")
+    assert mock_get.call_count == 3
+    assert list(app.geocoded_places) == ["spl", "mu"]
+    assert empty_geocoding_index.lookup("atlantis") is None
+    assert [p.name for p in empty_geocoding_index.prefix("a")] == []
+    assert [p.name for p in empty_geocoding_index.prefix("s")] == ["Split", "Spl"]
+    app.remember_geocoded_place("Split", Place("Split", 0.0, 0.0))
+    assert list(app.geocoded_places) == ["mu", "split"]
+    assert empty_geocoding_index.lookup("spl") is None
+    assert [p.country for p in empty_geocoding_index.prefix("sp")] == ["Croatia", ""]
+    assert empty_geocoding_index.lookup("split").country == "Croatia"
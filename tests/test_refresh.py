@@ -0,0 +1,123 @@
+import threading
+
+from cache import ForecastCache
+from refresh import BackgroundRefresher, HotKeys
+
+
+def _wait_for_refreshes(cache, count=1):
+    """
+    Block until the cache has finished ``count`` background refreshes.
+    """
+    for _ in range(200):
+        info = cache.info()
+        if info["refreshes"] + info["refresh_errors"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("background refresh did not finish")
+
+# A stale entry is served at once and refreshed in the background.
+def test_stale_while_revalidate(mocker):
+    """
+    Test that after the TTL a hit returns the stale value without waiting
+    for the fetch, and that the background refresh replaces it.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(stale_ttl=300)
+    values = iter(["v1", "v2"])
+    fetch = lambda: next(values)  # noqa: E731
+    assert cache.get_or_fetch(("k",), fetch, ttl=60) == "v1"
+
+    clock.return_value = 1061.0
+    assert cache.get_or_fetch(("k",), fetch, ttl=60) == "v1"
+    _wait_for_refreshes(cache)
+    assert cache.get_or_fetch(("k",), fetch, ttl=60) == "v2"
+    info = cache.info()
+    assert info["stale_hits"] == 1
+    assert info["refreshes"] == 1
+
+# Past the stale window the entry is a plain miss.
+def test_stale_window_expires(mocker):
+    """
+    Test that once TTL plus stale_ttl has passed the value is refetched in
+    the foreground.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(stale_ttl=300)
+    values = iter(["v1", "v2"])
+    cache.get_or_fetch(("k",), lambda: next(values), ttl=60)
+    clock.return_value = 1361.0
+    assert cache.get_or_fetch(("k",), lambda: next(values), ttl=60) == "v2"
+    assert cache.info()["stale_hits"] == 0
+
+# A failed refresh keeps serving the stale entry.
+def test_failed_refresh_keeps_stale_entry(mocker):
+    """
+    Test that an exception during a background refresh is counted and the
+    stale value stays available.
+    """
+    clock = mocker.patch("cache.time.time", return_value=1000.0)
+    cache = ForecastCache(stale_ttl=300)
+    cache.set(("k",), "v1", ttl=60)
+    clock.return_value = 1100.0
+
+    def failing():
+        raise RuntimeError("upstream down")
+
+    assert cache.get_or_fetch(("k",), failing, ttl=60) == "v1"
+    _wait_for_refreshes(cache)
+    assert cache.info()["refresh_errors"] == 1
+    assert cache.get(("k",)).value == "v1"
+
+# Access frequency decays over time.
+def test_hot_keys_ranking_and_decay(mocker):
+    """
+    Test that frequently accessed keys rank first, that scores decay with
+    the half-life and that min_score filters cold keys.
+    """
+    clock = mocker.patch("refresh.time.time", return_value=0.0)
+    hot = HotKeys(half_life=100)
+    for _ in range(5):
+        hot.touch("popular", None, 60)
+    hot.touch("rare", None, 60)
+    assert [key for key, _, _ in hot.top(2)] == ["popular", "rare"]
+    clock.return_value = 200.0
+    # 5 accesses decayed by two half-lives score 1.25; one access scores 0.25
+    assert [key for key, _, _ in hot.top(2, min_score=1.0)] == ["popular"]
+
+# The hot-key table stays bounded.
+def test_hot_keys_bounded():
+    """
+    Test that the tracker prunes itself when it exceeds maxsize.
+    """
+    hot = HotKeys(maxsize=10)
+    for i in range(25):
+        hot.touch(i, None, 60)
+    assert len(hot) <= 10
+
+# The refresher renews hot entries before they go stale.
+def test_background_refresher_run_once(mocker):
+    """
+    Test that run_once refreshes hot keys whose entries go stale before the
+    next run, and leaves fresh or cold keys alone.
+    """
+    mocker.patch("cache.time.time", return_value=1000.0)
+    mocker.patch("refresh.time.time", return_value=1000.0)
+    cache = ForecastCache(stale_ttl=300)
+    refresher = BackgroundRefresher(cache, top_n=10, interval=60, min_score=2.0)
+    fetched = []
+
+    def fetcher(name):
+        def fetch():
+            fetched.append(name)
+            return name
+        return fetch
+
+    for _ in range(3):
+        cache.get_or_fetch(("soon",), fetcher("soon"), ttl=30)
+        cache.get_or_fetch(("later",), fetcher("later"), ttl=3600)
+    cache.get_or_fetch(("cold",), fetcher("cold"), ttl=30)
+    fetched.clear()
+
+    assert refresher.run_once() == 1
+    _wait_for_refreshes(cache)
+    assert fetched == ["soon"]
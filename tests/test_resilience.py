@@ -0,0 +1,286 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import resilience
+from resilience import (
+    Bulkhead, CircuitBreaker, CircuitOpenError, LatencyTracker, ResilientClient, UpstreamBusyError,
+)
+from upstream import UpstreamClient
+
+
+class FaultInjector:
+    """
+    Faults the stub server applies to the next requests: a queue of
+    statuses to answer with, a delay before answering and the Retry-After
+    of 429 answers.
+    """
+
+    def __init__(self):
+        self.statuses = []
+        self.delay = 0.0
+        self.retry_after = None
+        self.slow_every = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def next(self):
+        with self.lock:
+            self.requests += 1
+            status = self.statuses.pop(0) if self.statuses else 200
+            slow = self.delay if not self.slow_every or self.requests % self.slow_every == 1 else 0.0
+        return status, slow
+
+
+class _FaultyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send headers and body in one segment, avoiding delayed-ACK stalls
+    wbufsize = -1
+
+    def do_GET(self):
+        status, delay = self.server.faults.next()
+        time.sleep(delay)
+        body = b'{"ok": true}'
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429 and self.server.faults.retry_after is not None:
+                self.send_header("Retry-After", self.server.faults.retry_after)
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            # The client gave up (timed out) first
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def faulty_server():
+    """
+    Run a local JSON server whose answers can be delayed or fail on demand.
+    """
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FaultyHandler)
+    httpd.daemon_threads = True
+    httpd.faults = FaultInjector()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/v1/forecast", httpd.faults
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _client(**options):
+    options.setdefault("backoff", 0.001)
+    return ResilientClient(UpstreamClient(), **options)
+
+# Transient upstream errors are retried.
+def test_retries_transient_errors(faulty_server):
+    """
+    Test that 503 answers are retried until one succeeds, and that the last
+    response is returned when every attempt fails.
+    """
+    url, faults = faulty_server
+    client = _client(retries=2)
+    faults.statuses = [503, 503]
+    assert client.get(url).status_code == 200
+    faults.statuses = [503, 503, 503]
+    assert client.get(url).status_code == 503
+    stats = client.stats()["127.0.0.1:%s/v1/forecast" % url.split(":")[2].split("/")[0]]
+    assert stats["attempts"] == 6 and stats["retries"] == 4 and stats["failures"] == 1
+
+# Retries never outlast the caller's timeout.
+def test_retries_within_caller_timeout(faulty_server, monkeypatch):
+    """
+    Test that a call to a stalled upstream gives up after the caller's
+    timeout instead of retrying with a full timeout each time, and that a
+    429 is retried after its Retry-After only if that fits in the timeout.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_TIMEOUT_MIN", 0.05)
+    url, faults = faulty_server
+    client = _client(retries=2, backoff=0.1, adaptive_timeout=False)
+    faults.delay = 1.0
+    start = time.perf_counter()
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get(url, timeout=0.3)
+    assert time.perf_counter() - start < 0.6
+    assert faults.requests == 1
+
+    faults.delay = 0.0
+    faults.requests = 0
+    faults.retry_after = "0"
+    faults.statuses = [429]
+    assert client.get(url, timeout=2).status_code == 200
+    assert faults.requests == 2
+    faults.retry_after = "30"
+    faults.statuses = [429]
+    start = time.perf_counter()
+    assert client.get(url, timeout=2).status_code == 429
+    assert time.perf_counter() - start < 1
+    assert faults.requests == 3
+    assert resilience.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert resilience.retry_after_seconds("soon") is None
+
+# The circuit breaker fails fast, then probes the upstream again.
+def test_circuit_breaker_opens_and_recovers(faulty_server):
+    """
+    Test that consecutive failed calls open the breaker so further calls
+    raise CircuitOpenError without reaching the upstream, and that a
+    successful probe after the reset timeout closes it.
+    """
+    url, faults = faulty_server
+    client = _client(retries=0, breaker_failures=3, breaker_reset=0.2)
+    faults.statuses = [500] * 3
+    for _ in range(3):
+        client.get(url)
+    with pytest.raises(CircuitOpenError) as error:
+        client.get(url)
+    assert 0 < error.value.retry_after <= 0.2
+    assert faults.requests == 3
+    time.sleep(0.25)
+    assert client.get(url).status_code == 200
+    assert client.endpoint(url).breaker.state == "closed"
+
+# Timeouts adapt to the observed latency.
+def test_adaptive_timeout(faulty_server, monkeypatch):
+    """
+    Test that once enough fast calls were observed, a call to a stalled
+    upstream times out after a multiple of the observed latency instead of
+    the caller's full timeout.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_TIMEOUT_MIN", 0.05)
+    url, faults = faulty_server
+    client = _client(retries=0)
+    endpoint = client.endpoint(url)
+    assert client.timeout_for(endpoint, 5) == 5
+    for _ in range(resilience.LATENCY_MIN_SAMPLES):
+        client.get(url, timeout=5)
+    assert client.timeout_for(endpoint, 5) < 1
+    faults.delay = 2.0
+    start = time.perf_counter()
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get(url, timeout=5)
+    assert time.perf_counter() - start < 1
+
+# A hedged request answers when the first one is slow.
+def test_hedged_request(faulty_server):
+    """
+    Test that a second request is sent after the hedge delay and its answer
+    is used when the first request is slow.
+    """
+    url, faults = faulty_server
+    client = _client(hedge=True)
+    for _ in range(resilience.LATENCY_MIN_SAMPLES):
+        client.get(url)
+    faults.delay = 1.0
+    faults.slow_every = 2
+    faults.requests = 0
+    start = time.perf_counter()
+    assert client.get(url).status_code == 200
+    assert time.perf_counter() - start < 0.5
+    stats = client.endpoint(url).info()
+    assert stats["hedges"] == stats["hedge_wins"] == 1
+
+# The async path shares the same policies.
+def test_async_retries_and_breaker(faulty_server):
+    """
+    Test that async calls are retried and trip the breaker like sync calls.
+    """
+    url, faults = faulty_server
+    client = _client(retries=1, breaker_failures=1)
+
+    async def run():
+        try:
+            faults.statuses = [502]
+            first = await client.async_get(url)
+            faults.statuses = [502, 502]
+            second = await client.async_get(url)
+            with pytest.raises(CircuitOpenError):
+                await client.async_get(url)
+            return first.status_code, second.status_code
+        finally:
+            await client.client.aclose()
+
+    assert asyncio.run(run()) == (200, 502)
+
+# Throughput holds up when the upstream stalls.
+def test_throughput_with_stalled_upstream(faulty_server, monkeypatch):
+    """
+    Test that after the upstream starts stalling, calls time out early and
+    then fail fast, so 50 calls finish in a fraction of the time a single
+    call would block with a fixed timeout.
+    """
+    monkeypatch.setattr(resilience, "UPSTREAM_TIMEOUT_MIN", 0.05)
+    url, faults = faulty_server
+    client = _client(retries=1, breaker_failures=3, breaker_reset=60)
+    for _ in range(resilience.LATENCY_MIN_SAMPLES):
+        client.get(url, timeout=10)
+    faults.delay = 10.0
+    start = time.perf_counter()
+    outcomes = []
+    for _ in range(50):
+        try:
+            client.get(url, timeout=10)
+            outcomes.append("ok")
+        except CircuitOpenError:
+            outcomes.append("fast")
+        except requests.exceptions.Timeout:
+            outcomes.append("timeout")
+    assert time.perf_counter() - start < 2
+    assert outcomes.count("timeout") == 3 and outcomes.count("fast") == 47
+
+# Calls beyond the bulkhead's cap are turned away, not queued.
+def test_bulkhead_sheds_excess_calls(faulty_server):
+    """
+    Test that with every slot taken by slow calls a further call fails fast
+    with UpstreamBusyError, and that a freed slot admits the next call.
+    """
+    url, faults = faulty_server
+    client = _client(retries=0, max_concurrency=2, admission_wait=0.05)
+    faults.delay = 0.3
+    slow = [threading.Thread(target=client.get, args=(url,)) for _ in range(2)]
+    for thread in slow:
+        thread.start()
+    time.sleep(0.1)
+    start = time.perf_counter()
+    with pytest.raises(UpstreamBusyError) as error:
+        client.get(url)
+    assert time.perf_counter() - start < 0.2
+    assert error.value.retry_after >= 1
+    for thread in slow:
+        thread.join()
+    faults.delay = 0
+    assert client.get(url).status_code == 200
+    assert client.bulkhead.info() == {"limit": 2, "active": 0, "peak": 2, "rejected": 1}
+    assert client.stats()[client.endpoint(url).name]["shed"] == 1
+
+    bulkhead = Bulkhead(limit=1, wait=0)
+    assert bulkhead.acquire() and not bulkhead.acquire()
+    bulkhead.release()
+    assert bulkhead.acquire()
+    assert Bulkhead(limit=0).acquire()
+
+# Percentiles need a minimum number of samples.
+def test_latency_tracker_and_breaker_units():
+    """
+    Test the latency percentiles and that a half-open breaker lets a single
+    probe through.
+    """
+    tracker = LatencyTracker(window=100, min_samples=10)
+    assert tracker.percentile(50) is None
+    for ms in range(1, 101):
+        tracker.record(ms / 1000)
+    assert tracker.percentile(50) == 0.051 and tracker.percentile(99) == 0.1
+
+    breaker = CircuitBreaker(failures=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
@@ -0,0 +1,77 @@
+import gzip
+import json
+
+import pytest
+
+import serialization
+from serialization import EncodedResponse, ResponseMemo, dumps, negotiate
+
+# Both encoders produce the same compact JSON.
+def test_dumps_matches_stdlib(monkeypatch):
+    """
+    Test that the fast path and the stdlib fallback decode to the same
+    document, and that values orjson rejects fall back to the stdlib.
+    """
+    doc = {"location": "Zürich, Switzerland", "weather": {"hourly": {"t": [1.5, None, -3]}}}
+    fast = dumps(doc)
+    monkeypatch.setattr(serialization, "JSON_ENCODER", "json")
+    assert json.loads(fast) == json.loads(dumps(doc)) == doc
+    monkeypatch.setattr(serialization, "JSON_ENCODER", "auto")
+    assert json.loads(dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
+
+# Content coding negotiation honours preferences and q-values.
+@pytest.mark.parametrize("header,expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip;q=1.0, br;q=0", "gzip"),
+    ("identity", None),
+    ("*", "br"),
+    ("", None),
+])
+def test_negotiate(header, expected):
+    """
+    Test the choice of content coding for typical Accept-Encoding headers.
+    """
+    assert negotiate(header, codings=["br", "gzip"]) == expected
+
+# Compressed variants are built once and tagged per coding.
+def test_encoded_response_variants_and_etag(monkeypatch):
+    """
+    Test that a gzip variant decompresses to the body, is memoized, has its
+    own ETag, and that small bodies are sent uncompressed.
+    """
+    monkeypatch.setattr(serialization, "RESPONSE_COMPRESSION", ["gzip"])
+    encoded = EncodedResponse.of({"values": list(range(1000))})
+    coding, body = encoded.variant("gzip")
+    assert coding == "gzip"
+    assert gzip.decompress(body) == encoded.body
+    assert encoded.variant("gzip")[1] is body
+    assert encoded.etag("gzip") != encoded.etag()
+    assert EncodedResponse.of({"a": 1}).variant("gzip")[0] is None
+
+# If-None-Match with any representation's tag gives a 304.
+def test_encoded_response_conditional():
+    """
+    Test that a matching (possibly weak or coding-specific) ETag yields a
+    304 without a body, and a stale one the full response.
+    """
+    encoded = EncodedResponse.of({"a": 1})
+    status, headers, body = encoded.respond("", f'W/"{encoded.digest}-gzip"')
+    assert (status, body) == (304, b"")
+    assert dict(headers)["ETag"] == encoded.etag()
+    status, headers, body = encoded.respond("", '"stale"')
+    assert (status, body) == (200, encoded.body)
+    assert dict(headers)["Content-Type"] == "application/json"
+
+# The response memo is a bounded LRU.
+def test_response_memo_lru():
+    """
+    Test that the memo evicts its least recently used body and counts hits.
+    """
+    memo = ResponseMemo(maxsize=2)
+    for key in ("a", "b"):
+        memo.set(key, EncodedResponse(b"{}"))
+    assert memo.get("a") is not None
+    memo.set("c", EncodedResponse(b"{}"))
+    assert memo.get("b") is None
+    assert len(memo) == 2
+    assert memo.info()["hits"] == 1
@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+
+import app
+from cache import ForecastCache, SQLiteBackend
+from singleflight import AsyncSingleFlight, SingleFlight
+
+N = 50
+
+
+def _run_concurrently(target, count=N):
+    """
+    Start ``count`` threads that call ``target`` at the same moment and
+    collect their return values.
+    """
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(i):
+        barrier.wait()
+        results[i] = target()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+# N concurrent callers with one key share one call.
+def test_single_flight_deduplicates():
+    """
+    Test that concurrent calls with the same key run the function once and
+    all callers receive its result.
+    """
+    flights = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"weather": "ok"}
+
+    results = _run_concurrently(lambda: flights.do("key", fn))
+    assert len(calls) == 1
+    assert all(result == {"weather": "ok"} for result, _ in results)
+    assert sum(shared for _, shared in results) == N - 1
+
+# Waiters see the leader's exception.
+def test_single_flight_shares_errors():
+    """
+    Test that an exception raised by the in-flight call is raised in every
+    waiting caller, and that the next call runs again.
+    """
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise RuntimeError("upstream down")
+
+    def call():
+        try:
+            flights.do("key", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join()
+    follower.join()
+    assert len(errors) == 2
+    assert flights.do("key", lambda: "recovered") == ("recovered", False)
+
+# Concurrent identical /api/weather misses cause one upstream call.
+def test_cached_weather_entry_concurrent_misses(mocker):
+    """
+    Stress test: N threads requesting the same uncached forecast trigger
+    exactly one fetch_weather call, and the cache reports the coalesced
+    callers.
+    """
+    def slow_fetch(lat, lon, forecast_type):
+        time.sleep(0.2)
+        return {"hourly": {"temperature_2m": [1.0]}}
+
+    mock_fetch = mocker.patch("app.fetch_weather", side_effect=slow_fetch)
+    cell = app.spatial_keyer.cell(51.5, -0.1)
+    results = _run_concurrently(lambda: app.cached_weather_entry(*cell, "hourly"))
+    assert mock_fetch.call_count == 1
+    assert all(entry.value.to_dict() == {"hourly": {"temperature_2m": [1.0]}} for _, entry in results)
+    assert app.forecast_cache.info()["coalesced"] == N - 1
+
+# Workers sharing a SQLite cache wait for the lock holder.
+def test_shared_cache_lock_across_workers(tmp_path):
+    """
+    Test that two caches on one SQLite file, standing in for two worker
+    processes, fetch a missing key only once between them.
+    """
+    path = str(tmp_path / "shared.sqlite3")
+    workers = [ForecastCache(SQLiteBackend(path)), ForecastCache(SQLiteBackend(path))]
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.3)
+        return {"daily": {}}
+
+    counter = iter(range(N))
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            worker = workers[next(counter) % 2]
+        return worker.get_or_fetch(("k",), fetch, ttl=60)
+
+    results = _run_concurrently(call, count=10)
+    assert len(calls) == 1
+    assert all(r == {"daily": {}} for r in results)
+
+# The async variant coalesces coroutines on one loop.
+def test_async_single_flight_deduplicates():
+    """
+    Test that N concurrent coroutines with the same key await one call.
+    """
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(N)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert [r for r, _ in results] == [42] * N
+
+# Failures propagate to every waiting coroutine.
+def test_async_single_flight_shares_errors():
+    """
+    Test that all coroutines waiting on a failing call receive its exception.
+    """
+    flights = AsyncSingleFlight()
+
+    async def fn():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+# Cancelling the first caller does not cancel the shared call.
+def test_async_single_flight_leader_cancelled():
+    """
+    Test that when the coroutine that started a call is cancelled, the
+    coroutines waiting on the same key still receive its result.
+    """
+    flights = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 42
+
+    async def run():
+        leader = asyncio.ensure_future(flights.do("key", fn))
+        await asyncio.sleep(0)
+        followers = [asyncio.ensure_future(flights.do("key", fn)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(*followers)
+        return leader, results
+
+    leader, results = asyncio.run(run())
+    assert leader.cancelled()
+    assert results == [(42, True)] * 3
+    assert len(calls) == 1
@@ -0,0 +1,103 @@
+import time
+
+import app
+from benchmarks.stub_upstream import forecast_payload
+from cache import Entry
+from forecast import CompactForecast
+from geocoding import GeocodingIndex, Place
+from snapshot import SnapshotWriter, read_snapshot, write_snapshot
+
+
+def _forecast():
+    return CompactForecast(forecast_payload({"latitude": "52.5", "longitude": "13.4", "hourly": "temperature_2m"}))
+
+# Entries and places survive a write/read round trip.
+def test_snapshot_round_trip(tmp_path):
+    """
+    Test that forecasts keep their value and timestamps, places their
+    fields, and that the LRU order is preserved.
+    """
+    path = str(tmp_path / "cache.snap")
+    now = time.time()
+    entries = [((52.5, 13.4, "hourly"), Entry(_forecast(), now - 10, now + 600, stale_at=now + 300)),
+               ((48.1, 11.6, "daily"), Entry({"daily": {}}, now - 5, now + 900))]
+    places = [("berlin", Place("Berlin", 52.52, 13.41, "Germany", 3426354))]
+    assert write_snapshot(path, entries, places) > 0
+
+    restored, restored_places = read_snapshot(path)
+    assert [key for key, _ in restored] == [key for key, _ in entries]
+    entry = restored[0][1]
+    assert (entry.created_at, entry.stale_at, entry.expires_at) == (now - 10, now + 300, now + 600)
+    assert entry.value.to_dict() == entries[0][1].value.to_dict()
+    assert entry.size > 0
+    name, place = restored_places[0]
+    assert name == "berlin" and place.as_tuple() == (52.52, 13.41, "Berlin", "Germany")
+
+# Expired entries and unreadable files are skipped.
+def test_snapshot_skips_expired_and_bad_files(tmp_path):
+    """
+    Test that expired forecasts are not loaded, and that a missing, foreign
+    or truncated file yields what could be read without raising.
+    """
+    path = str(tmp_path / "cache.snap")
+    now = time.time()
+    write_snapshot(path, [("old", Entry(1, now - 100, now - 1)), ("new", Entry(2, now, now + 60))])
+    assert [key for key, _ in read_snapshot(path)[0]] == ["new"]
+
+    assert read_snapshot(str(tmp_path / "missing")) == ([], [])
+    (tmp_path / "foreign").write_bytes(b"not a snapshot file")
+    assert read_snapshot(str(tmp_path / "foreign")) == ([], [])
+    with open(path, "rb") as f:
+        data = f.read()
+    (tmp_path / "truncated").write_bytes(data[:-3])
+    assert read_snapshot(str(tmp_path / "truncated")) == ([], [])
+
+# A new worker serves hits from the snapshot of an earlier one.
+def test_restore_snapshot_warms_app(tmp_path, mocker):
+    """
+    Test that a snapshot written from the app's cache and geocoded places is
+    served after a restart without calling the upstream APIs.
+    """
+    mocker.patch("app.fetch_weather", return_value={"hourly": {"temperature_2m": [20.5]}})
+    mocker.patch("app.upstream.get", return_value=mocker.Mock(
+        json=lambda: {"results": [{"name": "Berlin", "latitude": 52.52, "longitude": 13.41, "country": "Germany"}]}
+    ))
+    client = app.app.test_client()
+    first = client.post("/api/weather", json={"city": "Berlin"}).get_json()
+    writer = SnapshotWriter(str(tmp_path / "cache.snap"), app.snapshot_entries, lambda: list(app.geocoded_places.items()))
+    assert writer.run_once() == writer.info()["bytes"] > 0
+
+    app.forecast_cache.clear()
+    mocker.patch("app.geocoding_index", GeocodingIndex())
+    app.fetch_weather.reset_mock()
+    app.upstream.get.reset_mock()
+    assert app.restore_snapshot(writer.path) == (1, 1)
+    assert client.post("/api/weather", json={"city": "Berlin"}).get_json() == first
+    assert not app.fetch_weather.called and not app.upstream.get.called
+
+# Workers sharing a snapshot path merge into it instead of overwriting it.
+def test_snapshot_writers_merge(tmp_path):
+    """
+    Test that two writers on one path keep each other's entries, that the
+    newer entry wins for a key both have, that the merged snapshot keeps
+    the most recently used entries up to the limit, and that a failed
+    write at exit is logged rather than raised.
+    """
+    path = str(tmp_path / "cache.snap")
+    now = time.time()
+    first = SnapshotWriter(path, lambda: [("a", Entry(1, now - 10, now + 60)), ("b", Entry(2, now - 10, now + 60))])
+    second = SnapshotWriter(path, lambda: [("b", Entry(3, now, now + 60)), ("c", Entry(4, now, now + 60))],
+                            max_entries=3)
+    first.run_once()
+    second.run_once()
+    assert [(key, entry.value) for key, entry in read_snapshot(path)[0]] == [("a", 1), ("b", 3), ("c", 4)]
+    first.run_once()
+    assert [(key, entry.value) for key, entry in read_snapshot(path)[0]] == [("c", 4), ("a", 1), ("b", 3)]
+
+    second.max_entries = 2
+    second.run_once()
+    assert [key for key, _ in read_snapshot(path)[0]] == ["b", "c"]
+
+    broken = SnapshotWriter(str(tmp_path / "missing" / "cache.snap"), lambda: [])
+    broken.run_at_exit()
+    assert broken.writes == 0
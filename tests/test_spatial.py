@@ -0,0 +1,62 @@
+import pytest
+
+from spatial import SpatialKeyer, geohash_bounds, geohash_encode
+
+# Nearby coordinates inside one grid cell share a canonical point.
+def test_grid_cell_shared_by_nearby_points():
+    """
+    Test that two points a few metres apart resolve to the same grid cell and
+    that the canonical point is the snapped coordinate.
+    """
+    keyer = SpatialKeyer("grid", resolution=0.1)
+    assert keyer.cell(51.50741, -0.12781) == keyer.cell(51.50702, -0.12745)
+    assert keyer.cell(51.50741, -0.12781) == (51.5, -0.1)
+
+# Grid snapping stays inside the valid coordinate range.
+@pytest.mark.parametrize("lat,lon,expected", [
+    (89.99, 179.99, (90.0, 180.0)),
+    (-89.99, -179.99, (-90.0, -180.0)),
+    (0.04, -0.04, (0.0, -0.0)),
+])
+def test_grid_cell_edges(lat, lon, expected):
+    """
+    Test that grid cells at the poles and the antimeridian stay valid.
+    """
+    assert SpatialKeyer("grid", resolution=0.1).cell(lat, lon) == expected
+
+# Exact mode leaves coordinates untouched.
+def test_exact_mode_passthrough():
+    """
+    Test that the "exact" mode disables bucketing.
+    """
+    assert SpatialKeyer("exact").cell(10, 20.123456789) == (10.0, 20.123456789)
+
+# Geohash encoding matches the reference value and round-trips.
+def test_geohash_encode_and_bounds():
+    """
+    Test geohash encoding against a well-known reference value and check that
+    the decoded cell contains the original point.
+    """
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    lat_min, lat_max, lon_min, lon_max = geohash_bounds("u4pruydqqvj")
+    assert lat_min <= 57.64911 <= lat_max
+    assert lon_min <= 10.40744 <= lon_max
+
+# Geohash mode maps a point to the centre of its cell.
+def test_geohash_mode_cell_centre():
+    """
+    Test that points in one geohash cell resolve to the same cell centre.
+    """
+    keyer = SpatialKeyer("geohash", precision=5)
+    lat, lon = keyer.cell(48.8566, 2.3522)
+    assert keyer.cell(48.8570, 2.3530) == (lat, lon)
+    assert geohash_encode(lat, lon, 5) == geohash_encode(48.8566, 2.3522, 5)
+
+# Invalid configurations are rejected.
+@pytest.mark.parametrize("kwargs", [{"mode": "h3"}, {"mode": "grid", "resolution": 0}])
+def test_invalid_keyer_configuration(kwargs):
+    """
+    Test that unknown modes and non-positive grid resolutions raise ValueError.
+    """
+    with pytest.raises(ValueError):
+        SpatialKeyer(**kwargs)
@@ -0,0 +1,63 @@
+import pytest
+
+from units import canonical_params, convert_array, convert_units, quantity_of, resolve_units
+
+# Variables map to the quantity whose unit they are reported in.
+@pytest.mark.parametrize("variable,quantity", [
+    ("temperature_2m", "temperature"),
+    ("apparent_temperature_max", "temperature"),
+    ("wind_speed_10m_max", "wind_speed"),
+    ("precipitation_sum", "precipitation"),
+    ("precipitation_probability", None),
+    ("wind_direction_10m", None),
+    ("weather_code", None),
+])
+def test_quantity_of(variable, quantity):
+    """
+    Test that unit-bearing variables are recognised and that percentages,
+    directions and codes are left alone.
+    """
+    assert quantity_of(variable) == quantity
+
+# Unit systems, overrides and the upstream query parameters.
+def test_resolve_units_and_canonical_params():
+    """
+    Test the named unit systems, per-quantity overrides, the fallback for an
+    unknown system and the rejection of an unknown override.
+    """
+    assert resolve_units("fahrenheit") == {"temperature": "fahrenheit", "wind_speed": "mph", "precipitation": "mm"}
+    assert resolve_units("celsius", "kn", "inch")["wind_speed"] == "kn"
+    assert resolve_units("kelvin") == resolve_units("celsius")
+    with pytest.raises(ValueError, match="wind_speed_unit"):
+        resolve_units("celsius", wind_speed_unit="furlongs")
+    assert canonical_params() == {"temperature_unit": "celsius", "wind_speed_unit": "kmh", "precipitation_unit": "mm"}
+
+# Whole series are converted with missing values kept.
+def test_convert_array_preserves_missing_values():
+    """
+    Test that a series with gaps converts every number and keeps None.
+    """
+    assert convert_array([0.0, None, -40.0], "temperature", "fahrenheit") == [32.0, None, -40.0]
+    assert convert_array([36.0, 18.0], "wind_speed", "ms") == [10.0, 5.0]
+    assert convert_array([25.4], "precipitation", "inch") == [1.0]
+
+# A whole forecast document is converted, labels included.
+def test_convert_units_document():
+    """
+    Test that current and daily sections and their unit labels are converted
+    while unrelated variables and the input document stay unchanged.
+    """
+    weather = {
+        "latitude": 51.5,
+        "current_units": {"temperature_2m": "°C", "relative_humidity_2m": "%"},
+        "current": {"temperature_2m": 10.0, "relative_humidity_2m": 80},
+        "daily_units": {"precipitation_sum": "mm"},
+        "daily": {"time": ["2024-01-01"], "precipitation_sum": [12.7]},
+    }
+    result = convert_units(weather, resolve_units("fahrenheit", precipitation_unit="inch"))
+    assert result["current"] == {"temperature_2m": 50.0, "relative_humidity_2m": 80}
+    assert result["current_units"] == {"temperature_2m": "°F", "relative_humidity_2m": "%"}
+    assert result["daily"]["precipitation_sum"] == [0.5]
+    assert result["daily_units"]["precipitation_sum"] == "inch"
+    assert weather["current"]["temperature_2m"] == 10.0
+    assert convert_units(weather, resolve_units("celsius")) is weather
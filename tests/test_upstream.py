@@ -0,0 +1,72 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from upstream import UpstreamClient
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = json.dumps({
+            "path": self.path,
+            "accept_encoding": self.headers.get("Accept-Encoding"),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+    Run a keep-alive HTTP/1.1 JSON server on a free local port.
+    """
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _JSONHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+# Sequential requests share one pooled keep-alive connection.
+def test_connection_reuse(server):
+    """
+    Test that repeated GETs to the same host open a single connection and
+    that the statistics report the reuse.
+    """
+    client = UpstreamClient()
+    for i in range(5):
+        resp = client.get(f"{server}/v1/forecast", params={"i": i})
+        assert resp.json()["path"] == f"/v1/forecast?i={i}"
+    stats = client.stats()
+    assert stats["requests"] == 5
+    assert stats["connections_opened"] == 1
+    assert stats["connections_reused"] == 4
+
+# Compressed responses are negotiated.
+def test_accept_encoding_header(server):
+    """
+    Test that requests advertise gzip support to the upstream.
+    """
+    resp = UpstreamClient().get(f"{server}/")
+    assert "gzip" in resp.json()["accept_encoding"]
+
+# Connect and read timeouts are applied separately.
+def test_timeout_tuple():
+    """
+    Test that the read timeout can be overridden per call while the connect
+    timeout never exceeds it.
+    """
+    client = UpstreamClient(connect_timeout=3.05, read_timeout=10)
+    assert client.timeout() == (3.05, 10)
+    assert client.timeout(5) == (3.05, 5)
+    assert client.timeout(1) == (1, 1)
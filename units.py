@@ -0,0 +1,154 @@
+import numpy as np
+
+# Units every forecast is fetched and cached in. Responses are converted
+# from these at request time, so one cache entry serves every unit system.
+# Wind is kept in km/h rather than m/s because upstream values are rounded
+# to one decimal, and 0.1 km/h loses less precision than 0.1 m/s.
+CANONICAL_UNITS = {
+    "temperature": "celsius",
+    "wind_speed": "kmh",
+    "precipitation": "mm",
+}
+
+# Open-Meteo query parameter for each quantity
+UPSTREAM_PARAMS = {
+    "temperature": "temperature_unit",
+    "wind_speed": "wind_speed_unit",
+    "precipitation": "precipitation_unit",
+}
+
+# Named unit systems accepted in the "units" request field
+UNIT_SYSTEMS = {
+    "celsius": {"temperature": "celsius", "wind_speed": "kmh", "precipitation": "mm"},
+    "fahrenheit": {"temperature": "fahrenheit", "wind_speed": "mph", "precipitation": "mm"},
+}
+
+# Conversion from the canonical unit: value * scale + offset, rounded
+CONVERSIONS = {
+    "temperature": {
+        "celsius": (1.0, 0.0, 1, "°C"),
+        "fahrenheit": (1.8, 32.0, 1, "°F"),
+    },
+    "wind_speed": {
+        "kmh": (1.0, 0.0, 1, "km/h"),
+        "ms": (1 / 3.6, 0.0, 1, "m/s"),
+        "mph": (1 / 1.609344, 0.0, 1, "mp/h"),
+        "kn": (1 / 1.852, 0.0, 1, "kn"),
+    },
+    "precipitation": {
+        "mm": (1.0, 0.0, 1, "mm"),
+        "inch": (1 / 25.4, 0.0, 3, "inch"),
+    },
+}
+
+FORECAST_SECTIONS = ("current", "hourly", "daily")
+
+
+def quantity_of(variable):
+    """
+    :param variable: Open-Meteo variable name, e.g. "temperature_2m_max"
+    :return: "temperature", "wind_speed", "precipitation" or None for
+        variables without a configurable unit
+    """
+    if variable.startswith(("temperature", "apparent_temperature", "dew_point", "heat_index", "wind_chill")):
+        return "temperature"
+    if variable.startswith(("wind_speed", "wind_gusts")):
+        return "wind_speed"
+    if variable.startswith("precipitation_probability") or variable == "precipitation_hours":
+        return None
+    if variable.startswith(("precipitation", "rain", "showers")):
+        return "precipitation"
+    return None
+
+
+def resolve_units(units="celsius", wind_speed_unit=None, precipitation_unit=None):
+    """
+    Resolve a unit system name plus optional per-quantity overrides.
+
+    Unknown system names fall back to "celsius", as the API always has.
+
+    :param units: "celsius" or "fahrenheit"
+    :param wind_speed_unit: Optional override: "kmh", "ms", "mph" or "kn"
+    :param precipitation_unit: Optional override: "mm" or "inch"
+    :return: Dict mapping quantity to unit
+    :raises ValueError: if an override names an unknown unit
+    """
+    resolved = dict(UNIT_SYSTEMS.get(units, UNIT_SYSTEMS["celsius"]))
+    for quantity, unit in (("wind_speed", wind_speed_unit), ("precipitation", precipitation_unit)):
+        if unit:
+            if unit not in CONVERSIONS[quantity]:
+                raise ValueError(f"Unsupported {UPSTREAM_PARAMS[quantity]}: {unit}")
+            resolved[quantity] = unit
+    return resolved
+
+
+def canonical_params():
+    """
+    :return: Open-Meteo query parameters requesting the canonical units
+    """
+    return {UPSTREAM_PARAMS[q]: unit for q, unit in CANONICAL_UNITS.items()}
+
+
+def convert_array(values, quantity, unit):
+    """
+    Convert a whole series from the canonical unit in one vectorized step.
+
+    :param values: List of numbers (None for missing values)
+    :param quantity: "temperature", "wind_speed" or "precipitation"
+    :param unit: Target unit
+    :return: List of converted values with None preserved
+    """
+    scale, offset, decimals, _ = CONVERSIONS[quantity][unit]
+    data = np.asarray(values, dtype=float)
+    converted = np.round(data * scale + offset, decimals)
+    missing = np.isnan(data)
+    if missing.any():
+        return np.where(missing, None, converted).tolist()
+    return converted.tolist()
+
+
+def convert_value(value, quantity, unit):
+    """
+    Scalar counterpart of convert_array.
+    """
+    if value is None:
+        return None
+    scale, offset, decimals, _ = CONVERSIONS[quantity][unit]
+    return round(value * scale + offset, decimals)
+
+
+def convert_units(weather, units):
+    """
+    Convert a canonical-unit forecast document to the requested units.
+
+    The cached document is never modified; converted sections are copies.
+
+    :param weather: Forecast document in CANONICAL_UNITS
+    :param units: Dict mapping quantity to unit, from resolve_units
+    :return: Forecast document in the requested units
+    """
+    targets = {q: u for q, u in units.items() if u != CANONICAL_UNITS[q]}
+    if not targets or not isinstance(weather, dict):
+        return weather
+    converted = dict(weather)
+    for section in FORECAST_SECTIONS:
+        data = weather.get(section)
+        if not isinstance(data, dict):
+            continue
+        out = dict(data)
+        labels = dict(weather.get(f"{section}_units") or {})
+        for name, values in data.items():
+            quantity = quantity_of(name)
+            if quantity not in targets:
+                continue
+            unit = targets[quantity]
+            if isinstance(values, list):
+                out[name] = convert_array(values, quantity, unit)
+            elif isinstance(values, (int, float)):
+                out[name] = convert_value(values, quantity, unit)
+            if name in labels:
+                labels[name] = CONVERSIONS[quantity][unit][3]
+        converted[section] = out
+        if f"{section}_units" in weather:
+            converted[f"{section}_units"] = labels
+    return converted
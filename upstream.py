@@ -0,0 +1,224 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from resilience import ResilientClient
+
+# Connection pool and timeout settings for calls to the Open-Meteo APIs.
+UPSTREAM_POOL_CONNECTIONS = int(os.getenv("UPSTREAM_POOL_CONNECTIONS", "4"))
+UPSTREAM_POOL_MAXSIZE = int(os.getenv("UPSTREAM_POOL_MAXSIZE", "32"))
+UPSTREAM_KEEP_ALIVE = os.getenv("UPSTREAM_KEEP_ALIVE", "1") != "0"
+UPSTREAM_KEEP_ALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEP_ALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "3.05"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "10"))
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1") != "0"
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class UpstreamClient:
+    """
+    Pooled, keep-alive HTTP client for the Open-Meteo APIs.
+
+    Each worker process gets one requests.Session (re-created after a fork)
+    whose connection pools are reused by every thread, plus one
+    httpx.AsyncClient per event loop for the async serving mode. Responses
+    are negotiated with every content encoding urllib3 can decode (gzip and
+    deflate, plus brotli/zstd when their packages are installed). The async
+    client speaks HTTP/2 when the ``h2`` package is installed; requests is
+    HTTP/1.1 only.
+    """
+
+    def __init__(
+        self,
+        pool_connections=UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+        keep_alive=UPSTREAM_KEEP_ALIVE,
+        keep_alive_expiry=UPSTREAM_KEEP_ALIVE_EXPIRY,
+        connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout=UPSTREAM_READ_TIMEOUT,
+        http2=UPSTREAM_HTTP2,
+    ):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.keep_alive_expiry = keep_alive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self._session = None
+        self._session_pid = None
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self._counts = {"requests": 0, "async_requests": 0, "http2_responses": 0}
+
+    @property
+    def headers(self):
+        return {
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive" if self.keep_alive else "close",
+        }
+
+    @property
+    def session(self):
+        """
+        The requests.Session for the current worker process.
+        """
+        if self._session is None or self._session_pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._session_pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_connections,
+                        pool_maxsize=self.pool_maxsize,
+                        max_retries=0,
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    session.headers.update(self.headers)
+                    self._session = session
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def timeout(self, read_timeout=None):
+        """
+        :param read_timeout: Read timeout in seconds (defaults to read_timeout)
+        :return: (connect, read) timeout tuple for requests
+        """
+        read = self.read_timeout if read_timeout is None else read_timeout
+        return min(self.connect_timeout, read), read
+
+    def _count(self, field):
+        with self._counts_lock:
+            self._counts[field] += 1
+
+    def get(self, url, params=None, timeout=None):
+        """
+        Send a GET request over the pooled session.
+
+        :param url: Request URL
+        :param params: Query parameters
+        :param timeout: Read timeout in seconds
+        :return: requests.Response
+        :raises requests.exceptions.RequestException: on request errors
+        """
+        self._count("requests")
+        return self.session.get(url, params=params, timeout=self.timeout(timeout))
+
+    def async_client(self):
+        """
+        The httpx.AsyncClient for the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                headers=self.headers,
+                limits=httpx.Limits(
+                    max_connections=self.pool_maxsize,
+                    max_keepalive_connections=self.pool_maxsize if self.keep_alive else 0,
+                    keepalive_expiry=self.keep_alive_expiry,
+                ),
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    async def async_get(self, url, params=None, timeout=None):
+        """
+        Coroutine version of get() on the shared async client.
+
+        :return: httpx.Response
+        :raises httpx.HTTPError: on request errors
+        """
+        self._count("async_requests")
+        read = self.read_timeout if timeout is None else timeout
+        resp = await self.async_client().get(
+            url, params=params, timeout=httpx.Timeout(read, connect=min(self.connect_timeout, read))
+        )
+        if resp.http_version == "HTTP/2":
+            self._count("http2_responses")
+        return resp
+
+    async def aclose(self):
+        """
+        Close the async client of the running event loop, if any.
+        """
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def stats(self):
+        """
+        Connection reuse statistics for this worker.
+
+        ``connections_opened`` counts TCP(+TLS) handshakes made by the sync
+        session; every other sync request reused a pooled connection.
+
+        :return: Dict of counters
+        """
+        with self._counts_lock:
+            data = dict(self._counts)
+        opened = 0
+        pools = 0
+        if self._session is not None and self._session_pid == os.getpid():
+            for adapter in set(self._session.adapters.values()):
+                for key in adapter.poolmanager.pools.keys():
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        pools += 1
+                        opened += pool.num_connections
+        data["connections_opened"] = opened
+        data["connections_reused"] = max(0, data["requests"] - opened)
+        data["pools"] = pools
+        data["http2_enabled"] = self.http2
+        return data
+
+
+default_client = UpstreamClient()
+# Retries, adaptive timeouts, hedging and circuit breaking around it
+resilient_client = ResilientClient(default_client)
+
+
+def get(url, params=None, timeout=None):
+    """
+    GET through the shared default client with the resilience policies of
+    resilient_client. See ResilientClient.get.
+
+    :param timeout: Longest read timeout allowed; the adaptive timeout
+        may be shorter
+    """
+    return resilient_client.get(url, params=params, timeout=timeout)
+
+
+async def async_get(url, params=None, timeout=None):
+    """
+    Async GET through the shared default client with the resilience
+    policies of resilient_client. See ResilientClient.async_get.
+    """
+    return await resilient_client.async_get(url, params=params, timeout=timeout)
+
+
+def stats():
+    """
+    Connection statistics of the shared default client, plus the
+    resilience state of each upstream endpoint and the bulkhead's
+    occupancy.
+    """
+    return dict(
+        default_client.stats(),
+        endpoints=resilient_client.stats(),
+        bulkhead=resilient_client.bulkhead.info(),
+    )